@@ -0,0 +1,211 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from blob_client import AzureBlobDownloader, DEFAULT_BATCH_SIZE
+from blob_url_parser import BlobURLParser
+from graph_api_client import GraphAPIClient
+from polling_policy import PollingPolicy
+from resource_location import ResourceLocationParser
+from secret_manager import SecretsManager
+
+# Number of export requests and polls in flight at once.
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Billing periods exported by the daily jobs, with the currency of the reports.
+DEFAULT_EXPORTS = [('current', 'INR'), ('last', 'INR')]
+
+
+def get_billing_month(billing_period: str, now: Optional[datetime] = None) -> str:
+    """
+    Return the billing month of an unbilled export formatted as "YYYY-MM-01".
+
+    Args:
+        billing_period (str): The billing period, 'current' or 'last'.
+        now (Optional[datetime]): The time the export runs. Defaults to now.
+
+    Returns:
+        str: The first day of the current month, or of the previous one for 'last'.
+    """
+    now = now or datetime.now()
+    year, month = now.year, now.month
+    if billing_period == 'last':
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    elif billing_period != 'current':
+        raise ValueError(f"Unknown billing period {billing_period}.")
+    return f"{year}-{month:02d}-01"
+
+
+class AsyncExportClient:
+    """
+    Runs several unbilled usage exports at once, e.g. the current and last billing period, or several currencies.
+
+    Every export is started right away and polled on its own schedule from the client's polling policy,
+    and each one is handed off as soon as it succeeds, so the total latency is that of the slowest export
+    rather than the sum of all of them.
+    Waiting between polls happens on the event loop with asyncio.sleep. The HTTP calls themselves go
+    through the GraphAPIClient in worker threads, so they keep its token cache, retries and connection pool.
+
+    Attributes:
+        graph_client (GraphAPIClient): The authenticated Graph API client.
+        max_concurrency (int): The maximum number of HTTP calls in flight at once.
+    """
+
+    def __init__(self, graph_client: GraphAPIClient, max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> None:
+        """
+        Initialize the client.
+
+        Args:
+            graph_client (GraphAPIClient): The Graph API client, authenticated with get_access_token.
+            max_concurrency (int): The maximum number of HTTP calls in flight at once.
+        """
+        self.graph_client = graph_client
+        self.max_concurrency = max_concurrency
+
+    async def run_export(self, api_url: str, billing_period: str, currency_code: str = "INR",
+                         semaphore: Optional[asyncio.Semaphore] = None) -> dict:
+        """
+        Start an unbilled export and wait for it to complete.
+
+        Args:
+            api_url (str): The API URL to submit the billing request.
+            billing_period (str): The billing period, e.g. 'current' or 'last'.
+            currency_code (str): The currency of the billing report.
+            semaphore (Optional[asyncio.Semaphore]): Limits the HTTP calls in flight across exports.
+
+        Returns:
+            dict: The final status of the operation, including the resourceLocation.
+
+        Raises:
+            Exception: If the request fails or the operation does not succeed.
+        """
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        start_time = time.perf_counter()
+
+        async with semaphore:
+            headers = await asyncio.to_thread(self.graph_client.initialize_unbilled_request, api_url, billing_period, currency_code)
+        operation_url: Optional[str] = headers.get('Location')
+        if not operation_url:
+            raise Exception(f"Failed to initialize unbilled request for {billing_period} {currency_code}.")
+
+        schedule = self.graph_client.get_poll_schedule(operation_url)
+        while True:
+            async with semaphore:
+                result, retry_after = await asyncio.to_thread(self.graph_client.poll_operation_status, operation_url)
+            if result is not None:
+                break
+            await asyncio.sleep(schedule.next_delay(retry_after))
+
+        if result.get('status') != 'succeeded':
+            raise Exception(f"Export for {billing_period} {currency_code} ended with status {result.get('status')}.")
+        schedule.complete()
+        print(f"Export for {billing_period} {currency_code} succeeded after {time.perf_counter() - start_time:.1f} seconds.")
+        return result
+
+    async def iter_completed_exports(self, api_url: str, exports: List[Tuple[str, str]]) -> AsyncIterator[Tuple[Tuple[str, str], Any]]:
+        """
+        Start every export at once and yield each one as soon as it completes.
+
+        Args:
+            api_url (str): The API URL to submit the billing requests.
+            exports (List[Tuple[str, str]]): The (billing_period, currency_code) pairs to export.
+
+        Yields:
+            Tuple[Tuple[str, str], Any]: The export, and its final status or the exception it raised.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(export: Tuple[str, str]) -> Tuple[Tuple[str, str], Any]:
+            try:
+                return export, await self.run_export(api_url, *export, semaphore=semaphore)
+            except Exception as e:
+                return export, e
+
+        tasks = [asyncio.create_task(run(export)) for export in exports]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def run_exports_async(self, api_url: str, exports: List[Tuple[str, str]],
+                                on_ready: Callable[[Tuple[str, str], dict], Any]) -> Dict[Tuple[str, str], Any]:
+        """
+        Run every export concurrently and call on_ready in a worker thread as soon as each one succeeds.
+
+        Downloads of finished exports overlap with the polling of the others.
+
+        Args:
+            api_url (str): The API URL to submit the billing requests.
+            exports (List[Tuple[str, str]]): The (billing_period, currency_code) pairs to export.
+            on_ready (Callable[[Tuple[str, str], dict], Any]): Called with the export and its final status,
+                e.g. to download and upload the export.
+
+        Returns:
+            Dict[Tuple[str, str], Any]: The value returned by on_ready for every export.
+
+        Raises:
+            Exception: Re-raises the first error raised by an export or by on_ready, once all others have finished.
+        """
+        handoffs = {}
+        errors = []
+        async for export, result in self.iter_completed_exports(api_url, exports):
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            handoffs[export] = asyncio.create_task(asyncio.to_thread(on_ready, export, result))
+
+        results = {}
+        for export, task in handoffs.items():
+            try:
+                results[export] = await task
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        return results
+
+    def run_exports(self, api_url: str, exports: List[Tuple[str, str]],
+                    on_ready: Callable[[Tuple[str, str], dict], Any]) -> Dict[Tuple[str, str], Any]:
+        """
+        Blocking entry point of run_exports_async, for scripts without an event loop.
+        """
+        return asyncio.run(self.run_exports_async(api_url, exports, on_ready))
+
+
+# Test
+
+def main() -> None:
+    """
+    Export the current and last billing period at once and count the records of each as soon as it is ready.
+    """
+    secrets = SecretsManager()
+
+    graph_client = GraphAPIClient(
+        tenant_id=secrets.tenant_id,
+        client_id=secrets.client_id,
+        client_secret=secrets.client_secret,
+        scope=secrets.scope,
+        token_cache_file=secrets.token_cache_file,
+        polling_policy=PollingPolicy(history_file=secrets.polling_history_file)
+    )
+    graph_client.get_access_token()
+
+    def count_records(export: Tuple[str, str], result: dict) -> int:
+        resource_parser = ResourceLocationParser(result.get('resourceLocation'))
+        parsed_location = resource_parser.parse_resource_location()
+        storage_account_name, container_name = BlobURLParser(parsed_location['rootDirectory']).extract_storage_info()
+        downloader = AzureBlobDownloader(storage_account_name, parsed_location['sasToken'], container_name, parsed_location['blobName'],
+                                         billing_month=get_billing_month(export[0]))
+        batches = downloader.iter_record_batches_from_blobs(container_name, resource_parser.parse_blob_names(), batch_size=DEFAULT_BATCH_SIZE)
+        return sum(len(batch) for batch in batches)
+
+    start_time = time.perf_counter()
+    client = AsyncExportClient(graph_client)
+    record_counts = client.run_exports(secrets.unbilled_endpoint, DEFAULT_EXPORTS, count_records)
+    print(f"Record counts: {record_counts}, in {time.perf_counter() - start_time:.1f} seconds.")
+
+
+if __name__ == "__main__":
+    main()
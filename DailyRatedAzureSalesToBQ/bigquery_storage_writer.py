@@ -0,0 +1,264 @@
+import queue
+import threading
+from typing import Iterator, List, Optional
+import pyarrow as pa
+from google.cloud.bigquery_storage_v1 import BigQueryWriteClient, types
+
+# The Storage Write API rejects append requests larger than 10 MB.
+MAX_REQUEST_BYTES = 8 * 1024 * 1024
+
+# Number of append requests queued ahead of the network before append() blocks.
+DEFAULT_MAX_INFLIGHT = 4
+
+
+class BigQueryStorageWriter:
+    """
+    Append Arrow record batches to a BigQuery table through a pending Storage Write API stream.
+
+    Rows sent to a pending stream only become visible when the stream is committed, so a run
+    either lands completely or not at all. Appends are sent by a background thread, which lets
+    the caller keep parsing while earlier batches are on the wire.
+
+    Attributes:
+        write_client: The BigQueryWriteClient, or an object with the same methods.
+        parent (str): The table path the stream writes to.
+        stream_name (str): The name of the open write stream, None before open().
+        row_count (int): The number of rows appended so far.
+    """
+
+    def __init__(self, project_id: str, dataset_id: str, table_id: str, write_client=None,
+                 max_inflight: int = DEFAULT_MAX_INFLIGHT) -> None:
+        """
+        Initialize the writer for a table.
+
+        Args:
+            project_id (str): The Google Cloud project ID.
+            dataset_id (str): The BigQuery dataset ID.
+            table_id (str): The BigQuery table ID.
+            write_client: The write client to use. Defaults to a new BigQueryWriteClient.
+            max_inflight (int): The number of append requests that may be queued before append() blocks.
+        """
+        self.write_client = write_client or BigQueryWriteClient()
+        self.parent = self.write_client.table_path(project_id, dataset_id, table_id)
+        self.max_inflight = max_inflight
+        self.stream_name: Optional[str] = None
+        self.row_count = 0
+        self._schema: Optional[pa.Schema] = None
+        self._requests: Optional[queue.Queue] = None
+        self._sender: Optional[threading.Thread] = None
+        self._error: Optional[Exception] = None
+
+    def open(self, schema: pa.Schema) -> None:
+        """
+        Create a pending write stream and start the background sender.
+
+        Args:
+            schema (pa.Schema): The Arrow schema of the batches that will be appended.
+        """
+        write_stream = self.write_client.create_write_stream(
+            parent=self.parent,
+            write_stream=types.WriteStream(type_=types.WriteStream.Type.PENDING)
+        )
+        self.stream_name = write_stream.name
+        # Dictionary batches cannot be sent on their own, so dictionary columns are sent decoded
+        self._schema = _without_dictionaries(schema)
+        self._requests = queue.Queue(maxsize=self.max_inflight)
+        self._sender = threading.Thread(target=self._send_requests, daemon=True)
+        self._sender.start()
+        print(f"Opened pending write stream {self.stream_name}.")
+
+    def append(self, batch: pa.RecordBatch) -> None:
+        """
+        Queue a record batch for appending, split into requests under the API size limit.
+
+        Args:
+            batch (pa.RecordBatch): The rows to append, in the schema given to open().
+
+        Raises:
+            Exception: If an earlier append failed.
+        """
+        if self._requests is None:
+            raise Exception("Write stream is not open. Call open() first.")
+
+        batch = pa.RecordBatch.from_arrays(
+            [column.cast(field.type) for column, field in zip(batch.columns, self._schema)],
+            schema=self._schema
+        )
+        rows_per_request = max(1, batch.num_rows * MAX_REQUEST_BYTES // max(batch.nbytes, 1))
+        for offset in range(0, batch.num_rows, rows_per_request):
+            rows = batch.slice(offset, rows_per_request)
+            arrow_rows = types.AppendRowsRequest.ArrowData(
+                rows=types.ArrowRecordBatch(serialized_record_batch=rows.serialize().to_pybytes())
+            )
+            if self.row_count == 0:
+                # The writer schema is only required on the first request of the connection
+                arrow_rows.writer_schema = types.ArrowSchema(serialized_schema=self._schema.serialize().to_pybytes())
+            request = types.AppendRowsRequest(write_stream=self.stream_name, offset=self.row_count, arrow_rows=arrow_rows)
+            self._put(request)
+            self.row_count += rows.num_rows
+
+    def commit(self) -> int:
+        """
+        Wait for every append, finalize the stream and commit it, making all rows visible at once.
+
+        Returns:
+            int: The number of rows committed.
+
+        Raises:
+            Exception: If an append failed or the commit reported errors.
+        """
+        self._close_sender()
+        self._raise_if_failed()
+
+        self.write_client.finalize_write_stream(name=self.stream_name)
+        response = self.write_client.batch_commit_write_streams(
+            types.BatchCommitWriteStreamsRequest(parent=self.parent, write_streams=[self.stream_name])
+        )
+        if response.stream_errors:
+            raise Exception(f"Failed to commit write stream {self.stream_name}: {list(response.stream_errors)}")
+
+        print(f"Committed {self.row_count} rows from write stream {self.stream_name}.")
+        return self.row_count
+
+    def abort(self) -> None:
+        """
+        Stop sending and leave the stream uncommitted, so none of its rows become visible.
+        """
+        self._close_sender()
+        print(f"Aborted write stream {self.stream_name}, {self.row_count} rows discarded.")
+
+    def _put(self, request: types.AppendRowsRequest) -> None:
+        # Block while the queue is full, but notice if the sender died in the meantime
+        while True:
+            self._raise_if_failed()
+            try:
+                self._requests.put(request, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _iter_requests(self) -> Iterator[types.AppendRowsRequest]:
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            yield request
+
+    def _send_requests(self) -> None:
+        try:
+            # The raw client does not add the routing header, without which the API rejects the connection
+            metadata = (('x-goog-request-params', f'write_stream={self.stream_name}'),)
+            for response in self.write_client.append_rows(self._iter_requests(), metadata=metadata):
+                if response.error.code:
+                    raise Exception(f"Append to {self.stream_name} failed: {response.error.message}")
+        except Exception as e:
+            self._error = e
+            # Drain the queue so a producer blocked on a full queue notices the error
+            while not self._requests.empty():
+                self._requests.get_nowait()
+
+    def _close_sender(self) -> None:
+        if self._sender is None:
+            return
+        if self._error is None:
+            self._requests.put(None)
+        self._sender.join()
+        self._sender = None
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+
+def _without_dictionaries(schema: pa.Schema) -> pa.Schema:
+    """
+    Return the schema with every dictionary type replaced by its value type.
+    """
+    return pa.schema([
+        field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field
+        for field in schema
+    ])
+
+
+class LocalBigQueryWriteClient:
+    """
+    In-process stand-in for BigQueryWriteClient that keeps appended batches in memory.
+
+    Useful for dry runs and for exercising BigQueryStorageWriter without a Google Cloud project.
+    Rows of a stream are only added to committed_batches when the stream is committed.
+    """
+
+    def __init__(self) -> None:
+        self.pending_batches = {}
+        self.committed_batches: List[pa.RecordBatch] = []
+        self.finalized_streams = set()
+        self._schemas = {}
+
+    @staticmethod
+    def table_path(project: str, dataset: str, table: str) -> str:
+        return f"projects/{project}/datasets/{dataset}/tables/{table}"
+
+    def create_write_stream(self, parent: str, write_stream: types.WriteStream) -> types.WriteStream:
+        name = f"{parent}/streams/local-{len(self.pending_batches)}"
+        self.pending_batches[name] = []
+        return types.WriteStream(name=name, type_=write_stream.type_)
+
+    def append_rows(self, requests: Iterator[types.AppendRowsRequest], metadata=()) -> Iterator[types.AppendRowsResponse]:
+        routing = dict(metadata).get('x-goog-request-params', '')
+        for request in requests:
+            if routing != f"write_stream={request.write_stream}":
+                yield types.AppendRowsResponse(error={"code": 3, "message": f"Missing routing header for {request.write_stream}."})
+                return
+            if request.arrow_rows.writer_schema.serialized_schema:
+                self._schemas[request.write_stream] = pa.ipc.read_schema(pa.py_buffer(request.arrow_rows.writer_schema.serialized_schema))
+            schema = self._schemas[request.write_stream]
+            batch = pa.ipc.read_record_batch(pa.py_buffer(request.arrow_rows.rows.serialized_record_batch), schema)
+            rows = self.pending_batches[request.write_stream]
+            expected_offset = sum(len(rows_batch) for rows_batch in rows)
+            if request.offset != expected_offset:
+                yield types.AppendRowsResponse(error={"code": 11, "message": f"Expected offset {expected_offset}, got {request.offset}."})
+                return
+            rows.append(batch)
+            yield types.AppendRowsResponse(append_result={"offset": request.offset})
+
+    def finalize_write_stream(self, name: str) -> types.FinalizeWriteStreamResponse:
+        self.finalized_streams.add(name)
+        return types.FinalizeWriteStreamResponse(row_count=sum(len(batch) for batch in self.pending_batches[name]))
+
+    def batch_commit_write_streams(self, request: types.BatchCommitWriteStreamsRequest) -> types.BatchCommitWriteStreamsResponse:
+        for name in request.write_streams:
+            if name not in self.finalized_streams:
+                return types.BatchCommitWriteStreamsResponse(stream_errors=[{"entity": name, "error_message": "Stream is not finalized."}])
+        for name in request.write_streams:
+            self.committed_batches.extend(self.pending_batches.pop(name))
+        return types.BatchCommitWriteStreamsResponse()
+
+
+# Test
+
+def main() -> None:
+    """
+    Append a few batches through a local write client and check that they only show up after commit.
+    """
+    schema = pa.schema([("CustomerName", pa.dictionary(pa.int32(), pa.string())), ("BillingPreTaxTotal", pa.float64())])
+    batch = pa.RecordBatch.from_arrays([pa.array(["Contoso", "Fabrikam"]).dictionary_encode(), pa.array([1.5, 2.0])], schema=schema)
+
+    write_client = LocalBigQueryWriteClient()
+
+    aborted_writer = BigQueryStorageWriter("project", "dataset", "table", write_client=write_client)
+    aborted_writer.open(schema)
+    aborted_writer.append(batch)
+    aborted_writer.abort()
+    assert not write_client.committed_batches, "Rows of an aborted stream must not be visible."
+
+    writer = BigQueryStorageWriter("project", "dataset", "table", write_client=write_client)
+    writer.open(schema)
+    for _ in range(3):
+        writer.append(batch)
+    writer.commit()
+    assert sum(len(batch) for batch in write_client.committed_batches) == 6, "All rows must be visible after commit."
+    print("Test Success: rows committed atomically.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,16 @@
 import io
 import json
+import tempfile
+import uuid
+from typing import Iterable, Optional, Union
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from google.cloud import bigquery
-from google.cloud.bigquery import WriteDisposition
+from google.cloud.bigquery import SourceFormat, WriteDisposition
+from arrow_schema import bigquery_schema_to_arrow, table_to_record_batch
+from bigquery_storage_writer import BigQueryStorageWriter
+from row_fingerprint import FingerprintStore, assign_fingerprints, hash_rows
 from secret_manager import SecretsManager
 from blob_client import AzureBlobDownloader
 from blob_url_parser import BlobURLParser
@@ -9,9 +18,16 @@ from resource_location import ResourceLocationParser
 from datetime import datetime
 import os
 
+# Columns the table is clustered on within each billing_month partition.
+CLUSTERING_FIELDS = ["CustomerId", "SubscriptionId", "MeterCategory"]
+
+# Tables with more rows than this are serialized to a temporary file rather than in memory.
+PARQUET_SPOOL_ROWS = 500000
+
 
 class BigQueryUploader:
-    def __init__(self, project_id: str, dataset_id: str, table_id: str) -> None:
+    def __init__(self, project_id: str, dataset_id: str, table_id: str, source_format: str = SourceFormat.PARQUET,
+                 parquet_compression: str = 'zstd') -> None:
         """
         Initialize the BigQueryUploader with the necessary project, dataset, and table details.
 
@@ -19,29 +35,58 @@ class BigQueryUploader:
             project_id (str): The Google Cloud project ID.
             dataset_id (str): The BigQuery dataset ID.
             table_id (str): The BigQuery table ID.
+            source_format (str): How rows are sent to BigQuery, SourceFormat.PARQUET (default) or
+                SourceFormat.NEWLINE_DELIMITED_JSON for the load_table_from_json path.
+            parquet_compression (str): The Parquet compression codec, e.g. 'zstd', 'snappy' or 'gzip'.
         """
+        if source_format not in (SourceFormat.PARQUET, SourceFormat.NEWLINE_DELIMITED_JSON):
+            raise ValueError(f"Unsupported source format '{source_format}'.")
+
         self.project_id = project_id
         self.dataset_id = dataset_id
         self.table_id = table_id
+        self.source_format = source_format
+        self.parquet_compression = parquet_compression
+        self.arrow_schema = self.get_arrow_schema()
+        # Whether the table is partitioned on billing_month, set by create_table_if_not_exists
+        self.is_partitioned: Optional[bool] = None
         self.client = bigquery.Client(project=self.project_id)
         self.table_ref = self.client.dataset(self.dataset_id).table(self.table_id)
 
     def create_table_if_not_exists(self) -> None:
         """
         Create the BigQuery table if it doesn't already exist, using a predefined schema.
+
+        New tables are partitioned by month on billing_month and clustered on CLUSTERING_FIELDS,
+        so a billing month can be replaced atomically without scanning the table.
         """
         schema = self._get_explicit_schema()  # Use the explicit schema
 
         table = bigquery.Table(self.table_ref, schema=schema)
+        table.time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.MONTH,
+            field="billing_month"
+        )
+        table.clustering_fields = CLUSTERING_FIELDS
         try:
-            self.client.get_table(self.table_ref)  # Check if table exists
+            existing_table = self.client.get_table(self.table_ref)  # Check if table exists
             print(f"Table {self.table_id} already exists.")
+            partitioning = existing_table.time_partitioning
+            self.is_partitioned = (
+                partitioning is not None
+                and partitioning.field == "billing_month"
+                and partitioning.type_ == bigquery.TimePartitioningType.MONTH
+            )
+            if not self.is_partitioned:
+                print(f"Table {self.table_id} is not partitioned by month on billing_month, using DELETE + APPEND.")
         except Exception:
             # If the table does not exist, create it
             self.client.create_table(table)
+            self.is_partitioned = True
             print(f"Table {self.table_id} created successfully.")
 
-    def _get_explicit_schema(self) -> list:
+    @staticmethod
+    def _get_explicit_schema() -> list:
         """
         Define the explicit schema with the desired field order.
         
@@ -104,6 +149,16 @@ class BigQueryUploader:
             bigquery.SchemaField("billing_month", "DATE"),
         ]
 
+    @staticmethod
+    def get_arrow_schema() -> pa.Schema:
+        """
+        Derive the Arrow schema of the rows from the explicit BigQuery schema.
+
+        Returns:
+            pa.Schema: The Arrow schema, with repeated STRING columns dictionary encoded.
+        """
+        return bigquery_schema_to_arrow(BigQueryUploader._get_explicit_schema())
+
 
     def upload_data(self, json_data: list) -> None:
         """
@@ -121,20 +176,540 @@ class BigQueryUploader:
         else:
             raise ValueError("No data available to infer the billing month.")
 
-        # Delete rows for the current billing month before uploading
-        self._delete_existing_rows(billing_month)
+        if self.is_partitioned:
+            # Replace the billing month's partition in a single atomic load job
+            load_job = self._load_batch(json_data, WriteDisposition.WRITE_TRUNCATE, self._get_partition_ref(billing_month))
+        else:
+            # Delete rows for the current billing month before uploading
+            self._delete_existing_rows(billing_month)
+            load_job = self._load_batch(json_data, WriteDisposition.WRITE_APPEND)
+        load_job.result()  # Wait for the job to complete
+        print(f"Uploaded {len(json_data)} records to {self.table_id}.")
+
+    def upload_batches(self, batches: Iterable[Union[list, pa.RecordBatch]]) -> None:
+        """
+        Uploads data to BigQuery one batch at a time, so the full export never has to be held in memory.
+
+        On a partitioned table, the batches are written to one temporary file, Parquet or newline-delimited
+        JSON depending on the source format, which replaces the billing month's partition in a single load
+        job, so readers never see a partial month. On an unpartitioned table, rows for the billing month of
+        the first batch are deleted once and every batch is appended.
+
+        Args:
+            batches (Iterable[Union[list, pa.RecordBatch]]): Batches of JSON dictionaries, or Arrow record batches,
+                with billing_month field already included, e.g. from AzureBlobDownloader.iter_record_batches.
+        """
+        self.create_table_if_not_exists()
+
+        if self.is_partitioned:
+            if self.source_format == SourceFormat.PARQUET:
+                self._replace_partition_from_batches(batches)
+            else:
+                self._replace_partition_from_json_batches(batches)
+            return
+
+        record_count = 0
+        for batch in batches:
+            if not len(batch):
+                continue
+            if record_count == 0:
+                # Delete rows for the current billing month before the first append
+                self._delete_existing_rows(self._get_billing_month(batch))
+
+            load_job = self._load_batch(batch, WriteDisposition.WRITE_APPEND)
+            load_job.result()  # Wait for the job to complete
+            record_count += len(batch)
+            print(f"Uploaded batch of {len(batch)} records ({record_count} total) to {self.table_id}.")
+
+        if record_count == 0:
+            raise ValueError("No data available to infer the billing month.")
+
+    def stream_batches(self, batches: Iterable[Union[list, pa.RecordBatch]], write_client=None) -> None:
+        """
+        Streams data to BigQuery through a pending Storage Write API stream while the batches are still being produced.
+
+        Unlike upload_batches, no load job is queued: each batch is appended as soon as it is parsed, and
+        the rows only become visible when the stream is committed after the last batch. If anything fails,
+        the stream is left uncommitted and the table is unchanged.
+
+        The rows are streamed into a staging table, which then replaces the billing month in one step: the
+        partition with a single copy job on a partitioned table, otherwise the month's rows with a DELETE and
+        INSERT in one transaction. The table is only touched once the stream is committed.
+
+        Args:
+            batches (Iterable[Union[list, pa.RecordBatch]]): Batches of JSON dictionaries, or Arrow record batches,
+                with billing_month field already included, e.g. from AzureBlobDownloader.iter_record_batches.
+            write_client: The Storage Write API client, e.g. a LocalBigQueryWriteClient for dry runs.
+                Defaults to a new BigQueryWriteClient.
+        """
+        self.create_table_if_not_exists()
+
+        # The billing month is only known from the first batch, the staging table is unique to this call
+        staging_table_id = self._get_scratch_table_id("staging")
+        staging_ref = self.client.dataset(self.dataset_id).table(staging_table_id)
+        self.client.create_table(bigquery.Table(staging_ref, schema=self._get_explicit_schema()))
+
+        writer = BigQueryStorageWriter(self.project_id, self.dataset_id, staging_table_id, write_client=write_client)
+        billing_month = None
+        try:
+            writer.open(self.arrow_schema)
+            for batch in batches:
+                if not len(batch):
+                    continue
+                if billing_month is None:
+                    billing_month = self._get_billing_month(batch)
+                if not isinstance(batch, pa.RecordBatch):
+                    batch = self._rows_to_table(batch).to_batches()[0]
+                writer.append(batch)
+
+            if billing_month is None:
+                raise ValueError("No data available to infer the billing month.")
+
+            writer.commit()
+        except Exception:
+            writer.abort()
+            self.client.delete_table(staging_ref, not_found_ok=True)
+            raise
+
+        try:
+            if self.is_partitioned:
+                # Replace the billing month's partition with the staged rows in a single copy job
+                copy_job = self.client.copy_table(
+                    staging_ref,
+                    self._get_partition_ref(billing_month),
+                    job_config=bigquery.CopyJobConfig(write_disposition=WriteDisposition.WRITE_TRUNCATE)
+                )
+                copy_job.result()  # Wait for the job to complete
+            else:
+                self._replace_rows_from_staging(staging_table_id, billing_month)
+        finally:
+            self.client.delete_table(staging_ref, not_found_ok=True)
+
+        print(f"Streamed {writer.row_count} records to {self.table_id}.")
+
+    def upload_incremental(self, batches: Iterable[Union[list, pa.RecordBatch]], fingerprint_store: FingerprintStore) -> None:
+        """
+        Uploads only the rows that changed since the previous snapshot of the billing month, as a single MERGE.
+
+        Every row is fingerprinted over FINGERPRINT_FIELDS and the fingerprint is kept in the row_fingerprint
+        column. New and changed rows are inserted, and rows whose fingerprint is gone from the snapshot are
+        deleted, so a changed amount replaces the old row. The fingerprints of the loaded snapshot are then
+        saved in the fingerprint store for the next run.
+
+        If the store has no fingerprints for the billing month, or they no longer match the partition, the
+        partition is replaced in full instead. Tables not partitioned on billing_month fall back to upload_batches.
+
+        Args:
+            batches (Iterable[Union[list, pa.RecordBatch]]): Batches of JSON dictionaries, or Arrow record batches,
+                with billing_month field already included, e.g. from AzureBlobDownloader.iter_record_batches.
+            fingerprint_store (FingerprintStore): The fingerprints of the previously loaded snapshots.
+        """
+        self.create_table_if_not_exists()
+
+        if not self.is_partitioned:
+            print(f"Table {self.table_id} is not partitioned on billing_month, uploading the full snapshot.")
+            self.upload_batches(batches)
+            return
+
+        self._add_fingerprint_column()
+
+        with tempfile.TemporaryFile() as snapshot_file:
+            # The snapshot is spooled to disk because the changed rows are only known once every row is hashed
+            billing_month, row_hashes = self._spool_snapshot(batches, snapshot_file)
+            fingerprints = assign_fingerprints(row_hashes)
+
+            previous_fingerprints = fingerprint_store.load(billing_month)
+            if previous_fingerprints is not None and not self._partition_matches_fingerprints(billing_month, previous_fingerprints):
+                print(f"Stored fingerprints for billing_month {billing_month} do not match {self.table_id}, reloading the partition.")
+                previous_fingerprints = None
+
+            if previous_fingerprints is None:
+                self._replace_partition_with_fingerprints(snapshot_file, billing_month, fingerprints)
+            else:
+                self._merge_delta(snapshot_file, billing_month, fingerprints, previous_fingerprints)
+
+        fingerprint_store.save(billing_month, fingerprints)
+
+    def _add_fingerprint_column(self) -> None:
+        """
+        Add the row_fingerprint column to the table if it is missing.
+        """
+        query = f"""
+        ALTER TABLE `{self.project_id}.{self.dataset_id}.{self.table_id}`
+        ADD COLUMN IF NOT EXISTS row_fingerprint INT64
+        """
+        self.client.query(query).result()
+
+    def _spool_snapshot(self, batches: Iterable[Union[list, pa.RecordBatch]], snapshot_file) -> tuple:
+        """
+        Write every batch to a Parquet file while hashing its rows.
+
+        Args:
+            batches (Iterable[Union[list, pa.RecordBatch]]): The rows of the snapshot.
+            snapshot_file: The binary file the Parquet data is written to.
+
+        Returns:
+            tuple: The billing month formatted as "YYYY-MM-DD" and the uint64 row hashes in row order.
+        """
+        billing_month = None
+        row_hashes = []
+        parquet_writer = pq.ParquetWriter(snapshot_file, self.arrow_schema, compression=self.parquet_compression)
+        for batch in batches:
+            if not len(batch):
+                continue
+            if billing_month is None:
+                billing_month = self._get_billing_month(batch)
+            table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else self._rows_to_table(batch)
+            parquet_writer.write_table(table)
+            row_hashes.append(hash_rows(table))
+        parquet_writer.close()
+
+        if billing_month is None:
+            raise ValueError("No data available to infer the billing month.")
+
+        snapshot_file.seek(0)
+        return billing_month, np.concatenate(row_hashes)
+
+    def _partition_matches_fingerprints(self, billing_month: str, fingerprints: np.ndarray) -> bool:
+        """
+        Check that the partition holds exactly the rows described by the stored fingerprints.
+
+        The row count and the XOR of all fingerprints are compared, which catches loads done outside
+        upload_incremental without reading the rows.
+
+        Args:
+            billing_month (str): The billing month formatted as "YYYY-MM-DD".
+            fingerprints (np.ndarray): The stored uint64 fingerprints.
+
+        Returns:
+            bool: Whether the partition matches the fingerprints.
+        """
+        query = f"""
+        SELECT COUNT(*) AS row_count, COUNTIF(row_fingerprint IS NULL) AS missing_count, BIT_XOR(row_fingerprint) AS checksum
+        FROM `{self.project_id}.{self.dataset_id}.{self.table_id}`
+        WHERE billing_month = @billing_month
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("billing_month", "DATE", datetime.strptime(billing_month, "%Y-%m-%d").date())
+            ]
+        )
+        row = list(self.client.query(query, job_config=job_config).result())[0]
+        checksum = int(np.bitwise_xor.reduce(fingerprints.view(np.int64))) if len(fingerprints) else None
+        return row["row_count"] == len(fingerprints) and row["missing_count"] == 0 and row["checksum"] == checksum
+
+    def _replace_partition_with_fingerprints(self, snapshot_file, billing_month: str, fingerprints: np.ndarray) -> None:
+        """
+        Replace the billing month's partition with the whole snapshot and its fingerprints.
+
+        Args:
+            snapshot_file: The Parquet file written by _spool_snapshot.
+            billing_month (str): The billing month formatted as "YYYY-MM-DD".
+            fingerprints (np.ndarray): The uint64 fingerprint of every row of the snapshot.
+        """
+        schema = self.arrow_schema.append(pa.field("row_fingerprint", pa.int64()))
+        with tempfile.TemporaryFile() as parquet_file:
+            parquet_writer = pq.ParquetWriter(parquet_file, schema, compression=self.parquet_compression)
+            offset = 0
+            for batch in pq.ParquetFile(snapshot_file).iter_batches():
+                batch_fingerprints = fingerprints[offset:offset + batch.num_rows].view(np.int64)
+                parquet_writer.write_table(pa.Table.from_batches([batch]).append_column("row_fingerprint", pa.array(batch_fingerprints)))
+                offset += batch.num_rows
+            parquet_writer.close()
+
+            parquet_file.seek(0)
+            load_job = self._load_parquet_file(parquet_file, WriteDisposition.WRITE_TRUNCATE, self._get_partition_ref(billing_month))
+            load_job.result()  # Wait for the job to complete
+
+        print(f"Replaced billing_month {billing_month} in {self.table_id} with {len(fingerprints)} fingerprinted records.")
+
+    def _merge_delta(self, snapshot_file, billing_month: str, fingerprints: np.ndarray, previous_fingerprints: np.ndarray) -> None:
+        """
+        Load the inserted, changed and deleted rows into a delta table and apply them to the partition with one MERGE.
+
+        Rows to insert are staged with _op 'I', fingerprints to delete with _op 'D' and every other column null.
 
-        # Define job configuration for inserting data
+        Args:
+            snapshot_file: The Parquet file written by _spool_snapshot.
+            billing_month (str): The billing month formatted as "YYYY-MM-DD".
+            fingerprints (np.ndarray): The uint64 fingerprint of every row of the snapshot.
+            previous_fingerprints (np.ndarray): The sorted uint64 fingerprints of the previous snapshot.
+        """
+        inserted_mask = ~np.isin(fingerprints, previous_fingerprints, assume_unique=True)
+        deleted_fingerprints = np.setdiff1d(previous_fingerprints, fingerprints, assume_unique=True)
+        inserted_count = int(inserted_mask.sum())
+        print(f"Delta for billing_month {billing_month}: {inserted_count} rows to insert, {len(deleted_fingerprints)} rows to delete, "
+              f"{len(fingerprints) - inserted_count} unchanged.")
+        if not inserted_count and not len(deleted_fingerprints):
+            return
+
+        schema = self.arrow_schema.append(pa.field("row_fingerprint", pa.int64())).append(pa.field("_op", pa.string()))
+        # Unique to this call, so concurrent uploads of other months never merge or drop each other's delta
+        delta_table_id = self._get_scratch_table_id("delta", billing_month)
+        delta_ref = self.client.dataset(self.dataset_id).table(delta_table_id)
+
+        try:
+            self.client.create_table(bigquery.Table(delta_ref, schema=self._get_explicit_schema() + [
+                bigquery.SchemaField("row_fingerprint", "INTEGER"),
+                bigquery.SchemaField("_op", "STRING"),
+            ]))
+            with tempfile.TemporaryFile() as parquet_file:
+                parquet_writer = pq.ParquetWriter(parquet_file, schema, compression=self.parquet_compression)
+                offset = 0
+                for batch in pq.ParquetFile(snapshot_file).iter_batches():
+                    batch_mask = inserted_mask[offset:offset + batch.num_rows]
+                    batch_fingerprints = fingerprints[offset:offset + batch.num_rows]
+                    offset += batch.num_rows
+                    if not batch_mask.any():
+                        continue
+                    table = pa.Table.from_batches([batch]).filter(pa.array(batch_mask))
+                    table = table.append_column("row_fingerprint", pa.array(batch_fingerprints[batch_mask].view(np.int64)))
+                    parquet_writer.write_table(table.append_column("_op", pa.repeat("I", table.num_rows)))
+                if len(deleted_fingerprints):
+                    columns = [pa.nulls(len(deleted_fingerprints), type=field.type) for field in self.arrow_schema]
+                    columns += [pa.array(deleted_fingerprints.view(np.int64)), pa.repeat("D", len(deleted_fingerprints))]
+                    parquet_writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+                parquet_writer.close()
+
+                print(f"Serialized delta to {parquet_file.tell()} bytes of {self.parquet_compression} Parquet.")
+                parquet_file.seek(0)
+                self._load_parquet_file(parquet_file, WriteDisposition.WRITE_TRUNCATE, delta_ref).result()
+
+            column_list = ", ".join([field.name for field in self._get_explicit_schema()] + ["row_fingerprint"])
+            query = f"""
+            MERGE `{self.project_id}.{self.dataset_id}.{self.table_id}` T
+            USING `{self.project_id}.{self.dataset_id}.{delta_table_id}` S
+            ON T.billing_month = @billing_month AND S._op = 'D' AND T.row_fingerprint = S.row_fingerprint
+            WHEN MATCHED THEN DELETE
+            WHEN NOT MATCHED BY TARGET AND S._op = 'I' THEN INSERT ({column_list}) VALUES ({column_list})
+            """
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ScalarQueryParameter("billing_month", "DATE", datetime.strptime(billing_month, "%Y-%m-%d").date())
+                ]
+            )
+            self.client.query(query, job_config=job_config).result()  # Wait for the job to complete
+        finally:
+            self.client.delete_table(delta_ref, not_found_ok=True)
+
+        print(f"Merged {inserted_count} inserted and {len(deleted_fingerprints)} deleted records into billing_month {billing_month} of {self.table_id}.")
+
+    def _replace_partition_from_batches(self, batches: Iterable[Union[list, pa.RecordBatch]]) -> None:
+        """
+        Write every batch to one Parquet temporary file, then replace the billing month's partition with it.
+
+        Memory stays bounded by the batch size while the data is on disk, and the single WRITE_TRUNCATE
+        load makes the refresh atomic.
+
+        Args:
+            batches (Iterable[Union[list, pa.RecordBatch]]): Batches of JSON dictionaries, or Arrow record batches,
+                with billing_month field already included.
+        """
+        billing_month = None
+        record_count = 0
+        with tempfile.TemporaryFile() as parquet_file:
+            parquet_writer = pq.ParquetWriter(parquet_file, self.arrow_schema, compression=self.parquet_compression)
+            for batch in batches:
+                if not len(batch):
+                    continue
+                if billing_month is None:
+                    billing_month = self._get_billing_month(batch)
+                table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else self._rows_to_table(batch)
+                parquet_writer.write_table(table)
+                record_count += table.num_rows
+            parquet_writer.close()
+
+            if billing_month is None:
+                raise ValueError("No data available to infer the billing month.")
+
+            print(f"Serialized {record_count} records to {parquet_file.tell()} bytes of {self.parquet_compression} Parquet.")
+            parquet_file.seek(0)
+            load_job = self._load_parquet_file(parquet_file, WriteDisposition.WRITE_TRUNCATE, self._get_partition_ref(billing_month))
+            load_job.result()  # Wait for the job to complete
+
+        print(f"Replaced billing_month {billing_month} in {self.table_id} with {record_count} records.")
+
+    def _replace_partition_from_json_batches(self, batches: Iterable[Union[list, pa.RecordBatch]]) -> None:
+        """
+        Write every batch to one newline-delimited JSON temporary file, then replace the billing month's partition with it.
+
+        The JSON counterpart of _replace_partition_from_batches, for uploaders configured with a JSON source format.
+
+        Args:
+            batches (Iterable[Union[list, pa.RecordBatch]]): Batches of JSON dictionaries, or Arrow record batches,
+                with billing_month field already included.
+        """
+        billing_month = None
+        record_count = 0
+        with tempfile.TemporaryFile() as json_file:
+            for batch in batches:
+                if not len(batch):
+                    continue
+                if billing_month is None:
+                    billing_month = self._get_billing_month(batch)
+                rows = batch.to_pylist() if isinstance(batch, pa.RecordBatch) else batch
+                for row in rows:
+                    json_file.write(json.dumps(row, default=str).encode('utf-8'))
+                    json_file.write(b'\n')
+                record_count += len(rows)
+
+            if billing_month is None:
+                raise ValueError("No data available to infer the billing month.")
+
+            print(f"Serialized {record_count} records to {json_file.tell()} bytes of newline-delimited JSON.")
+            json_file.seek(0)
+            job_config = bigquery.LoadJobConfig(
+                write_disposition=WriteDisposition.WRITE_TRUNCATE,
+                source_format=SourceFormat.NEWLINE_DELIMITED_JSON,
+                schema=self._get_explicit_schema()
+            )
+            load_job = self.client.load_table_from_file(json_file, self._get_partition_ref(billing_month), job_config=job_config)
+            load_job.result()  # Wait for the job to complete
+
+        print(f"Replaced billing_month {billing_month} in {self.table_id} with {record_count} records.")
+
+    def _get_scratch_table_id(self, purpose: str, billing_month: Optional[str] = None) -> str:
+        """
+        Return a table ID unique to one upload, e.g. "table__delta_202410_1a2b3c4d", for its intermediate rows.
+
+        Args:
+            purpose (str): What the table holds, e.g. "delta" or "staging".
+            billing_month (Optional[str]): The billing month of the upload, formatted as "YYYY-MM-DD", when known.
+
+        Returns:
+            str: The table ID.
+        """
+        month_suffix = f"_{datetime.strptime(billing_month, '%Y-%m-%d'):%Y%m}" if billing_month else ""
+        return f"{self.table_id}__{purpose}{month_suffix}_{uuid.uuid4().hex[:8]}"
+
+    def _get_partition_ref(self, billing_month: str) -> bigquery.TableReference:
+        """
+        Return the reference to the monthly partition of the table, e.g. "table$202410".
+
+        Args:
+            billing_month (str): The billing month formatted as "YYYY-MM-DD".
+
+        Returns:
+            bigquery.TableReference: The partition decorator reference.
+        """
+        billing_month_date = datetime.strptime(billing_month, "%Y-%m-%d").date()
+        return self.client.dataset(self.dataset_id).table(f"{self.table_id}${billing_month_date:%Y%m}")
+
+    def _load_batch(self, batch: Union[list, pa.RecordBatch], write_disposition: str,
+                    destination: Optional[bigquery.TableReference] = None) -> bigquery.LoadJob:
+        """
+        Start a load job for a batch of rows in the configured source format.
+
+        Arrow record batches are always sent as Parquet.
+
+        Args:
+            batch (Union[list, pa.RecordBatch]): The rows to load.
+            write_disposition (str): The write disposition of the load job.
+            destination (Optional[bigquery.TableReference]): The table or partition to load into. Defaults to the table.
+
+        Returns:
+            bigquery.LoadJob: The started load job.
+        """
+        destination = destination or self.table_ref
+
+        if isinstance(batch, pa.RecordBatch):
+            return self._load_parquet(pa.Table.from_batches([batch]), write_disposition, destination)
+
+        if self.source_format == SourceFormat.PARQUET:
+            return self._load_parquet(self._rows_to_table(batch), write_disposition, destination)
+
+        job_config = bigquery.LoadJobConfig(write_disposition=write_disposition)
+        return self.client.load_table_from_json(batch, destination, job_config=job_config)
+
+    def _rows_to_table(self, rows: list) -> pa.Table:
+        """
+        Convert JSON dictionaries to an Arrow table typed by the explicit schema.
+
+        Args:
+            rows (list): The JSON dictionaries.
+
+        Returns:
+            pa.Table: The rows as a table with the schema from get_arrow_schema.
+        """
+        record_batch = table_to_record_batch(pa.Table.from_pylist(rows), self.arrow_schema)
+        return pa.Table.from_batches([record_batch])
+
+    def _load_parquet(self, table: pa.Table, write_disposition: str, destination: bigquery.TableReference) -> bigquery.LoadJob:
+        """
+        Start a load job for an Arrow table, sent as compressed Parquet so column types are kept.
+
+        Small tables are serialized in memory, large ones are staged in a temporary file.
+
+        Args:
+            table (pa.Table): The rows to load.
+            write_disposition (str): The write disposition of the load job.
+            destination (bigquery.TableReference): The table or partition to load into.
+
+        Returns:
+            bigquery.LoadJob: The started load job.
+        """
+        parquet_file = tempfile.TemporaryFile() if table.num_rows > PARQUET_SPOOL_ROWS else io.BytesIO()
+        try:
+            pq.write_table(table, parquet_file, compression=self.parquet_compression)
+            print(f"Serialized {table.num_rows} records to {parquet_file.tell()} bytes of {self.parquet_compression} Parquet.")
+            parquet_file.seek(0)
+            return self._load_parquet_file(parquet_file, write_disposition, destination)
+        finally:
+            parquet_file.close()
+
+    def _load_parquet_file(self, parquet_file, write_disposition: str, destination: bigquery.TableReference) -> bigquery.LoadJob:
+        """
+        Start a load job for a Parquet file object positioned at its start.
+
+        Args:
+            parquet_file: The Parquet data, opened in binary read mode.
+            write_disposition (str): The write disposition of the load job.
+            destination (bigquery.TableReference): The table or partition to load into.
+
+        Returns:
+            bigquery.LoadJob: The started load job.
+        """
         job_config = bigquery.LoadJobConfig(
-            write_disposition=WriteDisposition.WRITE_APPEND  # Append new data instead of truncating
+            write_disposition=write_disposition,
+            source_format=SourceFormat.PARQUET
         )
+        return self.client.load_table_from_file(parquet_file, destination, job_config=job_config)
 
-        # Upload data to BigQuery
-        load_job = self.client.load_table_from_json(json_data, self.table_ref, job_config=job_config)
-        load_job.result()  # Wait for the job to complete
-        print(f"Uploaded {len(json_data)} records to {self.table_id}.")
+    @staticmethod
+    def _get_billing_month(batch: Union[list, pa.RecordBatch]) -> str:
+        """
+        Return the billing month of the first row of a batch, formatted as "YYYY-MM-DD".
+        """
+        if isinstance(batch, pa.RecordBatch):
+            return batch.column("billing_month")[0].as_py().isoformat()
+        return batch[0].get('billing_month')
+
+    def _replace_rows_from_staging(self, staging_table_id: str, billing_month: str) -> None:
+        """
+        Replace the rows of the given billing month with those of a staging table, in one transaction.
 
+        Args:
+            staging_table_id (str): The table holding the new rows of the billing month.
+            billing_month (str): The billing month whose rows are replaced.
+        """
+        billing_month_date = datetime.strptime(billing_month, "%Y-%m-%d").date()
+        column_list = ", ".join(field.name for field in self._get_explicit_schema())
 
+        query = f"""
+        BEGIN TRANSACTION;
+        DELETE FROM `{self.project_id}.{self.dataset_id}.{self.table_id}`
+        WHERE CAST(billing_month AS DATE) = @billing_month;
+        INSERT INTO `{self.project_id}.{self.dataset_id}.{self.table_id}` ({column_list})
+        SELECT {column_list} FROM `{self.project_id}.{self.dataset_id}.{staging_table_id}`;
+        COMMIT TRANSACTION;
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("billing_month", "DATE", billing_month_date)
+            ]
+        )
+        self.client.query(query, job_config=job_config).result()  # Wait for the job to complete
+        print(f"Replaced rows for billing_month {billing_month_date} with the staged rows.")
 
     def _delete_existing_rows(self, billing_month: str) -> None:
         """
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, Optional
+
+# Local directory holding the cached blobs.
+DEFAULT_CACHE_DIR = "blob_cache"
+
+# Total size of the cached blobs above which the least recently used ones are evicted.
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Chunk size used when reading a cached blob back.
+CACHE_READ_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Serializes evictions between the threads of a process.
+_eviction_lock = threading.Lock()
+
+
+class BlobCache:
+    """
+    Local disk cache of the compressed blobs of one export, keyed by (rootDirectory, blob name, eTag).
+
+    A new export gets a new eTag, so cached blobs never go stale: a re-run against the same export reads
+    them from disk, and a newer export misses and downloads. Blobs are stored as downloaded, still
+    gzipped, so the cache works with any decoder. The directory is shared by every export and kept under
+    max_bytes by evicting the least recently used blobs.
+
+    Attributes:
+        cache_dir (str): The directory holding the cached blobs.
+        root_directory (str): The rootDirectory of the export.
+        etag (str): The eTag of the export.
+        max_bytes (int): The size limit of the cache directory.
+        hits (int): The number of blobs read from the cache.
+        misses (int): The number of blobs not found in the cache.
+        hit_bytes (int): The number of bytes read from the cache instead of the network.
+        evictions (int): The number of blobs evicted.
+    """
+
+    def __init__(self, root_directory: str, etag: str, cache_dir: str = DEFAULT_CACHE_DIR,
+                 max_bytes: int = DEFAULT_CACHE_MAX_BYTES) -> None:
+        """
+        Initialize the cache for an export.
+
+        Args:
+            root_directory (str): The rootDirectory of the export, from the resource location.
+            etag (str): The eTag of the export, from the resource location.
+            cache_dir (str): The directory holding the cached blobs, created if needed.
+            max_bytes (int): The size limit of the cache directory.
+
+        Raises:
+            ValueError: If root_directory or etag is missing.
+        """
+        if not root_directory or not etag:
+            raise ValueError("Both rootDirectory and eTag are required to cache an export.")
+
+        self.root_directory = root_directory
+        self.etag = etag
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_resource_location(cls, resource_location: dict, **kwargs) -> Optional["BlobCache"]:
+        """
+        Create the cache for the export described by a resource location.
+
+        Args:
+            resource_location (dict): The resourceLocation of the operation result.
+            **kwargs: Passed to the constructor, e.g. cache_dir or max_bytes.
+
+        Returns:
+            Optional[BlobCache]: The cache, or None if the resource location has no eTag.
+        """
+        if not resource_location.get('eTag'):
+            print("Resource location has no eTag, blobs will not be cached.")
+            return None
+        return cls(resource_location.get('rootDirectory'), resource_location.get('eTag'), **kwargs)
+
+    def get_path(self, blob_name: str) -> Optional[str]:
+        """
+        Look up a blob and mark it as recently used.
+
+        Args:
+            blob_name (str): The blob name.
+
+        Returns:
+            Optional[str]: The path of the cached blob, or None on a miss.
+        """
+        path = self._get_path(blob_name)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.hit_bytes += size
+        print(f"Cache hit for blob '{blob_name}' ({size} bytes).")
+        return path
+
+    def iter_chunks(self, path: str) -> Iterator[bytes]:
+        """
+        Read a cached blob chunk by chunk.
+
+        Args:
+            path (str): The path returned by get_path.
+
+        Yields:
+            bytes: The compressed blob content, CACHE_READ_CHUNK_SIZE bytes at a time.
+        """
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CACHE_READ_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def put_chunks(self, blob_name: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass the chunks of a download through while writing them to the cache.
+
+        The blob is only added to the cache once every chunk has been consumed, so a failed or
+        abandoned download never leaves a partial entry.
+
+        Args:
+            blob_name (str): The blob name.
+            chunks (Iterable[bytes]): The compressed blob content, in order.
+
+        Yields:
+            bytes: The chunks, unchanged.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(temp_path, self._get_path(blob_name))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._evict()
+
+    def put_bytes(self, blob_name: str, data: bytes) -> None:
+        """
+        Add a blob that was downloaded in one piece to the cache.
+
+        Args:
+            blob_name (str): The blob name.
+            data (bytes): The compressed blob content.
+        """
+        for _ in self.put_chunks(blob_name, [data]):
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the hit and miss counters of the cache.
+
+        Returns:
+            Dict[str, int]: The hits, misses, bytes read from the cache and evictions.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitBytes': self.hit_bytes,
+            'evictions': self.evictions,
+        }
+
+    def _get_path(self, blob_name: str) -> str:
+        key = f"{self.root_directory}|{blob_name}|{self.etag}"
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.gz')
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used blobs until the cache directory fits in max_bytes.
+        """
+        with _eviction_lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith('.gz'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+                with self._lock:
+                    self.evictions += 1
+
+    def __repr__(self) -> str:
+        return f"BlobCache(cache_dir={self.cache_dir!r}, eTag={self.etag!r}, stats={self.stats()})"
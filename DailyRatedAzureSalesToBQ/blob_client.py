@@ -1,19 +1,64 @@
 import io
 import gzip
 import json
+import mmap
+import os
+import queue
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Union
 from azure.storage.blob import BlobServiceClient
 from datetime import datetime
+from blob_cache import BlobCache
 from blob_url_parser import BlobURLParser 
+from json_decoder import JsonLinesDecoder, get_json_lines_decoder
 from resource_location import ResourceLocationParser
 
+# Number of records handed out per batch by the streaming pipeline.
+DEFAULT_BATCH_SIZE = 20000
+
+# Upper bound on the bytes produced by a single decompress call, so a highly
+# compressible chunk cannot expand into one huge buffer.
+UNZIP_CHUNK_SIZE = 8 * 1024 * 1024
+
+# wbits value telling zlib to expect a gzip header and trailer.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Number of blobs downloaded and parsed concurrently by the multi-blob ingest.
+DEFAULT_MAX_WORKERS = 4
+
+# Defaults for the ranged download of a single blob.
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
 class AzureBlobDownloader:
 
-    def __init__(self, account_url, sas_token, container_name, blob_name):
+    def __init__(self, account_url, sas_token, container_name, blob_name, decoder: Optional[JsonLinesDecoder] = None,
+                 cache: Optional[BlobCache] = None, billing_month: Optional[str] = None):
         self.account_url = account_url
         self.sas_token = sas_token
         self.container_name = container_name
         self.blob_name = blob_name
 
+        # Turns batches of JSON lines into records, see json_decoder.get_json_lines_decoder
+        self.decoder = decoder or get_json_lines_decoder()
+
+        # Local copy of the export's blobs, see blob_cache.BlobCache. Downloads skip the network on a hit
+        self.cache = cache
+
+        # Billing month of the export's records, "YYYY-MM-01". Defaults to the current month
+        self.billing_month = billing_month
+
+        # Shared by every download, including the worker threads of the multi-blob ingest
+        self.blob_service_client = BlobServiceClient(account_url=self.account_url, credential=self.sas_token)
+
+        # One entry per streamed blob with its byte counters and timing
+        self.download_stats: List[dict] = []
+
     def download_blob_to_stream(self, container_name: str, blob_name: str, stream: io.BytesIO) -> None:
         """
         Download blob into a provided in-memory stream.
@@ -23,21 +68,98 @@ class AzureBlobDownloader:
             blob_name (str): The blob name.
             stream (io.BytesIO): The stream to download the blob to.
         """
+        cached_path = self.cache.get_path(blob_name) if self.cache else None
+        if cached_path:
+            for chunk in self.cache.iter_chunks(cached_path):
+                stream.write(chunk)
+            stream.seek(0)
+            return None
+
         # print(f"Downloading blob '{blob_name}' from container '{container_name}'...")
-        blob_service_client = BlobServiceClient(account_url=self.account_url, credential=self.sas_token)
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
         downloaded_stream = blob_client.download_blob()
         downloaded_stream.readinto(stream)  # Writes data into the provided stream
         stream.seek(0)  # Reset stream pointer to the beginning
         print("Blob downloaded successfully.")
+        if self.cache:
+            self._cache_stream(blob_name, stream)
         return downloaded_stream
 
-    def unzip_blob_stream(self, compressed_stream: io.BytesIO) -> io.BytesIO:
+    def download_blob_ranged(self, container_name: str, blob_name: str, range_size: int = DEFAULT_RANGE_SIZE,
+                             max_concurrency: int = DEFAULT_MAX_CONCURRENCY, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                             use_temp_file: bool = False) -> Union[io.BytesIO, mmap.mmap]:
+        """
+        Download a blob by fetching byte ranges concurrently into a preallocated buffer.
+
+        At most memory_budget // range_size ranges are in flight at once. Blobs larger than
+        memory_budget, or any blob when use_temp_file is set, are written to a memory-mapped
+        temporary file instead of an in-memory buffer.
+
+        Args:
+            container_name (str): The container name.
+            blob_name (str): The blob name.
+            range_size (int): The size in bytes of each range request.
+            max_concurrency (int): The maximum number of concurrent range requests.
+            memory_budget (int): The maximum number of bytes held by in-flight ranges, and the
+                largest blob kept in memory.
+            use_temp_file (bool): Always download into a memory-mapped temporary file.
+
+        Returns:
+            Union[io.BytesIO, mmap.mmap]: A file-like object with the blob content, positioned at the start.
+        """
+        cached_path = self.cache.get_path(blob_name) if self.cache else None
+        if cached_path:
+            if os.path.getsize(cached_path) == 0:
+                return io.BytesIO()
+            with open(cached_path, 'rb') as cached_file:
+                return mmap.mmap(cached_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        start_time = time.perf_counter()
+        blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        blob_size = blob_client.get_blob_properties().size
+        if blob_size == 0:
+            return io.BytesIO()
+
+        if use_temp_file or blob_size > memory_budget:
+            with tempfile.TemporaryFile() as temp_file:
+                temp_file.truncate(blob_size)
+                stream = mmap.mmap(temp_file.fileno(), blob_size)
+            buffer = stream
+        else:
+            stream = io.BytesIO()
+            stream.seek(blob_size - 1)
+            stream.write(b'\0')  # Grow the buffer to the blob size once
+            buffer = stream.getbuffer()
+
+        def fetch_range(offset: int) -> None:
+            length = min(range_size, blob_size - offset)
+            data = blob_client.download_blob(offset=offset, length=length, max_concurrency=1).readall()
+            buffer[offset:offset + len(data)] = data
+
+        # Each worker holds a single range at a time, which keeps in-flight data within the memory budget
+        workers = max(1, min(max_concurrency, memory_budget // range_size))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(fetch_range, offset) for offset in range(0, blob_size, range_size)]:
+                    future.result()
+        finally:
+            if isinstance(buffer, memoryview):
+                buffer.release()
+
+        stream.seek(0)
+        elapsed = time.perf_counter() - start_time
+        print(f"Blob downloaded successfully in {-(-blob_size // range_size)} ranges with {workers} workers "
+              f"({blob_size / elapsed / 1024 / 1024:.1f} MB/s).")
+        if self.cache:
+            self._cache_stream(blob_name, stream)
+        return stream
+
+    def unzip_blob_stream(self, compressed_stream: Union[io.BytesIO, mmap.mmap]) -> io.BytesIO:
         """
         Unzip a compressed in-memory stream and return a new in-memory stream with the unzipped content.
 
         Args:
-            compressed_stream (io.BytesIO): The in-memory stream containing compressed data.
+            compressed_stream (Union[io.BytesIO, mmap.mmap]): The in-memory stream containing compressed data.
 
         Returns:
             io.BytesIO: A new in-memory stream containing the unzipped data.
@@ -60,33 +182,271 @@ class AzureBlobDownloader:
             list: A list of JSON objects with the added billing_month field.
         """
         print("Processing the unzipped stream and adding billing_month...")
+        if not self.decoder.returns_dicts:
+            raise ValueError(f"{self.decoder!r} does not return dicts, use iter_record_batches instead.")
+
         unzipped_stream.seek(0)  # Ensure stream is at the start
         processed_data = []
         
-        # Get current year and month
-        current_year = datetime.now().year
-        current_month = datetime.now().month
-        
-        # Format billing_month as "YYYY-MM-01"
-        billing_month = f"{current_year}-{current_month:02d}-01"
+        billing_month = self._get_billing_month()
         
-        # Read the stream line by line
+        # Read the stream line by line and decode the lines in batches
+        lines = []
         for line in unzipped_stream:
-            # Convert the line to a JSON object
-            json_obj = json.loads(line.decode('utf-8'))
-            
-            # Add the billing_month field
-            json_obj["billing_month"] = billing_month
-            
-            # Append the processed JSON object to the list
-            processed_data.append(json_obj)
+            if line.strip():
+                lines.append(line)
+            if len(lines) >= DEFAULT_BATCH_SIZE:
+                processed_data.extend(self.decoder.decode_lines(lines, billing_month))
+                lines = []
+        if lines:
+            processed_data.extend(self.decoder.decode_lines(lines, billing_month))
         
         print(f"Added billing_month '{billing_month}' to {len(processed_data)} records.")
         return processed_data
 
+    def iter_blob_chunks(self, container_name: str, blob_name: str) -> Iterator[bytes]:
+        """
+        Download a blob chunk by chunk instead of buffering it in memory.
+
+        Args:
+            container_name (str): The container name.
+            blob_name (str): The blob name.
+
+        Yields:
+            bytes: The compressed blob content, one download chunk at a time.
+        """
+        cached_path = self.cache.get_path(blob_name) if self.cache else None
+        if cached_path:
+            yield from self.cache.iter_chunks(cached_path)
+            return
+
+        blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        chunks = blob_client.download_blob().chunks()
+        if self.cache:
+            # The blob is added to the cache once the last chunk has been read
+            chunks = self.cache.put_chunks(blob_name, chunks)
+        for chunk in chunks:
+            yield chunk
+
+    def iter_unzipped_chunks(self, compressed_chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Incrementally gunzip a sequence of compressed chunks.
+
+        Concatenated gzip members are handled the same way as gzip.GzipFile does.
+
+        Args:
+            compressed_chunks (Iterable[bytes]): The compressed data, in order.
+
+        Yields:
+            bytes: Decompressed data, at most UNZIP_CHUNK_SIZE bytes at a time.
+        """
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        for chunk in compressed_chunks:
+            while chunk:
+                data = decompressor.decompress(chunk, UNZIP_CHUNK_SIZE)
+                if data:
+                    yield data
+                if decompressor.eof:
+                    # Start over on the next gzip member, if any
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+                else:
+                    chunk = decompressor.unconsumed_tail
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    def iter_record_batches(self, container_name: str, blob_name: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list]:
+        """
+        Stream a gzipped JSON lines blob and yield its records in batches with the billing_month field added.
+
+        Only one download chunk, one decompressed chunk and one batch of records are held
+        in memory at a time, so peak memory is bounded by batch_size rather than by the blob size.
+        Lines are decoded a batch at a time by the downloader's decoder.
+
+        Args:
+            container_name (str): The container name.
+            blob_name (str): The blob name.
+            batch_size (int): The maximum number of records per batch.
+
+        Yields:
+            list: A list of at most batch_size JSON objects with the added billing_month field,
+                or a pyarrow.Table when the decoder is columnar.
+        """
+        print(f"Streaming blob '{blob_name}' in batches of {batch_size} records...")
+        start_time = time.perf_counter()
+        billing_month = self._get_billing_month()
+        batch = []
+        record_count = 0
+        compressed_bytes = 0
+        unzipped_bytes = 0
+        pending = b''
+
+        def count_compressed(chunks: Iterable[bytes]) -> Iterator[bytes]:
+            nonlocal compressed_bytes
+            for chunk in chunks:
+                compressed_bytes += len(chunk)
+                yield chunk
+
+        unzipped_chunks = self.iter_unzipped_chunks(count_compressed(self.iter_blob_chunks(container_name, blob_name)))
+        for data in unzipped_chunks:
+            unzipped_bytes += len(data)
+            lines = (pending + data).split(b'\n')
+            # The last piece may be an incomplete line, keep it for the next chunk
+            pending = lines.pop()
+            for line in lines:
+                if not line.strip():
+                    continue
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    record_count += len(batch)
+                    yield self.decoder.decode_lines(batch, billing_month)
+                    batch = []
+
+        if pending.strip():
+            batch.append(pending)
+        if batch:
+            record_count += len(batch)
+            yield self.decoder.decode_lines(batch, billing_month)
+
+        stats = {
+            'blobName': blob_name,
+            'compressedBytes': compressed_bytes,
+            'unzippedBytes': unzipped_bytes,
+            'records': record_count,
+            'seconds': round(time.perf_counter() - start_time, 3),
+        }
+        self.download_stats.append(stats)
+        print(f"Streamed {record_count} records with billing_month '{billing_month}': {stats}")
+
+    def iter_record_batches_from_blobs(self, container_name: str, blob_names: List[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                                       max_workers: int = DEFAULT_MAX_WORKERS) -> Iterator[list]:
+        """
+        Stream several gzipped JSON lines blobs in parallel and merge their record batches into one ingest.
+
+        Each blob is downloaded, unzipped and parsed by a worker from a bounded thread pool sharing
+        this downloader's BlobServiceClient. Batches are yielded in the order they become ready, and at
+        most 2 * max_workers batches are buffered, so memory stays bounded by batch_size.
+
+        Args:
+            container_name (str): The container name.
+            blob_names (List[str]): The blob names, e.g. from ResourceLocationParser.parse_blob_names.
+            batch_size (int): The maximum number of records per batch.
+            max_workers (int): The maximum number of blobs processed concurrently.
+
+        Yields:
+            list: A list of at most batch_size JSON objects with the added billing_month field.
+
+        Raises:
+            Exception: Re-raises the first error raised while processing any of the blobs.
+        """
+        print(f"Streaming {len(blob_names)} blob(s) with up to {max_workers} workers...")
+        start_time = time.perf_counter()
+        batches = queue.Queue(maxsize=2 * max_workers)
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            # Give up once the consumer has stopped, instead of blocking on a full queue forever
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker(blob_name: str) -> None:
+            try:
+                for batch in self.iter_record_batches(container_name, blob_name, batch_size):
+                    if not put(batch):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        stats_offset = len(self.download_stats)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        for blob_name in blob_names:
+            executor.submit(worker, blob_name)
+
+        try:
+            remaining = len(blob_names)
+            while remaining:
+                item = batches.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        total_bytes = sum(stats['compressedBytes'] for stats in self.download_stats[stats_offset:])
+        print(f"Streamed {len(blob_names)} blob(s), {total_bytes} compressed bytes, in {time.perf_counter() - start_time:.2f} seconds.")
+        if self.cache:
+            print(f"Blob cache: {self.cache.stats()}")
+
+    def download_blobs_to_files(self, container_name: str, blob_names: List[str], directory: str,
+                                max_workers: int = DEFAULT_MAX_WORKERS) -> List[str]:
+        """
+        Make local gzipped copies of several blobs, for readers that take file paths such as DuckDB's read_json.
+
+        Blobs found in the cache are used in place. Others are downloaded in parallel into directory,
+        and added to the cache on the way.
+
+        Args:
+            container_name (str): The container name.
+            blob_names (List[str]): The blob names, e.g. from ResourceLocationParser.parse_blob_names.
+            directory (str): The directory of the downloaded blobs, created if needed.
+            max_workers (int): The maximum number of blobs downloaded concurrently.
+
+        Returns:
+            List[str]: The local path of every blob, in the order of blob_names.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        def download(blob_name: str) -> str:
+            cached_path = self.cache.get_path(blob_name) if self.cache else None
+            if cached_path:
+                return cached_path
+            chunks = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name).download_blob().chunks()
+            if self.cache:
+                chunks = self.cache.put_chunks(blob_name, chunks)
+            path = os.path.join(directory, os.path.basename(blob_name))
+            with open(path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            return path
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            paths = list(executor.map(download, blob_names))
+        print(f"{len(paths)} blob(s) available locally in {directory}.")
+        return paths
+
+    def _cache_stream(self, blob_name: str, stream: Union[io.BytesIO, mmap.mmap]) -> None:
+        """
+        Add a downloaded blob to the cache and rewind the stream.
+        """
+        for _ in self.cache.put_chunks(blob_name, iter(lambda: stream.read(DEFAULT_RANGE_SIZE), b'')):
+            pass
+        stream.seek(0)
+
+    def _get_billing_month(self) -> str:
+        """
+        Return the billing month of the export formatted as "YYYY-MM-01", the current one unless set.
+        """
+        if self.billing_month:
+            return self.billing_month
+        now = datetime.now()
+        return f"{now.year}-{now.month:02d}-01"
+
 def main():
     # Simulate parsing resource location
-    init_resource_location = ResourceLocationParser("""{
+    resource_location = json.loads("""{
     "id": "b8d16d34-910e-47e4-8fa5-c934976a9a11",
     "createdDateTime": "2024-10-08T00:57:36.037Z",
     "schemaVersion": "2",
@@ -102,11 +462,14 @@ def main():
         "name": "part-00103-9a209a5e-0378-4bb5-9b6a-75bb0fe7ae84.c000.json.gz",
         "partitionValue": "default"
       }]}""")
+    init_resource_location = ResourceLocationParser(resource_location)
 
     rootDirectory, sasToken, blob_name = init_resource_location.parse_resource_location().values()
     storage_account_name, container_name = BlobURLParser(rootDirectory).extract_storage_info()
 
-    downloader = AzureBlobDownloader(storage_account_name, sasToken, container_name, blob_name)
+    # Re-runs against the same export read the blob from the local cache instead of the network
+    blob_cache = BlobCache.from_resource_location(resource_location)
+    downloader = AzureBlobDownloader(storage_account_name, sasToken, container_name, blob_name, cache=blob_cache)
     
     # Download blob into the in-memory stream
     downloaded_stream = io.BytesIO()  # Create an empty BytesIO stream
@@ -124,6 +487,7 @@ def main():
 
     # Further processing can be done here (e.g., uploading to BigQuery)
     print("Processing complete. Billing month added to all records.")
+    print(blob_cache)
 
 if __name__ == "__main__":
     main()
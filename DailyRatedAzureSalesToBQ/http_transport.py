@@ -0,0 +1,246 @@
+import bisect
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Size of the connection pool kept per host.
+DEFAULT_POOL_SIZE = 16
+
+# Retry policy for throttled and failed requests.
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 60.0
+DEFAULT_TIMEOUT = 60
+
+# Longest Retry-After honoured. The server's value is waited in full up to this limit, unlike the
+# jittered backoff which is capped by backoff_max.
+DEFAULT_RETRY_AFTER_MAX = 15 * 60
+
+# Status codes worth retrying. 429 and 503 mean the request was not processed, so they are retried for
+# every method; the others only for idempotent methods.
+RETRY_ALWAYS_STATUS_CODES = {429, 503}
+RETRY_IDEMPOTENT_STATUS_CODES = {500, 502, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# Upper bounds, in milliseconds, of the latency histogram buckets. The last bucket is unbounded.
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+# Path segments that identify a single resource, e.g. invoice IDs or GUIDs, are grouped under one endpoint.
+_ID_SEGMENT = re.compile(r'^(?=.*\d)[\w.-]{6,}$')
+
+
+class HttpTransport:
+    """
+    Shared HTTP transport for the Partner Center and Graph API clients.
+
+    Wraps a requests.Session with a sized connection pool, so connections are kept alive across polls
+    and invoices instead of doing a TCP and TLS handshake per call. Throttled (429) and failed (5xx)
+    requests are retried with exponential backoff and full jitter, waiting at least as long as the
+    Retry-After header asks. Connection errors are retried for idempotent requests; others, e.g. POSTs
+    starting an export, are only retried when the request never reached the server, so a timeout after
+    the server accepted it does not send it twice. The latency of every attempt is recorded in a histogram per endpoint.
+
+    Attributes:
+        session (requests.Session): The pooled session.
+        max_retries (int): The maximum number of retries per request.
+        backoff_base (float): The base delay in seconds of the exponential backoff.
+        backoff_max (float): The maximum delay in seconds between attempts.
+        timeout (float): The default timeout in seconds of each attempt.
+        retry_after_max (float): The maximum delay in seconds honoured from a Retry-After header.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE, backoff_max: float = DEFAULT_BACKOFF_MAX,
+                 timeout: float = DEFAULT_TIMEOUT, session: Optional[requests.Session] = None,
+                 retry_after_max: float = DEFAULT_RETRY_AFTER_MAX) -> None:
+        """
+        Initialize the transport.
+
+        Args:
+            pool_size (int): The number of connections kept open per host.
+            max_retries (int): The maximum number of retries per request.
+            backoff_base (float): The base delay in seconds of the exponential backoff.
+            backoff_max (float): The maximum delay in seconds between attempts.
+            timeout (float): The default timeout in seconds of each attempt.
+            session (Optional[requests.Session]): The session to use. Defaults to a new pooled session.
+            retry_after_max (float): The maximum delay in seconds honoured from a Retry-After header.
+        """
+        self.max_retries = max_retries
+        self.retry_after_max = retry_after_max
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        if session is None:
+            session = requests.Session()
+            # Retries are handled here, so the adapter must not retry on its own
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        self.session = session
+
+        self._latencies: Dict[str, List[int]] = {}
+        self._latency_totals: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def request(self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs) -> requests.Response:
+        """
+        Send a request, retrying it on connection errors, 429 and 5xx responses.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            idempotent (Optional[bool]): Whether the request may be retried on 500, 502 and 504, and on
+                connection errors and timeouts after it was sent. Defaults to True for GET, HEAD, OPTIONS,
+                PUT and DELETE.
+            **kwargs: Passed to requests.Session.request, e.g. headers, json or data.
+
+        Returns:
+            requests.Response: The last response, which may still be an error once retries are exhausted.
+
+        Raises:
+            requests.RequestException: If the last attempt failed without a response.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        retry_status_codes = RETRY_ALWAYS_STATUS_CODES | (RETRY_IDEMPOTENT_STATUS_CODES if idempotent else set())
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = self._get_endpoint(method, url)
+
+        attempt = 0
+        while True:
+            start_time = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record_latency(endpoint, time.perf_counter() - start_time)
+                if attempt >= self.max_retries or not (idempotent or self._was_not_sent(e)):
+                    raise
+                delay = self._get_backoff(attempt)
+                print(f"{endpoint} failed with {type(e).__name__}, retrying in {delay:.1f} seconds...")
+            else:
+                self._record_latency(endpoint, time.perf_counter() - start_time)
+                if response.status_code not in retry_status_codes or attempt >= self.max_retries:
+                    return response
+                delay = max(self._get_backoff(attempt), self._get_retry_after(response))
+                print(f"{endpoint} returned {response.status_code}, retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def latency_report(self) -> Dict[str, dict]:
+        """
+        Return the latency histogram of every endpoint called so far.
+
+        Returns:
+            Dict[str, dict]: Per endpoint, the number of attempts, the mean and max latency in milliseconds,
+                and the attempt count per bucket keyed by the bucket's upper bound, e.g. "<=250ms".
+        """
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        report = {}
+        with self._lock:
+            for endpoint, counts in self._latencies.items():
+                total_seconds, max_seconds = self._latency_totals[endpoint]
+                count = sum(counts)
+                report[endpoint] = {
+                    'count': count,
+                    'meanMs': round(total_seconds / count * 1000, 1),
+                    'maxMs': round(max_seconds * 1000, 1),
+                    'buckets': {label: bucket_count for label, bucket_count in zip(labels, counts) if bucket_count},
+                }
+        return report
+
+    def print_latency_report(self) -> None:
+        """
+        Print the latency histogram of every endpoint called so far.
+        """
+        for endpoint, stats in self.latency_report().items():
+            print(f"{endpoint}: {stats['count']} calls, mean {stats['meanMs']} ms, max {stats['maxMs']} ms, {stats['buckets']}")
+
+    def _get_backoff(self, attempt: int) -> float:
+        """
+        Return a random delay between 0 and the exponential backoff of the attempt ("full jitter").
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _was_not_sent(error: requests.RequestException) -> bool:
+        """
+        Return whether a request failed before it reached the server: the connection could not be opened in time or at all.
+        """
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _get_retry_after(self, response: requests.Response) -> float:
+        """
+        Return the delay in seconds asked for by the Retry-After header, given in seconds or as an HTTP date.
+        """
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return 0.0
+        try:
+            return min(self.retry_after_max, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+        try:
+            return min(self.retry_after_max, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+        except (TypeError, ValueError):
+            return 0.0
+
+    @staticmethod
+    def _get_endpoint(method: str, url: str) -> str:
+        """
+        Return the endpoint of a request, e.g. "GET api.partnercenter.microsoft.com/v1/invoices/{id}/lineitems".
+        """
+        parts = urlsplit(url)
+        path = '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in parts.path.split('/'))
+        return f"{method} {parts.netloc}{path}"
+
+    def _record_latency(self, endpoint: str, seconds: float) -> None:
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)
+        with self._lock:
+            counts = self._latencies.setdefault(endpoint, [0] * (len(LATENCY_BUCKETS_MS) + 1))
+            counts[bucket] += 1
+            totals = self._latency_totals.setdefault(endpoint, [0.0, 0.0])
+            totals[0] += seconds
+            totals[1] = max(totals[1], seconds)
+
+    def close(self) -> None:
+        """
+        Close the pooled connections.
+        """
+        self.session.close()
+
+
+_default_transport: Optional[HttpTransport] = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> HttpTransport:
+    """
+    Return the transport shared by every client that was not given one explicitly.
+
+    Returns:
+        HttpTransport: The process-wide transport, created on first use.
+    """
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HttpTransport()
+        return _default_transport
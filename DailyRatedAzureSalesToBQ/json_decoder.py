@@ -0,0 +1,160 @@
+import io
+import json
+from datetime import date
+from typing import List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.json as pa_json
+    from arrow_schema import json_read_schema, table_to_record_batch
+except ImportError:
+    pa = None
+    pa_json = None
+
+
+class JsonLinesDecoder:
+    """
+    Base class for decoders turning a batch of JSON lines into records with a billing_month field.
+
+    Attributes:
+        name (str): The backend name accepted by get_json_lines_decoder.
+        returns_dicts (bool): Whether decode_lines returns a list of dicts rather than a columnar table.
+    """
+    name = None
+    returns_dicts = True
+
+    def decode_lines(self, lines: List[bytes], billing_month: str):
+        """
+        Decode a batch of JSON lines and add the billing_month field to every record.
+
+        Args:
+            lines (List[bytes]): Complete, non-empty JSON lines.
+            billing_month (str): The billing month formatted as "YYYY-MM-01".
+
+        Returns:
+            The decoded batch, a list of dicts or a columnar table depending on the backend.
+        """
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+class StdlibJsonLinesDecoder(JsonLinesDecoder):
+    """
+    Decoder built on the standard library json module. Always available.
+    """
+    name = 'json'
+
+    def decode_lines(self, lines: List[bytes], billing_month: str) -> List[dict]:
+        # Decoding the batch as a single JSON array avoids a json.loads call per line
+        records = json.loads(b'[' + b','.join(lines) + b']')
+        for record in records:
+            record["billing_month"] = billing_month
+        return records
+
+
+class OrjsonJsonLinesDecoder(JsonLinesDecoder):
+    """
+    Decoder built on orjson, several times faster than the standard library.
+    """
+    name = 'orjson'
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise ImportError("The 'orjson' backend requires the orjson package.")
+
+    def decode_lines(self, lines: List[bytes], billing_month: str) -> List[dict]:
+        records = orjson.loads(b'[' + b','.join(lines) + b']')
+        for record in records:
+            record["billing_month"] = billing_month
+        return records
+
+
+class PyArrowJsonLinesDecoder(JsonLinesDecoder):
+    """
+    Decoder built on pyarrow's multithreaded JSON reader, returning a pyarrow.Table.
+
+    The billing_month field is added as a single column instead of being set on every record.
+    """
+    name = 'pyarrow'
+    returns_dicts = False
+
+    def __init__(self) -> None:
+        if pa_json is None:
+            raise ImportError("The 'pyarrow' backend requires the pyarrow package.")
+
+    def decode_lines(self, lines: List[bytes], billing_month: str) -> "pa.Table":
+        table = pa_json.read_json(io.BytesIO(b'\n'.join(lines)))
+        billing_month_column = pa.array([billing_month] * table.num_rows, type=pa.string())
+        return table.append_column("billing_month", billing_month_column)
+
+
+class ArrowRecordBatchDecoder(JsonLinesDecoder):
+    """
+    Decoder producing pyarrow.RecordBatches typed by a fixed schema, e.g. one derived from the
+    BigQuery schema with arrow_schema.bigquery_schema_to_arrow.
+
+    The lines are read with an explicit schema derived from it, so every batch gets the same types
+    whatever its values, and fields that are not in the schema are ignored. Missing columns are
+    filled with nulls and the billing_month column is typed as in the schema. No per-row Python
+    objects are created. A line whose value does not fit its field's type raises an error.
+
+    Attributes:
+        schema (pa.Schema): The schema of every decoded batch.
+    """
+    name = 'arrow'
+    returns_dicts = False
+
+    def __init__(self, schema: "pa.Schema") -> None:
+        if pa_json is None:
+            raise ImportError("The 'arrow' backend requires the pyarrow package.")
+        self.schema = schema
+        # billing_month is added from the export, never read from the lines
+        read_schema = json_read_schema(pa.schema([field for field in schema if field.name != "billing_month"]))
+        self._parse_options = pa_json.ParseOptions(explicit_schema=read_schema, unexpected_field_behavior="ignore")
+
+    def decode_lines(self, lines: List[bytes], billing_month: str) -> "pa.RecordBatch":
+        table = pa_json.read_json(io.BytesIO(b'\n'.join(lines)), parse_options=self._parse_options)
+        billing_month_column = pa.repeat(date.fromisoformat(billing_month), table.num_rows)
+        table = table.append_column("billing_month", billing_month_column)
+        return table_to_record_batch(table, self.schema)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({len(self.schema)} fields)"
+
+
+JSON_LINES_DECODERS = {
+    decoder.name: decoder
+    for decoder in [StdlibJsonLinesDecoder, OrjsonJsonLinesDecoder, PyArrowJsonLinesDecoder, ArrowRecordBatchDecoder]
+}
+
+
+def get_json_lines_decoder(backend: str = 'auto', **kwargs) -> JsonLinesDecoder:
+    """
+    Return a JSON lines decoder for the requested backend.
+
+    Args:
+        backend (str): One of 'json', 'orjson', 'pyarrow', 'arrow', or 'auto' to pick orjson when it is
+            installed and fall back to the standard library otherwise.
+        **kwargs: Passed to the decoder, e.g. schema for the 'arrow' backend.
+
+    Returns:
+        JsonLinesDecoder: The decoder instance.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        ImportError: If the backend's package is not installed.
+    """
+    if backend == 'auto':
+        backend = 'orjson' if orjson is not None else 'json'
+
+    if backend not in JSON_LINES_DECODERS:
+        raise ValueError(f"Unknown JSON decoder backend '{backend}'. Expected one of {list(JSON_LINES_DECODERS)} or 'auto'.")
+
+    return JSON_LINES_DECODERS[backend](**kwargs)
@@ -1,17 +1,19 @@
-import io
 import os
-from typing import Optional
-from blob_client import AzureBlobDownloader
+from typing import Optional, Tuple
+from async_export_client import DEFAULT_EXPORTS, AsyncExportClient, get_billing_month
+from blob_client import AzureBlobDownloader, DEFAULT_BATCH_SIZE
+from json_decoder import get_json_lines_decoder
 from blob_url_parser import BlobURLParser
 from graph_api_client import GraphAPIClient
 from resource_location import ResourceLocationParser
 from secret_manager import SecretsManager
 from bigquery_writer import BigQueryUploader
+from row_fingerprint import FingerprintStore
 
 def main() -> None:  # Updated to accept request
     """
     Main function to authenticate with Microsoft Graph API, retrieve unbilled usage data, 
-    download it from Azure Blob Storage, unzip it, process the JSON to add a `billing_month` field, 
+    stream every part of the current and last billing period's exports from Azure Blob Storage, unzip it, process the JSON to add a `billing_month` field, 
     and upload the data to BigQuery.
     """
     # Step 1: Retrieve secrets from SecretsManager
@@ -21,10 +23,10 @@ def main() -> None:  # Updated to accept request
     # Step 2: Initialize the Graph API client using credentials from SecretsManager
     print("Initializing GraphAPIClient...")
     graph_client = GraphAPIClient(
-        tenant_id=os.environ.get.tenant_id,
-        client_id=os.environ.get.client_id,
-        client_secret=os.environ.get.client_secret,
-        scope=os.environ.get.scope
+        tenant_id=os.environ.get("TENANT_ID"),
+        client_id=os.environ.get("CLIENT_ID"),
+        client_secret=os.environ.get("CLIENT_SECRET"),
+        scope=os.environ.get("SCOPE")
     )
 
     # Step 3: Authenticate and obtain an access token
@@ -32,75 +34,70 @@ def main() -> None:  # Updated to accept request
     if not access_token:
         raise Exception("Failed to authenticate with Microsoft.")
 
-    # Step 4: Initialize an unbilled request for the current billing period
-    print("Initializing unbilled request...")
-    headers = graph_client.initialize_unbilled_request(api_url=secrets.unbilled_endpoint, billing_period='current')
-    operation_url: Optional[str] = headers.get('Location')
-    if not operation_url:
-        raise Exception("Failed to initialize unbilled request.")
-
-    # Step 5: Check the status of the unbilled operation request
-    result = graph_client.check_operation_status(operation_url)
-    
-    # Step 6: Parse the resource location details from the response
-    resource_location: Optional[str] = result.get('resourceLocation')
-    if not resource_location:
-        raise Exception("Resource location not found in the result.")
-
-    # Step 7: Parse the resource location to extract storage account details
-    resource_parser = ResourceLocationParser(resource_location)
-    parsed_location = resource_parser.parse_resource_location()
-    
-    root_directory = parsed_location['rootDirectory']
-    sas_token = parsed_location['sasToken']
-    blob_name = parsed_location['blobName']
-
-    # Step 8: Extract the storage account name and container name from the root directory URL
-    print("Extracting storage account and container information...")
-    blob_parser = BlobURLParser(root_directory)
-    storage_account_name, container_name = blob_parser.extract_storage_info()
-    print(f"Extracted Storage Account Name & Container Name")
-
-    # Step 9: In-memory stream for blob data
-    blob_stream = io.BytesIO()
-
-    # Step 10: Initialize the Azure Blob Downloader and download the blob into an in-memory stream
-    print("Downloading blob from Azure Blob Storage...")
-    downloader = AzureBlobDownloader(storage_account_name, sas_token, container_name, blob_name)
-    downloader.download_blob_to_stream(container_name, blob_name, blob_stream)
-
-    # Step 11: Unzip the in-memory stream
-    unzipped_stream = downloader.unzip_blob_stream(blob_stream)
-
-    # Step 12: Ensure the unzipped stream contains data
-    print("Verifying the unzipped stream...")
-    unzipped_stream.seek(0)  # Reset the pointer for further operations
-    if not unzipped_stream.read(1):  # Check if there's any data
-        raise Exception("Blob download or unzip failed.")
-    print("Unzipped stream verification successful.")
-
-    # Step 13: Reset the pointer of unzipped stream for processing
-    unzipped_stream.seek(0)
-
-    # Step 14: Process the unzipped stream to add the `billing_month` field
-    json_data = downloader.process_stream_to_json_with_billing_month(unzipped_stream)
-
-    # Step 15: Initialize BigQueryUploader with credentials from SecretsManager
-    print("Initializing BigQueryUploader...")
-    uploader = BigQueryUploader(
-        project_id=os.environ.get.project_id,
-        dataset_id=os.environ.get.dataset_id,
-        table_id=os.environ.get.table_id
-    )
-
-    # Step 16: Ensure the BigQuery table exists or will be created on upload
+    # Step 4: Ensure the BigQuery table exists before the exports upload to it concurrently
     print("Ensuring the BigQuery table exists...")
-    uploader.create_table_if_not_exists()
-
-    # Step 17: Upload the processed data to BigQuery
-    print("Uploading data to BigQuery...")
-    uploader.upload_data(json_data)
-    print("Processed blob data with billing month uploaded to BigQuery successfully.")
+    BigQueryUploader(
+        project_id=os.environ.get("PROJECT_ID"),
+        dataset_id=os.environ.get("DATASET_ID"),
+        table_id=os.environ.get("TABLE_ID")
+    ).create_table_if_not_exists()
+    fingerprint_state_dir: Optional[str] = os.environ.get("FINGERPRINT_STATE_DIR")
+
+    # Step 5: Start the unbilled exports of the current and last billing period at once. Each export is
+    # polled on its own schedule and uploaded as soon as it succeeds, while the other is still running
+    def upload_export(export: Tuple[str, str], result: dict) -> None:
+        billing_period, currency_code = export
+        billing_month = get_billing_month(billing_period)
+
+        # Step 6: Parse the resource location details from the response
+        resource_location: Optional[str] = result.get('resourceLocation')
+        if not resource_location:
+            raise Exception(f"Resource location not found in the result of the {billing_period} export.")
+
+        # Step 7: Parse the resource location to extract storage account details
+        resource_parser = ResourceLocationParser(resource_location)
+        parsed_location = resource_parser.parse_resource_location()
+
+        root_directory = parsed_location['rootDirectory']
+        sas_token = parsed_location['sasToken']
+        blob_name = parsed_location['blobName']
+        blob_names = resource_parser.parse_blob_names()
+
+        # Step 8: Extract the storage account name and container name from the root directory URL
+        print("Extracting storage account and container information...")
+        blob_parser = BlobURLParser(root_directory)
+        storage_account_name, container_name = blob_parser.extract_storage_info()
+        print(f"Extracted Storage Account Name & Container Name")
+
+        # Step 9: Initialize the Azure Blob Downloader, decoding straight into Arrow record batches typed by the BigQuery schema
+        decoder = get_json_lines_decoder('arrow', schema=BigQueryUploader.get_arrow_schema())
+        downloader = AzureBlobDownloader(storage_account_name, sas_token, container_name, blob_name, decoder=decoder,
+                                         billing_month=billing_month)
+
+        # Step 10: Stream every blob of the export in parallel, unzipping and parsing them into batches of records
+        # with the `billing_month` field. Batches are consumed lazily by the uploader, so the export is never held
+        # in memory as a whole.
+        print(f"Streaming {len(blob_names)} blob(s) of the {billing_period} export from Azure Blob Storage...")
+        record_batches = downloader.iter_record_batches_from_blobs(container_name, blob_names, batch_size=DEFAULT_BATCH_SIZE)
+
+        # Step 11: Initialize BigQueryUploader with credentials from SecretsManager
+        print("Initializing BigQueryUploader...")
+        uploader = BigQueryUploader(
+            project_id=os.environ.get("PROJECT_ID"),
+            dataset_id=os.environ.get("DATASET_ID"),
+            table_id=os.environ.get("TABLE_ID")
+        )
+
+        # Step 12: Upload the processed data to BigQuery batch by batch. When a fingerprint state directory is
+        # configured, only the rows that changed since the previous run are merged into the billing month.
+        print(f"Uploading billing_month {billing_month} to BigQuery...")
+        if fingerprint_state_dir:
+            uploader.upload_incremental(record_batches, FingerprintStore(fingerprint_state_dir, uploader.table_id))
+        else:
+            uploader.upload_batches(record_batches)
+        print(f"Processed blob data with billing month {billing_month} uploaded to BigQuery successfully.")
+
+    AsyncExportClient(graph_client).run_exports(secrets.unbilled_endpoint, DEFAULT_EXPORTS, upload_export)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,231 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+# Overall time an export may take before polling gives up.
+DEFAULT_DEADLINE = 2 * 60 * 60
+
+# Bounds of the delay between two polls once the export is expected to complete.
+DEFAULT_MIN_INTERVAL = 2
+DEFAULT_MAX_INTERVAL = 60
+
+# Delay used while there is no history and the server sends no Retry-After.
+DEFAULT_RETRY_AFTER = 10
+
+# Number of past completion times kept per endpoint and billing period.
+DEFAULT_HISTORY_SIZE = 50
+
+# Path segments that identify a single operation, e.g. GUIDs, are left out of the history key.
+_ID_SEGMENT = re.compile(r'^(?=.*\d)[\w.-]{6,}$')
+
+# Completion times needed before the history is trusted over the server's Retry-After.
+MIN_HISTORY_SAMPLES = 3
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    """
+    Return the nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class PollSchedule:
+    """
+    The polling schedule of a single export, handed out by PollingPolicy.start.
+
+    Attributes:
+        key (str): The endpoint and billing period of the export.
+        expected (Optional[float]): The median completion time in seconds, None without enough history.
+        late (Optional[float]): The 90th percentile completion time in seconds, None without enough history.
+        deadline (float): The number of seconds after which polling gives up.
+        polls (int): The number of polls so far.
+    """
+
+    def __init__(self, policy: "PollingPolicy", key: str, expected: Optional[float], late: Optional[float]) -> None:
+        self.policy = policy
+        self.key = key
+        self.expected = expected
+        self.late = late
+        self.deadline = policy.deadline
+        self.polls = 0
+        self.start_time = time.monotonic()
+
+    def next_delay(self, retry_after: Optional[float] = None) -> float:
+        """
+        Return how long to wait before the next poll.
+
+        Without history, the server's Retry-After is followed. With history, there is no poll until just
+        before the median completion time, then polls are tight and back off gradually as the export runs late.
+
+        Args:
+            retry_after (Optional[float]): The Retry-After of the last poll, in seconds.
+
+        Returns:
+            float: The delay in seconds, never past the deadline.
+
+        Raises:
+            TimeoutError: If the deadline has passed.
+        """
+        self.polls += 1
+        elapsed = self.elapsed()
+        if elapsed >= self.deadline:
+            raise TimeoutError(f"Export '{self.key}' did not complete within {self.deadline} seconds ({self.polls} polls).")
+
+        if self.expected is None:
+            delay = min(retry_after if retry_after is not None else DEFAULT_RETRY_AFTER, self.policy.max_interval)
+        elif elapsed < self.expected - self.policy.min_interval:
+            # Sleep until just before the expected completion
+            delay = self.expected - self.policy.min_interval - elapsed
+        else:
+            # Poll tightly around the expected completion, then back off in proportion to how late the export
+            # is, faster once it is later than the 90th percentile
+            backoff = (elapsed - self.expected) / (8 if elapsed < self.late else 4)
+            delay = min(self.policy.max_interval, max(self.policy.min_interval, backoff))
+
+        return max(0.0, min(delay, self.deadline - elapsed))
+
+    def complete(self) -> float:
+        """
+        Record the completion time of the export in the policy's history.
+
+        Returns:
+            float: The completion time in seconds.
+        """
+        duration = self.elapsed()
+        self.policy.record(self.key, duration)
+        print(f"Export '{self.key}' completed in {duration:.1f} seconds after {self.polls + 1} polls.")
+        return duration
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+
+class PollingPolicy:
+    """
+    Decides when to poll long-running billing exports, learning from how long past exports took.
+
+    Completion times are kept per endpoint and billing period, optionally in a JSON history file so they
+    carry over between runs. Each export gets a PollSchedule that sleeps until close to the median
+    completion time, polls tightly around it, and gives up at the deadline.
+
+    Attributes:
+        history_file (Optional[str]): The path of the JSON history file. Defaults to in-memory history only.
+        deadline (float): The number of seconds after which polling gives up.
+        min_interval (float): The delay between polls around the expected completion time.
+        max_interval (float): The longest delay between polls once the export is expected to be done.
+        history_size (int): The number of completion times kept per key.
+    """
+
+    def __init__(self, history_file: Optional[str] = None, deadline: float = DEFAULT_DEADLINE,
+                 min_interval: float = DEFAULT_MIN_INTERVAL, max_interval: float = DEFAULT_MAX_INTERVAL,
+                 history_size: int = DEFAULT_HISTORY_SIZE) -> None:
+        """
+        Initialize the policy, loading the history file if there is one.
+
+        Args:
+            history_file (Optional[str]): The path of the JSON history file.
+            deadline (float): The number of seconds after which polling gives up.
+            min_interval (float): The delay between polls around the expected completion time.
+            max_interval (float): The longest delay between polls once the export is expected to be done.
+            history_size (int): The number of completion times kept per key.
+        """
+        self.history_file = history_file
+        self.deadline = deadline
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.history_size = history_size
+        self._lock = threading.Lock()
+        self.history: Dict[str, List[float]] = self._load_history()
+
+    @staticmethod
+    def get_key(api_url: str, billing_period: str) -> str:
+        """
+        Return the history key of an export, e.g. "graph.microsoft.com/v1.0/.../unbilled/usageLineItems:current".
+
+        Segments identifying a single operation are replaced by "{id}", so an operation URL gives the same
+        key on every run instead of adding a new entry to the history.
+
+        Args:
+            api_url (str): The API URL the export was requested from.
+            billing_period (str): The billing period of the export.
+
+        Returns:
+            str: The history key.
+        """
+        parts = urlsplit(api_url)
+        path = '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in parts.path.split('/'))
+        return f"{parts.netloc}{path}:{billing_period}"
+
+    def start(self, key: str) -> PollSchedule:
+        """
+        Start the schedule of a new export.
+
+        Args:
+            key (str): The history key of the export, see get_key.
+
+        Returns:
+            PollSchedule: The schedule, started now.
+        """
+        with self._lock:
+            durations = list(self.history.get(key, []))
+
+        if len(durations) < MIN_HISTORY_SAMPLES:
+            return PollSchedule(self, key, None, None)
+
+        expected = _percentile(durations, 50)
+        late = _percentile(durations, 90)
+        print(f"Export '{key}' usually completes in {expected:.0f} seconds (p90 {late:.0f} seconds).")
+        return PollSchedule(self, key, expected, late)
+
+    def percentiles(self, key: str) -> Dict[str, float]:
+        """
+        Return the completion time percentiles of a key.
+
+        Args:
+            key (str): The history key.
+
+        Returns:
+            Dict[str, float]: The p50, p90 and max completion times in seconds, empty without history.
+        """
+        with self._lock:
+            durations = list(self.history.get(key, []))
+        if not durations:
+            return {}
+        return {'p50': _percentile(durations, 50), 'p90': _percentile(durations, 90), 'max': max(durations)}
+
+    def record(self, key: str, duration: float) -> None:
+        """
+        Add a completion time to the history and save it.
+
+        Args:
+            key (str): The history key.
+            duration (float): The completion time in seconds.
+        """
+        with self._lock:
+            durations = self.history.setdefault(key, [])
+            durations.append(round(duration, 1))
+            del durations[:-self.history_size]
+            if self.history_file:
+                self._save_history()
+
+    def _load_history(self) -> Dict[str, List[float]]:
+        if not self.history_file:
+            return {}
+        try:
+            with open(self.history_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_history(self) -> None:
+        temp_file = f"{self.history_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(self.history, f, indent=2)
+        os.replace(temp_file, self.history_file)
@@ -27,6 +27,8 @@ class SecretsManager:
             self.blob_container_name = os.getenv('BLOB_CONTAINER_NAME')
             self.blob_directory_name = os.getenv('BLOB_DIRECTORY_NAME')
             self.blob_connection_string = os.getenv('BLOB_CONNECTION_STRING')
+            self.token_cache_file = os.getenv('TOKEN_CACHE_FILE')
+            self.polling_history_file = os.getenv('POLLING_HISTORY_FILE')
         else:
             print("couldnt load env.")
             return
@@ -0,0 +1,145 @@
+from typing import List, Optional, Set
+import pyarrow as pa
+import pyarrow.compute as pc
+from google.cloud import bigquery
+
+# Arrow types used for each BigQuery column type.
+BIGQUERY_TO_ARROW_TYPES = {
+    "STRING": pa.string(),
+    "FLOAT": pa.float64(),
+    "INTEGER": pa.int64(),
+    "BOOLEAN": pa.bool_(),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    "DATE": pa.date32(),
+}
+
+# STRING columns with mostly unique values, which gain nothing from dictionary encoding.
+HIGH_CARDINALITY_FIELDS = {"ResourceURI", "Tags", "AdditionalInfo", "ServiceInfo1", "ServiceInfo2"}
+
+
+def bigquery_schema_to_arrow(schema_fields: List[bigquery.SchemaField], dictionary_exclude: Optional[Set[str]] = None) -> pa.Schema:
+    """
+    Derive an Arrow schema from a list of BigQuery SchemaFields, keeping the field order.
+
+    STRING columns are dictionary encoded, except those listed in dictionary_exclude, because
+    values such as PartnerName or CustomerName repeat on almost every row.
+
+    Args:
+        schema_fields (List[bigquery.SchemaField]): The BigQuery schema, e.g. BigQueryUploader._get_explicit_schema().
+        dictionary_exclude (Optional[Set[str]]): STRING columns to keep as plain strings. Defaults to HIGH_CARDINALITY_FIELDS.
+
+    Returns:
+        pa.Schema: The equivalent Arrow schema.
+
+    Raises:
+        ValueError: If a field type has no Arrow equivalent.
+    """
+    if dictionary_exclude is None:
+        dictionary_exclude = HIGH_CARDINALITY_FIELDS
+
+    arrow_fields = []
+    for field in schema_fields:
+        if field.field_type not in BIGQUERY_TO_ARROW_TYPES:
+            raise ValueError(f"Unsupported BigQuery type '{field.field_type}' for field '{field.name}'.")
+
+        arrow_type = BIGQUERY_TO_ARROW_TYPES[field.field_type]
+        if field.field_type == "STRING" and field.name not in dictionary_exclude:
+            arrow_type = pa.dictionary(pa.int32(), pa.string())
+        arrow_fields.append(pa.field(field.name, arrow_type, nullable=field.mode != "REQUIRED"))
+
+    return pa.schema(arrow_fields)
+
+
+def json_read_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Derive the explicit schema given to pyarrow's JSON reader, so every batch is read with the same types.
+
+    The reader cannot produce dictionary columns nor parse timestamps without a zone offset as UTC, so
+    those columns are read as strings and converted by cast_column afterwards.
+
+    Args:
+        schema (pa.Schema): The target schema, e.g. from bigquery_schema_to_arrow.
+
+    Returns:
+        pa.Schema: The schema to read the JSON lines with.
+    """
+    read_fields = []
+    for field in schema:
+        read_type = field.type
+        if pa.types.is_dictionary(read_type) or pa.types.is_timestamp(read_type) or pa.types.is_date(read_type):
+            read_type = pa.string()
+        read_fields.append(field.with_type(read_type))
+    return pa.schema(read_fields)
+
+
+def cast_column(column: pa.Array, arrow_type: pa.DataType) -> pa.Array:
+    """
+    Cast a column with inferred types to the type required by the schema.
+
+    Timestamps without a zone offset are taken to be UTC, as in the billing exports.
+
+    Args:
+        column (pa.Array): The column as read, e.g. by pyarrow.json.read_json.
+        arrow_type (pa.DataType): The target type.
+
+    Returns:
+        pa.Array: The column cast to arrow_type.
+    """
+    if column.type == arrow_type:
+        return column
+
+    if pa.types.is_dictionary(arrow_type):
+        return cast_column(column, arrow_type.value_type).dictionary_encode().cast(arrow_type)
+
+    if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+        timestamps = _cast_to_utc_timestamp(column)
+        if pa.types.is_date(arrow_type):
+            return timestamps.cast(arrow_type)
+        return timestamps.cast(arrow_type, safe=False)
+
+    if pa.types.is_string(arrow_type) and pa.types.is_timestamp(column.type):
+        # Inferred timestamps are turned back into their ISO 8601 form
+        return pc.strftime(column, format="%Y-%m-%dT%H:%M:%SZ")
+
+    return column.cast(arrow_type)
+
+
+def _cast_to_utc_timestamp(column: pa.Array) -> pa.Array:
+    """
+    Cast a string or timestamp column to a nanosecond UTC timestamp.
+    """
+    if pa.types.is_timestamp(column.type):
+        if column.type.tz is None:
+            return pc.assume_timezone(column.cast(pa.timestamp("ns")), "UTC")
+        return column.cast(pa.timestamp("ns", tz="UTC"))
+
+    column = column.cast(pa.string())
+    try:
+        return column.cast(pa.timestamp("ns", tz="UTC"))
+    except pa.ArrowInvalid:
+        # Values without a zone offset, e.g. "2024-10-01" or "2024-10-01T00:00:00"
+        return pc.assume_timezone(column.cast(pa.timestamp("ns")), "UTC")
+
+
+def table_to_record_batch(table: pa.Table, schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Conform a table to a schema: select and order its columns, cast them, and add missing ones as nulls.
+
+    Columns of the table that are not in the schema are dropped.
+
+    Args:
+        table (pa.Table): The table as read, with inferred types.
+        schema (pa.Schema): The target schema.
+
+    Returns:
+        pa.RecordBatch: A single record batch with the given schema.
+    """
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table.column(field.name).combine_chunks()
+            columns.append(cast_column(column, field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, type=field.type))
+
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
@@ -0,0 +1,58 @@
+import io
+import json
+import time
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud.bigquery import SourceFormat
+from arrow_schema import table_to_record_batch
+from bigquery_writer import BigQueryUploader
+from benchmark_json_decoder import make_synthetic_lines
+
+
+def main() -> None:
+    """
+    Compare the bytes and time needed to send rows to BigQuery as newline-delimited JSON and as Parquet.
+
+    Without --project the benchmark only measures serialization. With --project, --dataset and --table it
+    also runs real load jobs against that (scratch) table with both source formats.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark BigQuery load formats.")
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--project")
+    parser.add_argument("--dataset")
+    parser.add_argument("--table")
+    args = parser.parse_args()
+
+    rows = [json.loads(line) for line in make_synthetic_lines(args.records)]
+    for row in rows:
+        row["billing_month"] = "2024-10-01"
+
+    # Same serialization as load_table_from_json
+    start_time = time.perf_counter()
+    ndjson_size = len("\n".join(json.dumps(row, ensure_ascii=False) for row in rows).encode("utf-8"))
+    print(f"{'NEWLINE_DELIMITED_JSON':<24} {ndjson_size / 1024 / 1024:>10.1f} MB {time.perf_counter() - start_time:>8.2f} s")
+
+    arrow_schema = BigQueryUploader.get_arrow_schema()
+    for compression in ["zstd", "snappy", "gzip"]:
+        # Same conversion as BigQueryUploader._rows_to_table and _load_parquet
+        start_time = time.perf_counter()
+        table = pa.Table.from_batches([table_to_record_batch(pa.Table.from_pylist(rows), arrow_schema)])
+        parquet_buffer = io.BytesIO()
+        pq.write_table(table, parquet_buffer, compression=compression)
+        label = f"PARQUET ({compression})"
+        print(f"{label:<24} {parquet_buffer.tell() / 1024 / 1024:>10.1f} MB {time.perf_counter() - start_time:>8.2f} s")
+
+    if not (args.project and args.dataset and args.table):
+        return
+
+    for source_format in [SourceFormat.NEWLINE_DELIMITED_JSON, SourceFormat.PARQUET]:
+        uploader = BigQueryUploader(args.project, args.dataset, args.table, source_format=source_format)
+        uploader.create_table_if_not_exists()
+        start_time = time.perf_counter()
+        uploader.upload_data(rows)
+        print(f"{source_format:<24} load wall time {time.perf_counter() - start_time:>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
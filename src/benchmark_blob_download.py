@@ -0,0 +1,68 @@
+import io
+import time
+import argparse
+from blob_client import AzureBlobDownloader, DEFAULT_RANGE_SIZE, DEFAULT_MAX_CONCURRENCY, DEFAULT_MEMORY_BUDGET
+
+
+def time_download(label: str, download, repeat: int) -> None:
+    """
+    Run a download function several times and print its best throughput in MB/s.
+
+    Args:
+        label (str): The name of the download path being measured.
+        download (callable): A function downloading the blob and returning the number of bytes downloaded.
+        repeat (int): The number of times to run the download.
+    """
+    best_seconds = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        size = download()
+        seconds = time.perf_counter() - start_time
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+
+    print(f"{label:<24} {size / 1024 / 1024:>10.1f} MB {best_seconds:>8.2f} s {size / best_seconds / 1024 / 1024:>10.1f} MB/s")
+
+
+def main() -> None:
+    """
+    Compare the throughput of download_blob_to_stream with download_blob_ranged on the same blob.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark single blob download paths.")
+    parser.add_argument("--account-url", required=True, help="Storage account URL, e.g. https://<account>.blob.core.windows.net")
+    parser.add_argument("--sas-token", required=True, help="SAS token with read access to the blob")
+    parser.add_argument("--container", required=True, help="Container name, including any directory path")
+    parser.add_argument("--blob", required=True, help="Blob name")
+    parser.add_argument("--range-size-mb", type=int, default=DEFAULT_RANGE_SIZE // 1024 // 1024)
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--memory-budget-mb", type=int, default=DEFAULT_MEMORY_BUDGET // 1024 // 1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    downloader = AzureBlobDownloader(args.account_url, args.sas_token, args.container, args.blob)
+
+    def download_to_stream() -> int:
+        stream = io.BytesIO()
+        downloader.download_blob_to_stream(args.container, args.blob, stream)
+        return stream.getbuffer().nbytes
+
+    def download_ranged(use_temp_file: bool) -> int:
+        stream = downloader.download_blob_ranged(
+            args.container,
+            args.blob,
+            range_size=args.range_size_mb * 1024 * 1024,
+            max_concurrency=args.max_concurrency,
+            memory_budget=args.memory_budget_mb * 1024 * 1024,
+            use_temp_file=use_temp_file
+        )
+        stream.seek(0, io.SEEK_END)
+        size = stream.tell()
+        stream.close()
+        return size
+
+    time_download("download_blob_to_stream", download_to_stream, args.repeat)
+    time_download("ranged (memory)", lambda: download_ranged(False), args.repeat)
+    time_download("ranged (temp file)", lambda: download_ranged(True), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
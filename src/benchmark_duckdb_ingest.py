@@ -0,0 +1,88 @@
+import io
+import os
+import gzip
+import time
+import argparse
+import tempfile
+from typing import List
+from benchmark_json_decoder import make_synthetic_lines, timed
+from blob_client import AzureBlobDownloader
+from duckdb_warehouse import DuckDBWarehouse, write_usage_parquet
+
+
+def write_synthetic_export(directory: str, record_count: int, file_count: int) -> List[str]:
+    """
+    Write a synthetic unbilled usage export as gzipped JSON lines files.
+
+    Args:
+        directory (str): The directory of the files.
+        record_count (int): The total number of records.
+        file_count (int): The number of files the records are split into, like the blobs of an export.
+
+    Returns:
+        List[str]: The paths of the files.
+    """
+    lines = make_synthetic_lines(record_count)
+    per_file = -(-record_count // file_count)
+    paths = []
+    for index in range(file_count):
+        path = os.path.join(directory, f"part-{index:05d}.json.gz")
+        with gzip.open(path, 'wb') as f:
+            f.write(b'\n'.join(lines[index * per_file:(index + 1) * per_file]) + b'\n')
+        paths.append(path)
+    return paths
+
+
+def python_baseline(downloader: AzureBlobDownloader, paths: List[str]) -> int:
+    """
+    Unzip each file in memory and decode it into dicts with process_stream_to_json_with_billing_month.
+    """
+    record_count = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            unzipped_stream = downloader.unzip_blob_stream(io.BytesIO(f.read()))
+        record_count += len(downloader.process_stream_to_json_with_billing_month(unzipped_stream))
+    return record_count
+
+
+def main() -> None:
+    """
+    Compare the Python decode of process_stream_to_json_with_billing_month with DuckDB's read_json on the same export.
+
+    When --path is given, the benchmark runs on those local gzipped export files, e.g. from the blob cache.
+    Otherwise it writes a synthetic export following the BigQuery schema.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark loading gzipped JSON lines exports into DuckDB.")
+    parser.add_argument("--path", action="append", help="Local gzipped export file, may be repeated")
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--files", type=int, default=4, help="Number of files of the synthetic export")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    billing_month = "2024-10-01"
+    with tempfile.TemporaryDirectory() as directory:
+        paths = args.path or write_synthetic_export(directory, args.records, args.files)
+        compressed_bytes = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} file(s), {compressed_bytes / 1024 / 1024:.1f} MB compressed")
+
+        # The downloader is only used for its decoding, it never connects to the storage account
+        downloader = AzureBlobDownloader("https://benchmark.blob.core.windows.net", None, "benchmark", None)
+        warehouse = DuckDBWarehouse(':memory:')
+        parquet_path = os.path.join(directory, "usage.parquet")
+
+        candidates = {
+            "python dicts": lambda: python_baseline(downloader, paths),
+            "duckdb table": lambda: warehouse.load_usage_files(paths, billing_month),
+            "duckdb parquet": lambda: write_usage_parquet(paths, billing_month, parquet_path),
+        }
+        record_count = python_baseline(downloader, paths)
+        results = {label: min(timed(load) for _ in range(args.repeat)) for label, load in candidates.items()}
+        warehouse.close()
+
+    print()
+    for label, best_seconds in results.items():
+        print(f"{label:<16} {best_seconds:>8.3f} s {record_count / best_seconds:>12,.0f} records/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import time
+import json
+import random
+import argparse
+from bigquery_writer import BigQueryUploader
+from json_decoder import JSON_LINES_DECODERS, get_json_lines_decoder
+
+
+def make_synthetic_lines(record_count: int, seed: int = 0) -> list[bytes]:
+    """
+    Build JSON lines shaped like the unbilled usage export, following the BigQuery schema.
+
+    Args:
+        record_count (int): The number of records to generate.
+        seed (int): Seed for the random values, so runs are comparable.
+
+    Returns:
+        list[bytes]: One encoded JSON line per record, without the billing_month field.
+    """
+    rng = random.Random(seed)
+    fields = [field for field in BigQueryUploader._get_explicit_schema() if field.name != "billing_month"]
+    # A small pool per column mimics the heavy repetition of partner, customer and meter names
+    string_pools = {field.name: [f"{field.name}-{i:04d}" for i in range(50)] for field in fields}
+
+    lines = []
+    for _ in range(record_count):
+        record = {}
+        for field in fields:
+            if field.field_type == "FLOAT":
+                record[field.name] = round(rng.uniform(0, 1000), 6)
+            elif field.field_type == "TIMESTAMP":
+                record[field.name] = f"2024-10-{rng.randint(1, 28):02d}T00:00:00Z"
+            elif field.field_type == "DATE":
+                record[field.name] = f"2024-10-{rng.randint(1, 28):02d}"
+            else:
+                record[field.name] = rng.choice(string_pools[field.name])
+        lines.append(json.dumps(record).encode('utf-8'))
+    return lines
+
+
+def per_line_baseline(lines: list[bytes], billing_month: str) -> list[dict]:
+    """
+    The original per-line loop of process_stream_to_json_with_billing_month.
+    """
+    processed_data = []
+    for line in lines:
+        json_obj = json.loads(line.decode('utf-8'))
+        json_obj["billing_month"] = billing_month
+        processed_data.append(json_obj)
+    return processed_data
+
+
+def main() -> None:
+    """
+    Compare the per-line json.loads loop with every installed JSON lines decoder backend.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark JSON lines decoder backends.")
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = make_synthetic_lines(args.records)
+    batches = [lines[i:i + args.batch_size] for i in range(0, len(lines), args.batch_size)]
+    billing_month = "2024-10-01"
+    print(f"{args.records} synthetic records, {sum(map(len, lines)) / 1024 / 1024:.1f} MB, batches of {args.batch_size}")
+
+    candidates = {"per-line json.loads": lambda: per_line_baseline(lines, billing_month)}
+    for backend in JSON_LINES_DECODERS:
+        try:
+            if backend == 'arrow':
+                decoder = get_json_lines_decoder(backend, schema=BigQueryUploader.get_arrow_schema())
+            else:
+                decoder = get_json_lines_decoder(backend)
+        except ImportError as e:
+            print(f"Skipping '{backend}': {e}")
+            continue
+        candidates[backend] = lambda decoder=decoder: [decoder.decode_lines(batch, billing_month) for batch in batches]
+
+    for label, decode in candidates.items():
+        best_seconds = min(timed(decode) for _ in range(args.repeat))
+        print(f"{label:<22} {best_seconds:>8.3f} s {args.records / best_seconds:>12,.0f} records/s")
+
+
+def timed(function) -> float:
+    """
+    Return the wall time in seconds of a single call.
+    """
+    start_time = time.perf_counter()
+    function()
+    return time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    main()
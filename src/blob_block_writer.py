@@ -0,0 +1,155 @@
+import base64
+import io
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import List, Optional, Set
+from azure.storage.blob import BlobBlock, BlobClient
+
+# Size of each staged block. Larger blocks mean fewer requests, smaller ones less memory per upload.
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Number of blocks uploaded at once.
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Block blobs are limited to 50,000 committed blocks.
+MAX_BLOCK_COUNT = 50000
+
+
+class BlockBlobWriter(io.RawIOBase):
+    """
+    Writable stream uploading to a block blob as data is written.
+
+    Written bytes are cut into blocks of block_size, and each block is staged with stage_block in a worker
+    thread while the caller keeps writing. close commits the block list, which creates or replaces the
+    blob in one step, so readers never see a partial file. Memory stays at one block being filled plus at
+    most max_concurrency blocks uploading, whatever the size of the blob.
+
+    If the writer is used as a context manager and the block raises, the upload is aborted: nothing is
+    committed, and Blob Storage discards the staged blocks.
+
+    Attributes:
+        blob_client (BlobClient): The client of the blob to write.
+        block_size (int): The size in bytes of each staged block.
+        max_concurrency (int): The number of blocks uploaded at once.
+        bytes_written (int): The number of bytes written so far.
+    """
+
+    def __init__(self, blob_client: BlobClient, block_size: int = DEFAULT_BLOCK_SIZE,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> None:
+        """
+        Initialize the writer.
+
+        Args:
+            blob_client (BlobClient): The client of the blob to write.
+            block_size (int): The size in bytes of each staged block.
+            max_concurrency (int): The number of blocks uploaded at once.
+        """
+        super().__init__()
+        self.blob_client = blob_client
+        self.block_size = block_size
+        self.max_concurrency = max_concurrency
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._block_ids: List[str] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._uploads: Set[Future] = set()
+        self._aborted = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        """
+        Append data to the blob, staging every block that fills up.
+
+        Args:
+            data: The bytes to write.
+
+        Returns:
+            int: The number of bytes written.
+
+        Raises:
+            ValueError: If the writer is closed.
+            Exception: If an earlier block failed to upload.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed BlockBlobWriter.")
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._stage_block(block)
+        return len(data)
+
+    def close(self) -> None:
+        """
+        Stage the last block and commit the block list.
+
+        Raises:
+            Exception: If a block failed to upload or the commit failed.
+        """
+        if self.closed:
+            return
+        try:
+            if not self._aborted:
+                if self._buffer or not self._block_ids:
+                    self._stage_block(bytes(self._buffer))
+                    self._buffer = bytearray()
+                self._wait_for_uploads(0)
+                self.blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in self._block_ids])
+                print(f"Committed {len(self._block_ids)} block(s), {self.bytes_written} bytes, to {self.blob_client.blob_name}.")
+        finally:
+            self._shutdown()
+            super().close()
+
+    def abort(self) -> None:
+        """
+        Stop the upload without committing, leaving any existing blob unchanged.
+        """
+        if self.closed:
+            return
+        self._aborted = True
+        self._buffer = bytearray()
+        for future in self._uploads:
+            future.cancel()
+        self._shutdown()
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def __del__(self) -> None:
+        # A writer dropped without close is an interrupted upload, never commit it
+        if not self.closed:
+            self.abort()
+
+    def _stage_block(self, block: bytes) -> None:
+        if len(self._block_ids) >= MAX_BLOCK_COUNT:
+            raise Exception(f"Blob {self.blob_client.blob_name} exceeds {MAX_BLOCK_COUNT} blocks, use a larger block_size.")
+
+        # Block IDs must have the same length within a blob
+        block_id = base64.b64encode(f"{len(self._block_ids):08d}".encode('utf-8')).decode('utf-8')
+        self._block_ids.append(block_id)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='stage-block')
+        self._wait_for_uploads(self.max_concurrency - 1)
+        self._uploads.add(self._executor.submit(self.blob_client.stage_block, block_id, block, length=len(block)))
+
+    def _wait_for_uploads(self, max_pending: int) -> None:
+        """
+        Wait until at most max_pending blocks are uploading, raising the error of any failed upload.
+        """
+        while len(self._uploads) > max_pending:
+            done, self._uploads = wait(self._uploads, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+    def _shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._uploads = set()
@@ -0,0 +1,156 @@
+from typing import List, Optional
+import pyarrow as pa
+from duckdb_warehouse import DuckDBWarehouse
+from secret_manager import SecretsManager
+
+# Table of the reconciliation result in the warehouse.
+DEFAULT_RESULT_TABLE = 'cost_vs_sales'
+
+# Keys the cost and sales sides are aggregated and matched on.
+RECONCILIATION_KEYS = ('customer_id', 'subscription_id', 'product_id', 'sku_id', 'month')
+
+# Usage rows aggregated to the cost of each key. IDs are lower-cased as the two APIs do not agree on case.
+COST_SQL = """
+SELECT lower("CustomerId") AS customer_id,
+       lower("SubscriptionId") AS subscription_id,
+       "ProductId" AS product_id,
+       "SkuId" AS sku_id,
+       billing_month AS month,
+       any_value("CustomerName") AS customer_name,
+       any_value("ProductName") AS product_name,
+       any_value("SkuName") AS sku_name,
+       any_value("BillingCurrency") AS cost_currency,
+       sum("BillingPreTaxTotal") AS cost_billing,
+       sum("PricingPreTaxTotal") AS cost_pricing,
+       count(*) AS usage_rows
+FROM unbilled_usage
+{where}
+GROUP BY ALL
+"""
+
+# Invoice line items aggregated to the sales of each key, dated by the month their charge starts in.
+SALES_SQL = """
+SELECT lower("customerId") AS customer_id,
+       lower("subscriptionId") AS subscription_id,
+       "productId" AS product_id,
+       "skuId" AS sku_id,
+       CAST(date_trunc('month', "chargeStartDate") AS DATE) AS month,
+       any_value("customerName") AS customer_name,
+       any_value("productName") AS product_name,
+       any_value("skuName") AS sku_name,
+       any_value(currency) AS sales_currency,
+       sum(subtotal) AS sales,
+       sum("totalForCustomer") AS sales_with_tax,
+       count(*) AS line_items
+FROM recon_line_items
+{where}
+GROUP BY ALL
+"""
+
+
+def reconcile_cost_vs_sales(warehouse: DuckDBWarehouse, months: Optional[List[str]] = None,
+                            table_name: str = DEFAULT_RESULT_TABLE, parquet_path: Optional[str] = None) -> int:
+    """
+    Compute the margin of every customer, subscription, product, SKU and month, and keep it in a table.
+
+    Each side is aggregated to the reconciliation keys first, so the join only sees one row per key and
+    the whole computation runs as columnar scans and hash aggregates in DuckDB, in parallel and spilling
+    to disk if needed. Keys found on one side only are kept, with the other side's amounts at 0, so
+    unbilled cost and sales without usage both show up.
+
+    Args:
+        warehouse (DuckDBWarehouse): The warehouse holding unbilled_usage and recon_line_items.
+        months (Optional[List[str]]): The months to reconcile, as YYYY-MM-01. Defaults to every month.
+        table_name (str): The result table, replaced on every run for the reconciled months.
+        parquet_path (Optional[str]): Also write the result to this Parquet file.
+
+    Returns:
+        int: The number of result rows.
+    """
+    parameters = []
+    cost_where = sales_where = ''
+    if months:
+        placeholders = ', '.join('?::DATE' for _ in months)
+        cost_where = f"WHERE billing_month IN ({placeholders})"
+        sales_where = f"""WHERE CAST(date_trunc('month', "chargeStartDate") AS DATE) IN ({placeholders})"""
+        parameters = list(months) + list(months)
+
+    keys = ', '.join(RECONCILIATION_KEYS)
+    result_sql = f"""
+        WITH cost_side AS ({COST_SQL.format(where=cost_where)}),
+             sales_side AS ({SALES_SQL.format(where=sales_where)})
+        SELECT {keys},
+               coalesce(sales_side.customer_name, cost_side.customer_name) AS customer_name,
+               coalesce(sales_side.product_name, cost_side.product_name) AS product_name,
+               coalesce(sales_side.sku_name, cost_side.sku_name) AS sku_name,
+               coalesce(cost_billing, 0) AS cost_billing,
+               coalesce(cost_pricing, 0) AS cost_pricing,
+               cost_currency,
+               coalesce(sales, 0) AS sales,
+               coalesce(sales_with_tax, 0) AS sales_with_tax,
+               sales_currency,
+               coalesce(sales, 0) - coalesce(cost_billing, 0) AS margin,
+               (coalesce(sales, 0) - coalesce(cost_billing, 0)) / nullif(sales, 0) AS margin_pct,
+               coalesce(usage_rows, 0) AS usage_rows,
+               coalesce(line_items, 0) AS line_items
+        FROM cost_side FULL OUTER JOIN sales_side USING ({keys})
+        ORDER BY month, customer_id, subscription_id, product_id, sku_id
+    """
+
+    connection = warehouse.connection
+    connection.execute("BEGIN TRANSACTION")
+    try:
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table_name} AS SELECT * FROM ({result_sql}) LIMIT 0", parameters)
+        if months:
+            connection.execute(f"DELETE FROM {table_name} WHERE month IN ({', '.join('?::DATE' for _ in months)})", months)
+        else:
+            connection.execute(f"DELETE FROM {table_name}")
+        row_count = connection.execute(f"INSERT INTO {table_name} BY NAME {result_sql}", parameters).fetchone()[0]
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+    print(f"Reconciled cost vs sales into {table_name}: {row_count} rows.")
+    if parquet_path:
+        connection.execute(f"COPY {table_name} TO '{parquet_path}' (FORMAT parquet, COMPRESSION zstd)")
+        print(f"Wrote {table_name} to {parquet_path}.")
+    return row_count
+
+
+def get_margin_summary(warehouse: DuckDBWarehouse, table_name: str = DEFAULT_RESULT_TABLE) -> pa.Table:
+    """
+    Summarize the reconciliation per customer and month.
+
+    Args:
+        warehouse (DuckDBWarehouse): The warehouse holding the reconciliation result.
+        table_name (str): The result table.
+
+    Returns:
+        pa.Table: The cost, sales and margin of every customer and month, lowest margin first.
+    """
+    return warehouse.query(f"""
+        SELECT month, customer_id, any_value(customer_name) AS customer_name,
+               sum(cost_billing) AS cost_billing, sum(sales) AS sales, sum(margin) AS margin,
+               sum(margin) / nullif(sum(sales), 0) AS margin_pct
+        FROM {table_name}
+        GROUP BY month, customer_id
+        ORDER BY margin
+    """)
+
+
+def main() -> None:
+    """
+    Reconcile the warehouse at DUCKDB_PATH and print the customers with the lowest margin.
+    """
+    secrets = SecretsManager()
+    warehouse = DuckDBWarehouse(secrets.duckdb_path) if secrets.duckdb_path else DuckDBWarehouse()
+    try:
+        reconcile_cost_vs_sales(warehouse)
+        print(get_margin_summary(warehouse).slice(0, 10).to_pandas().to_string(index=False))
+    finally:
+        warehouse.close()
+
+
+if __name__ == "__main__":
+    main()
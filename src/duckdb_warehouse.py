@@ -0,0 +1,295 @@
+import json
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Union
+import duckdb
+import pyarrow as pa
+from arrow_schema import table_to_record_batch
+from bigquery_writer import BigQueryUploader
+from recon_parquet import RECON_LINE_ITEM_COLUMNS, RECON_LINE_ITEM_TYPES, line_items_to_table
+
+# Path of the warehouse, next to the scripts' other local state.
+DEFAULT_DB_PATH = '../duckdb.db'
+
+# DuckDB types of the BigQuery column types of the unbilled usage schema.
+BIGQUERY_TO_DUCKDB_TYPES = {
+    "STRING": "VARCHAR",
+    "FLOAT": "DOUBLE",
+    "INTEGER": "BIGINT",
+    "BOOLEAN": "BOOLEAN",
+    "TIMESTAMP": "TIMESTAMPTZ",
+    "DATE": "DATE",
+}
+
+# Invoice fields kept in the invoices table, with their types.
+INVOICE_COLUMNS = {
+    'invoiceDate': 'TIMESTAMPTZ',
+    'billingPeriodStartDate': 'TIMESTAMPTZ',
+    'billingPeriodEndDate': 'TIMESTAMPTZ',
+    'totalCharges': 'DOUBLE',
+    'paidAmount': 'DOUBLE',
+    'currencyCode': 'VARCHAR',
+    'currencySymbol': 'VARCHAR',
+    'invoiceType': 'VARCHAR',
+    'documentType': 'VARCHAR',
+}
+
+# DuckDB types of the typed recon line item fields, every other field is VARCHAR.
+ARROW_TO_DUCKDB_TYPES = {
+    pa.float64(): 'DOUBLE',
+    pa.int64(): 'BIGINT',
+    pa.timestamp('us', tz='UTC'): 'TIMESTAMPTZ',
+}
+
+
+def _get_usage_columns() -> List[tuple]:
+    return [(field.name, BIGQUERY_TO_DUCKDB_TYPES[field.field_type]) for field in BigQueryUploader._get_explicit_schema()]
+
+
+def get_usage_read_json_sql() -> str:
+    """
+    Return a query reading gzipped JSON lines exports with DuckDB's read_json, typed by the BigQuery schema.
+
+    The query takes two parameters: the list of file paths, and the billing month added to every row.
+    Fields of the files that are not in the schema are ignored, and missing ones are null.
+
+    Returns:
+        str: The query.
+    """
+    columns = ', '.join(f"'{name}': '{column_type}'" for name, column_type in _get_usage_columns() if name != 'billing_month')
+    return f"""SELECT *, ?::DATE AS billing_month
+               FROM read_json(?, format = 'newline_delimited', compression = 'gzip', columns = {{{columns}}})"""
+
+
+def write_usage_parquet(paths: List[str], billing_month: str, output_path: str, compression: str = 'zstd') -> int:
+    """
+    Convert gzipped JSON lines exports to a Parquet file with DuckDB, without decoding rows in Python.
+
+    Args:
+        paths (List[str]): The local gzipped export files, e.g. from AzureBlobDownloader.download_blobs_to_files.
+        billing_month (str): The billing month added to every row, as YYYY-MM-DD.
+        output_path (str): The Parquet file to write.
+        compression (str): The Parquet compression codec.
+
+    Returns:
+        int: The number of rows written.
+    """
+    connection = duckdb.connect()
+    try:
+        connection.execute("SET TimeZone = 'UTC'")
+        row_count = connection.execute(
+            f"COPY ({get_usage_read_json_sql()}) TO '{output_path}' (FORMAT parquet, COMPRESSION {compression})",
+            [billing_month, paths]).fetchone()[0]
+    finally:
+        connection.close()
+    print(f"Wrote {row_count} usage rows from {len(paths)} file(s) to {output_path}.")
+    return row_count
+
+
+class DuckDBWarehouse:
+    """
+    Local DuckDB warehouse of invoices, recon line items and unbilled usage.
+
+    Loads are upserts, so re-running a job replaces what it loaded before instead of duplicating it:
+
+    - invoices: one row per invoice, keyed by invoice_id.
+    - recon_line_items: keyed by (invoice_id, line_number). An invoice's line items are replaced together.
+    - unbilled_usage: a snapshot per billing_month, replaced together. Usage rows have no natural key.
+
+    Each table has ART indexes on the columns the cost-vs-sales analysis filters and joins on
+    (customer, subscription, month), so point lookups do not scan the table. Data is passed in and out as
+    Arrow, and DuckDB scans it in place without converting rows to Python objects.
+
+    Attributes:
+        db_path (str): The path of the DuckDB database file.
+        connection (duckdb.DuckDBPyConnection): The connection to the warehouse.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, read_only: bool = False) -> None:
+        """
+        Open the warehouse, creating its tables and indexes if needed.
+
+        Args:
+            db_path (str): The path of the DuckDB database file, or ':memory:'.
+            read_only (bool): Open the database read-only, e.g. for analysis while a load is running elsewhere.
+        """
+        self.db_path = db_path
+        self.connection = duckdb.connect(db_path, read_only=read_only)
+        # Timestamps without a zone offset are UTC, as in arrow_schema.cast_column
+        self.connection.execute("SET TimeZone = 'UTC'")
+        if not read_only:
+            self._create_tables()
+
+    def _create_tables(self) -> None:
+        invoice_columns = ', '.join(f'"{name}" {column_type}' for name, column_type in INVOICE_COLUMNS.items())
+        line_item_columns = ', '.join(
+            f'"{name}" {ARROW_TO_DUCKDB_TYPES.get(RECON_LINE_ITEM_TYPES.get(name), "VARCHAR")}' for name in RECON_LINE_ITEM_COLUMNS)
+        usage_columns = ', '.join(f'"{name}" {column_type}' for name, column_type in _get_usage_columns())
+
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS invoices (invoice_id VARCHAR PRIMARY KEY, {invoice_columns}, loaded_at TIMESTAMPTZ)",
+            f"""CREATE TABLE IF NOT EXISTS recon_line_items (
+                invoice_id VARCHAR NOT NULL, line_number INTEGER NOT NULL, {line_item_columns},
+                extra_fields VARCHAR, loaded_at TIMESTAMPTZ, PRIMARY KEY (invoice_id, line_number))""",
+            f"CREATE TABLE IF NOT EXISTS unbilled_usage ({usage_columns}, loaded_at TIMESTAMPTZ)",
+            'CREATE INDEX IF NOT EXISTS recon_line_items_customer ON recon_line_items ("customerId")',
+            'CREATE INDEX IF NOT EXISTS recon_line_items_subscription ON recon_line_items ("subscriptionId")',
+            'CREATE INDEX IF NOT EXISTS unbilled_usage_month ON unbilled_usage (billing_month)',
+            'CREATE INDEX IF NOT EXISTS unbilled_usage_customer ON unbilled_usage ("CustomerId")',
+            'CREATE INDEX IF NOT EXISTS unbilled_usage_subscription ON unbilled_usage ("SubscriptionId")',
+        ]
+        for statement in statements:
+            self.connection.execute(statement)
+
+    def upsert_invoices(self, invoices: List[dict]) -> int:
+        """
+        Insert new invoices and replace existing ones.
+
+        Args:
+            invoices (List[dict]): The invoices, as returned by the invoices API.
+
+        Returns:
+            int: The number of invoices upserted.
+        """
+        if not invoices:
+            return 0
+        invoice_table = pa.table({
+            'invoice_id': pa.array([invoice['id'] for invoice in invoices], pa.string()),
+            **{name: pa.array([None if invoice.get(name) is None else str(invoice[name]) for invoice in invoices], pa.string())
+               for name in INVOICE_COLUMNS},
+        })
+        # The text columns are cast to the table's types by DuckDB on insert
+        self.connection.execute("INSERT OR REPLACE INTO invoices BY NAME SELECT *, ?::TIMESTAMPTZ AS loaded_at FROM invoice_table",
+                                [self._now()])
+        print(f"Upserted {len(invoices)} invoice(s) into {self.db_path}.")
+        return len(invoices)
+
+    def upsert_line_items(self, invoice_id: str, line_items: List[dict]) -> int:
+        """
+        Replace the line items of an invoice.
+
+        Args:
+            invoice_id (str): The invoice ID.
+            line_items (List[dict]): Every line item of the invoice, e.g. from get_invoice_line_items.
+
+        Returns:
+            int: The number of line items loaded.
+        """
+        line_item_table = line_items_to_table(line_items, RECON_LINE_ITEM_COLUMNS)
+        extra_fields = [
+            json.dumps({key: value for key, value in item.items() if key not in RECON_LINE_ITEM_COLUMNS}, sort_keys=True, default=str)
+            for item in line_items
+        ]
+        line_item_table = line_item_table.append_column('extra_fields', pa.array(extra_fields, pa.string()))
+
+        self._replace(
+            "DELETE FROM recon_line_items WHERE invoice_id = ?", [invoice_id],
+            """INSERT INTO recon_line_items BY NAME
+               SELECT ? AS invoice_id, (row_number() OVER ())::INTEGER AS line_number, *, ?::TIMESTAMPTZ AS loaded_at
+               FROM line_item_table""",
+            [invoice_id, self._now()], line_item_table=line_item_table)
+        print(f"Loaded {len(line_items)} line items of invoice {invoice_id} into {self.db_path}.")
+        return len(line_items)
+
+    def upsert_usage(self, batches: Iterable[Union[list, pa.RecordBatch, pa.Table]], billing_month: str) -> int:
+        """
+        Replace the unbilled usage snapshot of a billing month.
+
+        Args:
+            batches (Iterable[Union[list, pa.RecordBatch, pa.Table]]): Batches of JSON dictionaries or Arrow record
+                batches with the billing_month field, e.g. from AzureBlobDownloader.iter_record_batches_from_blobs.
+            billing_month (str): The billing month of the snapshot, as YYYY-MM-DD.
+
+        Returns:
+            int: The number of usage rows loaded.
+        """
+        schema = BigQueryUploader.get_arrow_schema()
+        loaded_at = self._now()
+        row_count = 0
+
+        self.connection.execute("BEGIN TRANSACTION")
+        try:
+            self.connection.execute("DELETE FROM unbilled_usage WHERE billing_month = ?::DATE", [billing_month])
+            for batch in batches:
+                if isinstance(batch, list):
+                    batch = table_to_record_batch(pa.Table.from_pylist(batch), schema)
+                self.connection.execute("INSERT INTO unbilled_usage BY NAME SELECT *, ?::TIMESTAMPTZ AS loaded_at FROM batch",
+                                        [loaded_at])
+                row_count += batch.num_rows
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+        print(f"Loaded {row_count} usage rows for billing_month {billing_month} into {self.db_path}.")
+        return row_count
+
+    def load_usage_files(self, paths: List[str], billing_month: str) -> int:
+        """
+        Replace the unbilled usage snapshot of a billing month with gzipped JSON lines export files.
+
+        The files are read by DuckDB's JSON reader straight into the table, on all cores and without
+        creating Python objects per row.
+
+        Args:
+            paths (List[str]): The local gzipped export files, e.g. from AzureBlobDownloader.download_blobs_to_files.
+            billing_month (str): The billing month of the snapshot, as YYYY-MM-DD.
+
+        Returns:
+            int: The number of usage rows loaded.
+        """
+        self.connection.execute("BEGIN TRANSACTION")
+        try:
+            self.connection.execute("DELETE FROM unbilled_usage WHERE billing_month = ?::DATE", [billing_month])
+            row_count = self.connection.execute(
+                f"""INSERT INTO unbilled_usage BY NAME
+                    SELECT *, ?::TIMESTAMPTZ AS loaded_at FROM ({get_usage_read_json_sql()})""",
+                [self._now(), billing_month, paths]).fetchone()[0]
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+        print(f"Loaded {row_count} usage rows from {len(paths)} file(s) for billing_month {billing_month} into {self.db_path}.")
+        return row_count
+
+    def query(self, sql: str, parameters: Optional[list] = None) -> pa.Table:
+        """
+        Run a query on the warehouse.
+
+        Args:
+            sql (str): The query.
+            parameters (Optional[list]): The query parameters.
+
+        Returns:
+            pa.Table: The result.
+        """
+        result = self.connection.execute(sql, parameters or []).arrow()
+        return result.read_all() if isinstance(result, pa.RecordBatchReader) else result
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _replace(self, delete_sql: str, delete_parameters: list, insert_sql: str, insert_parameters: list, **tables) -> None:
+        """
+        Run a delete and an insert in one transaction, the insert reading the given Arrow tables by name.
+        """
+        cursor = self.connection.cursor()
+        for name, table in tables.items():
+            cursor.register(name, table)
+        cursor.execute("BEGIN TRANSACTION")
+        try:
+            cursor.execute(delete_sql, delete_parameters)
+            cursor.execute(insert_sql, insert_parameters)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S+00')
+
+    def __repr__(self) -> str:
+        return f"DuckDBWarehouse(db_path={self.db_path!r})"
@@ -0,0 +1,484 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.storage.blob import ContainerClient
+from http_transport import HttpTransport, get_default_transport
+from token_provider import TokenProvider
+
+# Logic App trigger resuming or suspending the Fabric capacity, with a body of {"Action": "resume"} or {"Action": "suspend"}.
+DEFAULT_TRIGGER_URL = "https://prod2-03.centralindia.logic.azure.com:443/workflows/3abceea03f6d477a999aab317aae1f0b/triggers/When_a_HTTP_request_is_received/paths/invoke?api-version=2016-10-01&sp=%2Ftriggers%2FWhen_a_HTTP_request_is_received%2Frun&sv=1.0&sig=9GidnrLPemnX8ekgH1Abdi2lejeclnGZgNW9-6-e1J8"
+
+# Scope of the token needed to read the capacity state from Azure Resource Manager.
+ARM_SCOPE = 'https://management.azure.com/.default'
+
+# Waiting for the capacity to become active, when its state can be read.
+DEFAULT_READY_TIMEOUT = 10 * 60
+DEFAULT_POLL_INTERVAL = 5
+
+# Time given to the capacity to start when its state cannot be read.
+DEFAULT_WARMUP_DELAY = 30
+
+# Time the capacity stays up after the last job releases it, so a job starting shortly after reuses it.
+DEFAULT_IDLE_TIMEOUT = 5 * 60
+
+# Time after which the lease of a job that never released it, e.g. because it crashed, is ignored.
+DEFAULT_LEASE_TTL = 2 * 60 * 60
+
+# Capacity states, as reported by Azure Resource Manager in properties.state.
+ACTIVE_STATE = 'active'
+
+# Name under which recon_line_items.py holds the capacity, until recon_line_items_delete_recon_file.py releases it.
+RECON_JOB_NAME = 'recon_line_items'
+
+
+class CapacityLeaseStore:
+    """
+    In-process store of the jobs holding the capacity, shared by the threads of one process.
+
+    The state is a dict with the leases of the jobs ("leases": {job name: expiry epoch time}) and the
+    current resume ("resume_id", "resume_requested_at", "ready_at"). It is only changed through update,
+    which applies a function to it atomically.
+    """
+
+    def __init__(self) -> None:
+        self._state: dict = {}
+        self._lock = threading.Lock()
+
+    def read(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._state))
+
+    def update(self, modify: Callable[[dict], None]) -> dict:
+        """
+        Apply modify to the state atomically.
+
+        Args:
+            modify (Callable[[dict], None]): Changes the state in place. May be called more than once.
+
+        Returns:
+            dict: The state after the update.
+        """
+        with self._lock:
+            state = json.loads(json.dumps(self._state))
+            modify(state)
+            self._state = state
+            return json.loads(json.dumps(state))
+
+
+class BlobCapacityLeaseStore(CapacityLeaseStore):
+    """
+    Lease store kept as a JSON blob, shared by the jobs of every process and machine using the capacity.
+
+    Updates are conditional on the blob's eTag and retried when another job changed the blob in between.
+
+    Attributes:
+        container_client (ContainerClient): The container holding the blob.
+        blob_name (str): The name of the blob.
+    """
+
+    def __init__(self, container_client: ContainerClient, blob_name: str = 'fabric_capacity_leases.json',
+                 max_attempts: int = 10) -> None:
+        super().__init__()
+        self.container_client = container_client
+        self.blob_name = blob_name
+        self.max_attempts = max_attempts
+
+    def read(self) -> dict:
+        return self._download()[0]
+
+    def update(self, modify: Callable[[dict], None]) -> dict:
+        blob_client = self.container_client.get_blob_client(self.blob_name)
+        for _ in range(self.max_attempts):
+            state, etag = self._download()
+            modify(state)
+            data = json.dumps(state, indent=2).encode('utf-8')
+            try:
+                if etag is None:
+                    blob_client.upload_blob(data, overwrite=False)
+                else:
+                    blob_client.upload_blob(data, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+                return state
+            except (ResourceModifiedError, ResourceExistsError):
+                # Another job updated the leases in between, apply the change again on its state
+                continue
+        raise Exception(f"Could not update {self.blob_name} after {self.max_attempts} attempts.")
+
+    def _download(self):
+        try:
+            downloader = self.container_client.get_blob_client(self.blob_name).download_blob()
+        except ResourceNotFoundError:
+            return {}, None
+        return json.loads(downloader.readall()), downloader.properties.etag
+
+
+class FabricCapacityManager:
+    """
+    Resumes the Fabric capacity when a job needs it and suspends it once no job does.
+
+    Every job acquires the capacity under its own name, which records a lease in the lease store.
+    The first job of a window sends the resume request, and jobs that acquire it while it is starting
+    wait for the same resume instead of sending their own. Readiness is polled from the capacity state
+    in Azure Resource Manager when status_url is set, and otherwise assumed after warmup_delay.
+
+    When the last lease is released, the capacity is suspended after idle_timeout, unless another job
+    acquired it in the meantime. Leases older than lease_ttl are ignored, so a job that crashed does not
+    keep the capacity up forever.
+
+    Attributes:
+        trigger_url (str): The Logic App trigger resuming and suspending the capacity.
+        status_url (Optional[str]): The Azure Resource Manager URL of the capacity, to read its state.
+        lease_store (CapacityLeaseStore): The store of the jobs holding the capacity.
+        ready_timeout (float): The number of seconds to wait for the capacity to become active.
+        poll_interval (float): The number of seconds between two state polls.
+        warmup_delay (float): The number of seconds the capacity is given to start when its state cannot be read.
+        idle_timeout (float): The number of seconds the capacity stays up after the last release.
+        lease_ttl (float): The number of seconds after which an unreleased lease is ignored.
+    """
+
+    def __init__(self, trigger_url: str = DEFAULT_TRIGGER_URL, status_url: Optional[str] = None,
+                 get_status_headers: Optional[Callable[[], Dict[str, str]]] = None,
+                 lease_store: Optional[CapacityLeaseStore] = None, ready_timeout: float = DEFAULT_READY_TIMEOUT,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, warmup_delay: float = DEFAULT_WARMUP_DELAY,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT, lease_ttl: float = DEFAULT_LEASE_TTL,
+                 transport: Optional[HttpTransport] = None) -> None:
+        """
+        Initialize the manager.
+
+        Args:
+            trigger_url (str): The Logic App trigger resuming and suspending the capacity.
+            status_url (Optional[str]): The Azure Resource Manager URL of the capacity, e.g.
+                https://management.azure.com/subscriptions/.../providers/Microsoft.Fabric/capacities/...?api-version=2023-11-01.
+            get_status_headers (Optional[Callable[[], Dict[str, str]]]): Returns the headers of the state requests,
+                e.g. with a bearer token for ARM_SCOPE.
+            lease_store (Optional[CapacityLeaseStore]): The store of the jobs holding the capacity. Defaults to
+                an in-process store; use BlobCapacityLeaseStore to share the capacity between scheduled jobs.
+            ready_timeout (float): The number of seconds to wait for the capacity to become active.
+            poll_interval (float): The number of seconds between two state polls.
+            warmup_delay (float): The number of seconds the capacity is given to start when its state cannot be read.
+            idle_timeout (float): The number of seconds the capacity stays up after the last release.
+            lease_ttl (float): The number of seconds after which an unreleased lease is ignored.
+            transport (Optional[HttpTransport]): The HTTP transport. Defaults to the shared transport.
+        """
+        self.trigger_url = trigger_url
+        self.status_url = status_url
+        self.get_status_headers = get_status_headers or dict
+        self.lease_store = lease_store or CapacityLeaseStore()
+        self.ready_timeout = ready_timeout
+        self.poll_interval = poll_interval
+        self.warmup_delay = warmup_delay
+        self.idle_timeout = idle_timeout
+        self.lease_ttl = lease_ttl
+        self.transport = transport or get_default_transport()
+
+    def acquire(self, job_name: str) -> None:
+        """
+        Register a job as using the capacity, and return once the capacity is ready.
+
+        The resume request is only sent if no other job has a resume in progress or done.
+
+        Args:
+            job_name (str): The name of the job, used again to release the capacity.
+
+        Raises:
+            Exception: If the resume request fails, in which case the job's lease is removed.
+            TimeoutError: If the capacity is not active within ready_timeout.
+        """
+        resume_id = uuid.uuid4().hex
+
+        def add_lease(state: dict) -> None:
+            now = time.time()
+            leases = self._get_live_leases(state, now)
+            leases[job_name] = now + self.lease_ttl
+            state['leases'] = leases
+            # A resume older than the ready timeout that never became ready has failed, start a new one
+            resume_pending = state.get('resume_requested_at') and now - state['resume_requested_at'] < self.ready_timeout
+            if not state.get('ready_at') and not resume_pending:
+                state.update(resume_id=resume_id, resume_requested_at=now, ready_at=None)
+
+        def restart_resume(state: dict) -> None:
+            state.update(resume_id=resume_id, resume_requested_at=time.time(), ready_at=None)
+
+        state = self.lease_store.update(add_lease)
+        if state.get('ready_at'):
+            if self.status_url and self.get_state() != ACTIVE_STATE:
+                # Suspended outside of the manager, e.g. from the portal
+                state = self.lease_store.update(restart_resume)
+            else:
+                print(f"Fabric capacity is already active, shared with {len(state['leases']) - 1} other job(s).")
+                return
+
+        if state.get('resume_id') == resume_id:
+            try:
+                self._trigger('resume')
+            except Exception:
+                # Nothing is starting the capacity, so other jobs must not wait for this resume or count on this lease
+                self.lease_store.update(lambda state: self._cancel_resume(state, job_name, resume_id))
+                raise
+            print("Fabric capacity resume requested.")
+        else:
+            print("Fabric capacity resume already requested by another job, waiting for it.")
+
+        self._wait_until_ready(state['resume_requested_at'])
+        self.lease_store.update(lambda state: state.update(ready_at=state.get('ready_at') or time.time()))
+
+    def release(self, job_name: str, idle_timeout: Optional[float] = None) -> bool:
+        """
+        Release a job's lease, and suspend the capacity if no other job holds it after the idle timeout.
+
+        This blocks for the idle timeout when the job is the last one holding the capacity, giving jobs
+        that start shortly after the chance to reuse it.
+
+        Args:
+            job_name (str): The name the job acquired the capacity with.
+            idle_timeout (Optional[float]): Overrides the manager's idle timeout, e.g. 0 to suspend right away.
+
+        Returns:
+            bool: True if the capacity was suspended.
+
+        Raises:
+            Exception: If the suspend request fails.
+        """
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+
+        def remove_lease(state: dict) -> None:
+            leases = self._get_live_leases(state, time.time())
+            leases.pop(job_name, None)
+            state['leases'] = leases
+
+        state = self.lease_store.update(remove_lease)
+        if state['leases']:
+            print(f"Fabric capacity released by {job_name}, still used by {', '.join(state['leases'])}.")
+            return False
+
+        if idle_timeout > 0:
+            print(f"Fabric capacity released by {job_name}, suspending in {idle_timeout:.0f} seconds if no job starts.")
+            time.sleep(idle_timeout)
+        return self.suspend_if_idle()
+
+    def suspend_if_idle(self) -> bool:
+        """
+        Suspend the capacity if no job holds a live lease.
+
+        Jobs that release the capacity call this themselves. A job that crashed never does, so
+        fabric_capacity_cleanup.py calls this on a schedule to suspend the capacity once its lease expired.
+
+        Returns:
+            bool: True if the capacity was suspended.
+
+        Raises:
+            Exception: If the suspend request fails.
+        """
+        suspend_id = uuid.uuid4().hex
+
+        def claim_suspend(state: dict) -> None:
+            state['leases'] = self._get_live_leases(state, time.time())
+            if not state['leases'] and (state.get('resume_id') or state.get('ready_at')):
+                state.update(resume_id=None, resume_requested_at=None, ready_at=None, suspend_id=suspend_id)
+
+        state = self.lease_store.update(claim_suspend)
+        if state['leases']:
+            print(f"Fabric capacity is in use by {', '.join(state['leases'])}, not suspending.")
+            return False
+        if state.get('suspend_id') != suspend_id:
+            print("Fabric capacity is not active, nothing to suspend.")
+            return False
+
+        self._trigger('suspend')
+        print("Fabric capacity suspended.")
+        return True
+
+    @contextmanager
+    def session(self, job_name: str, idle_timeout: Optional[float] = None) -> Iterator[None]:
+        """
+        Hold the capacity for the duration of a with block.
+
+        Args:
+            job_name (str): The name of the job.
+            idle_timeout (Optional[float]): Overrides the manager's idle timeout on release.
+        """
+        self.acquire(job_name)
+        try:
+            yield
+        finally:
+            self.release(job_name, idle_timeout)
+
+    def get_state(self) -> Optional[str]:
+        """
+        Read the capacity state from Azure Resource Manager.
+
+        Returns:
+            Optional[str]: The state in lower case, e.g. "active", "resuming" or "paused", None without a status_url.
+
+        Raises:
+            Exception: If the state request fails.
+        """
+        if not self.status_url:
+            return None
+        response = self.transport.get(self.status_url, headers=self.get_status_headers())
+        if response.status_code != 200:
+            raise Exception(f"Failed to read the Fabric capacity state: {response.status_code}, {response.content}")
+        data = response.json()
+        state = (data.get('properties') or {}).get('state') or data.get('state')
+        return state.lower() if state else None
+
+    def _trigger(self, action: str) -> None:
+        response = self.transport.post(self.trigger_url, json={"Action": action}, headers={'Content-Type': 'application/json'})
+        if response.status_code not in (200, 202):
+            raise Exception(f"Failed to {action} Fabric capacity: {response.status_code}, {response.content}")
+
+    def _wait_until_ready(self, requested_at: float) -> None:
+        """
+        Wait until the capacity is active, polling its state, or until the warmup delay after the resume request.
+        """
+        if not self.status_url:
+            delay = requested_at + self.warmup_delay - time.time()
+            if delay > 0:
+                print(f"Waiting {delay:.0f} seconds for the Fabric capacity to start...")
+                time.sleep(delay)
+            return
+
+        deadline = requested_at + self.ready_timeout
+        while True:
+            state = self.get_state()
+            if state == ACTIVE_STATE:
+                print(f"Fabric capacity is active after {time.time() - requested_at:.0f} seconds.")
+                return
+            if time.time() + self.poll_interval > deadline:
+                raise TimeoutError(f"Fabric capacity is still '{state}' after {self.ready_timeout} seconds.")
+            time.sleep(self.poll_interval)
+
+    @classmethod
+    def from_secrets(cls, secrets, container_client: ContainerClient, transport: Optional[HttpTransport] = None,
+                     **kwargs) -> "FabricCapacityManager":
+        """
+        Create the manager of the recon jobs, sharing leases through a blob in the recon container.
+
+        The capacity state is read from FABRIC_STATUS_URL with a token of the app, when it is set.
+
+        Args:
+            secrets (SecretsManager): The secrets, with fabric_trigger_url and fabric_status_url.
+            container_client (ContainerClient): The container holding the lease blob.
+            transport (Optional[HttpTransport]): The HTTP transport. Defaults to the shared transport.
+            **kwargs: Other arguments of FabricCapacityManager, e.g. idle_timeout.
+
+        Returns:
+            FabricCapacityManager: The manager.
+        """
+        get_status_headers = None
+        if secrets.fabric_status_url:
+            token_provider = TokenProvider(secrets.tenant_id, secrets.client_id, secrets.client_secret, ARM_SCOPE,
+                                           transport=transport)
+            get_status_headers = lambda: {'Authorization': f'Bearer {token_provider.get_token()}'}
+
+        return cls(trigger_url=secrets.fabric_trigger_url or DEFAULT_TRIGGER_URL, status_url=secrets.fabric_status_url,
+                   get_status_headers=get_status_headers, lease_store=BlobCapacityLeaseStore(container_client),
+                   transport=transport, **kwargs)
+
+    @staticmethod
+    def _cancel_resume(state: dict, job_name: str, resume_id: str) -> None:
+        (state.get('leases') or {}).pop(job_name, None)
+        if state.get('resume_id') == resume_id:
+            state.update(resume_id=None, resume_requested_at=None, ready_at=None)
+
+    @staticmethod
+    def _get_live_leases(state: dict, now: float) -> Dict[str, float]:
+        return {job_name: expires_at for job_name, expires_at in (state.get('leases') or {}).items() if expires_at > now}
+
+
+# Test
+
+class _LocalCapacityHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the Logic App trigger and the Azure Resource Manager capacity, serving from the server's attributes.
+    """
+
+    def do_GET(self) -> None:
+        self._reply(200, {'properties': {'state': self.server.capacity_state}})
+
+    def do_POST(self) -> None:
+        action = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['Action']
+        if self.server.fail_triggers:
+            self._reply(500, {'error': 'trigger failed'})
+            return
+        self.server.actions.append(action)
+        self.server.capacity_state = ACTIVE_STATE if action == 'resume' else 'paused'
+        self._reply(202, {})
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def main() -> None:
+    """
+    Acquire and release the capacity of a local stand-in, checking which resume and suspend requests are sent.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _LocalCapacityHandler)
+    server.capacity_state, server.actions, server.fail_triggers = 'paused', [], False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    def create_manager(**kwargs) -> FabricCapacityManager:
+        return FabricCapacityManager(trigger_url=f"{base_url}/trigger", status_url=f"{base_url}/capacity",
+                                     poll_interval=0.05, idle_timeout=0, transport=HttpTransport(max_retries=0), **kwargs)
+
+    try:
+        capacity = create_manager()
+        capacity.acquire('job_a')
+        assert server.capacity_state == ACTIVE_STATE and server.actions == ['resume'], "The first job must resume the capacity."
+        assert capacity.release('job_a'), "The last job must suspend the capacity."
+        assert server.actions == ['resume', 'suspend'], "The capacity must be suspended once."
+        print("Test Success: capacity resumed on acquire and suspended on release.")
+
+        server.actions.clear()
+        capacity.acquire('job_a')
+        capacity.acquire('job_b')
+        assert server.actions == ['resume'], "A job acquiring an active capacity must not resume it again."
+        assert not capacity.release('job_a'), "The capacity must stay up while another job holds it."
+        assert capacity.release('job_b') and server.actions == ['resume', 'suspend'], "The last job must suspend it."
+        print("Test Success: capacity shared by two jobs.")
+
+        server.actions.clear()
+        crashing = create_manager(lease_store=capacity.lease_store, lease_ttl=0.2)
+        crashing.acquire('crashed_job')
+        assert not capacity.suspend_if_idle(), "The capacity must not be suspended while a lease is live."
+        time.sleep(0.3)
+        assert capacity.suspend_if_idle() and server.actions == ['resume', 'suspend'], "An expired lease must not keep the capacity up."
+        assert not capacity.suspend_if_idle(), "A suspended capacity must not be suspended again."
+        print("Test Success: capacity suspended once the lease of a crashed job expired.")
+
+        server.actions.clear()
+        server.fail_triggers = True
+        try:
+            capacity.acquire('job_a')
+            raise AssertionError("A failed resume must raise.")
+        except AssertionError:
+            raise
+        except Exception:
+            pass
+        state = capacity.lease_store.read()
+        assert not state['leases'] and not state.get('resume_id'), "A failed resume must leave no lease nor pending resume."
+        server.fail_triggers = False
+        capacity.acquire('job_b')
+        assert server.actions == ['resume'], "The next job must send its own resume after a failed one."
+        capacity.release('job_b')
+        print("Test Success: failed resume cleared for the next job.")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
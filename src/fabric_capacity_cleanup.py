@@ -0,0 +1,20 @@
+from azure.storage.blob import BlobServiceClient
+from secret_manager import SecretsManager
+from fabric_capacity import FabricCapacityManager
+
+secrets = SecretsManager()
+
+def main():
+    """
+    Suspends the Fabric capacity if no job holds it.
+
+    Meant to run on a schedule, e.g. hourly: a recon job that crashed never releases the capacity,
+    which then stays up until its lease expires and the next run of this script suspends it.
+    """
+    container_client = BlobServiceClient.from_connection_string(secrets.blob_connection_string).get_container_client(
+        secrets.blob_container_name.lower())
+    capacity = FabricCapacityManager.from_secrets(secrets, container_client)
+    capacity.suspend_if_idle()
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,26 @@
-import csv
-from io import StringIO
+from collections import Counter
 from secret_manager import SecretsManager
 from datetime import datetime
-import requests
-import pandas as pd
 from azure.storage.blob import BlobServiceClient
+from typing import Dict, Iterator, List, Optional, Tuple
+from blob_block_writer import BlockBlobWriter
+from duckdb_warehouse import DuckDBWarehouse
+from http_transport import HttpTransport, get_default_transport
+from invoice_fetcher import ConcurrentInvoiceFetcher, DEFAULT_MAX_WORKERS
+from invoice_manifest import FULL_LOAD_MANIFEST_BLOB, InvoiceManifest
+from partner_center_paging import DEFAULT_PAGE_SIZE, clean_line_items, iter_pages
+from rate_limiter import TokenBucket
+from recon_parquet import DEFAULT_DATASET_ROOT, ParquetDatasetWriter
+from recon_sink import CsvLineItemSink
+from token_provider import TokenProvider
 
 # Initialize SecretsManager to fetch credentials
 secrets = SecretsManager()
 
 class PartnerCenterAPIClient:
     def __init__(self, base_url: str, client_id: str, client_secret: str, tenant_id: str, 
-                 invoice_url: str, invoice_line_items_url: str, scope: str, blob_connection_string: str, blob_container_name: str):
+                 invoice_url: str, invoice_line_items_url: str, scope: str, blob_connection_string: str, blob_container_name: str,
+                 token_cache_file: Optional[str] = None, transport: Optional[HttpTransport] = None):
         self.base_url = base_url
         self.client_id = client_id
         self.client_secret = client_secret
@@ -24,6 +33,13 @@ class PartnerCenterAPIClient:
 
         # Initialize BlobServiceClient
         self.blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
+
+        # Pooled connections with retries on 429/5xx, shared with the other clients unless one is injected
+        self.transport = transport or get_default_transport()
+
+        # Caches the access token until shortly before it expires, shared with other clients of the same app
+        self.token_provider = TokenProvider(tenant_id, client_id, client_secret, scope, cache_file=token_cache_file,
+                                            transport=self.transport)
         print("PartnerCenterAPIClient initialized successfully.")
 
     def check_blob_exists(self, blob_name: str) -> bool:
@@ -33,35 +49,23 @@ class PartnerCenterAPIClient:
         return exists
 
     def get_access_token(self) -> str:
-        token_url = f"https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token"
-        
-        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        body = {
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'scope': self.scope, 
-            'grant_type': 'client_credentials'
-        }
-
-        response = requests.post(token_url, data=body, headers=headers)
-        if response.status_code == 200:
-            token_data = response.json()
-            self.access_token = token_data['access_token']
-            print("Access token retrieved successfully.")
-        else:
-            raise Exception(f"Failed to authenticate: {response.status_code}, {response.content}")
-
+        self.access_token = self.token_provider.get_token()
         return self.access_token
 
-    def get_invoice_ids(self) -> dict:
-        headers = {'Authorization': f'Bearer {self.access_token}', 'Content-Type': 'application/json'}
-        response = requests.get(f"{self.invoice_url}", headers=headers)
+    def get_invoices(self) -> list[dict]:
+        headers = {'Authorization': f'Bearer {self.get_access_token()}', 'Content-Type': 'application/json'}
+        response = self.transport.get(f"{self.invoice_url}", headers=headers)
         if response.status_code == 200:
             invoices = response.json().get('items', [])
             print(f"Retrieved {len(invoices)} invoices.")
+            return invoices
         else:
             raise Exception(f"Error fetching invoices: {response.status_code}, {response.content}")
 
+    def get_invoice_ids(self, invoices: Optional[list[dict]] = None) -> dict:
+        if invoices is None:
+            invoices = self.get_invoices()
+
         d = {}
         for invoice in invoices:
             d[invoice["id"]] = datetime.strptime(invoice["billingPeriodStartDate"], "%Y-%m-%dT%H:%M:%SZ").date()
@@ -73,37 +77,51 @@ class PartnerCenterAPIClient:
         print(f"Filtered {len(filtered_invoices)} invoice(s) starting with 'G'.")
         return filtered_invoices
 
-    def get_invoice_line_items(self, invoice_id: str) -> list[dict]:
+    def iter_invoice_line_items(self, invoice_id: str, page_size: int = DEFAULT_PAGE_SIZE,
+                                rate_limiter: Optional[TokenBucket] = None) -> Iterator[list[dict]]:
         line_items_url = self.invoice_line_items_url.replace("<invoiceID>", invoice_id)
 
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
+        def get_headers() -> dict:
+            return {
+                'Authorization': f'Bearer {self.get_access_token()}',
+                'Content-Type': 'application/json'
+            }
 
-        response = requests.get(line_items_url, headers=headers)
-        if response.status_code == 200:
-            line_items = response.json().get('items', [])
-            print(f"Retrieved {len(line_items)} line items for invoice {invoice_id}.")
-            
-            for item in line_items:
-                item.pop('priceAdjustmentDescription', None)
-                item.pop('attributes', None)
-                item.pop('productQualifiers', None)
-
-            return line_items
-        else:
-            raise Exception(f"Error fetching invoice line items for {invoice_id}: {response.status_code}, {response.content}")
+        # Follows the continuation links page by page, so only one page of line items is in memory at a time
+        try:
+            for line_items in iter_pages(self.transport, line_items_url, get_headers, page_size, rate_limiter):
+                yield clean_line_items(line_items)
+        except Exception as e:
+            raise Exception(f"Error fetching invoice line items for {invoice_id}: {e}")
+
+    def get_invoice_line_items(self, invoice_id: str) -> list[dict]:
+        line_items = [line_item for page in self.iter_invoice_line_items(invoice_id) for line_item in page]
+        print(f"Retrieved {len(line_items)} line items for invoice {invoice_id}.")
+        return line_items
 
-    def write_to_blob_storage(self, df: bytes, blob_name: str):
+    def open_blob_writer(self, blob_name: str) -> BlockBlobWriter:
         container_client = self.blob_service_client.get_container_client(self.blob_container_name)
         if not container_client.exists():
             container_client.create_container()
             print(f"Created blob container: {self.blob_container_name}")
 
+        # Uploads blocks while the file is being written, the blob is replaced when the writer is closed
         blob_client = self.blob_service_client.get_blob_client(container=self.blob_container_name, blob=blob_name)
-        blob_client.upload_blob(df, overwrite=True)
-        print(f"Uploaded CSV file to Azure Blob Storage with name: {blob_name}")
+        return BlockBlobWriter(blob_client)
+
+    def open_parquet_dataset(self, root: str = DEFAULT_DATASET_ROOT) -> ParquetDatasetWriter:
+        container_client = self.blob_service_client.get_container_client(self.blob_container_name)
+        if not container_client.exists():
+            container_client.create_container()
+            print(f"Created blob container: {self.blob_container_name}")
+        return ParquetDatasetWriter(container_client, root)
+
+    def open_manifest(self) -> InvoiceManifest:
+        container_client = self.blob_service_client.get_container_client(self.blob_container_name)
+        if not container_client.exists():
+            container_client.create_container()
+            print(f"Created blob container: {self.blob_container_name}")
+        return InvoiceManifest(container_client, FULL_LOAD_MANIFEST_BLOB)
 
 def main():
     base_url = secrets.partner_api_base_url
@@ -117,7 +135,8 @@ def main():
     blob_container_name = secrets.blob_container_name
 
     # Initialize API client
-    api_client = PartnerCenterAPIClient(base_url, client_id, client_secret, tenant_id, invoice_url, invoice_line_items_url, scope, blob_connection_string, blob_container_name)
+    api_client = PartnerCenterAPIClient(base_url, client_id, client_secret, tenant_id, invoice_url, invoice_line_items_url, scope, blob_connection_string, blob_container_name,
+                                        token_cache_file=secrets.token_cache_file)
 
     # Fetch access token and invoice data
     print("Fetching access token...")
@@ -125,29 +144,100 @@ def main():
 
     # Fetch invoice IDs
     print("Fetching invoice IDs...")
-    invoice_ids = api_client.get_invoice_ids()
+    invoices = {invoice['id']: invoice for invoice in api_client.get_invoices()}
+    invoice_ids = api_client.get_invoice_ids(list(invoices.values()))
 
     # Filter invoices starting with 'G'
     matching_invoice_ids = api_client.filter_invoices(invoice_ids)
 
-    for idx, (invoice_id, charge_start_date) in enumerate(matching_invoice_ids.items()):
-        print(f"Processing invoice {invoice_id} for {charge_start_date}...")
-
-        # Fetch line items for the current invoice
-        line_items = api_client.get_invoice_line_items(invoice_id)
-
-        # Convert line items to DataFrame
-        invoice_df = pd.DataFrame(line_items)
-
-        # Generate blob name using year and month
-        blob_name = f"{charge_start_date.year}-{charge_start_date.month:02d}_recon_line_items.csv"
-        print(f"Generated blob name: {blob_name}")
-
-        # Convert DataFrame to CSV and upload to Azure Blob Storage
-        csv_data = invoice_df.to_csv(index=False)
-        api_client.write_to_blob_storage(df=bytes(csv_data, encoding='utf-8'), blob_name=blob_name)
+    # Only invoices that are new or changed since the last run are fetched, unless RECON_FULL_REFRESH is set
+    manifest = api_client.open_manifest()
+    selected_invoices = manifest.select_invoices([invoices[invoice_id] for invoice_id in matching_invoice_ids],
+                                                 full_refresh=secrets.recon_full_refresh)
+
+    # One recon file per month, holding every invoice of that month
+    def get_blob_name(charge_start_date) -> str:
+        return f"{charge_start_date.year}-{charge_start_date.month:02d}_recon_line_items.csv"
+
+    if secrets.recon_output_format == 'parquet':
+        # Each invoice has its own partition, so only the selected invoices are rewritten
+        invoices_to_fetch = {invoice['id']: matching_invoice_ids[invoice['id']] for invoice in selected_invoices}
+    else:
+        # A monthly file holds every invoice of its month, so a month with a selected invoice is rewritten in full
+        months_to_write = {get_blob_name(matching_invoice_ids[invoice['id']]) for invoice in selected_invoices}
+        invoices_to_fetch = {invoice_id: charge_start_date for invoice_id, charge_start_date in matching_invoice_ids.items()
+                             if get_blob_name(charge_start_date) in months_to_write}
+
+    if not invoices_to_fetch:
+        print("All invoices are up to date, nothing to fetch.")
+        return
+
+    fetcher = ConcurrentInvoiceFetcher(api_client, max_workers=DEFAULT_MAX_WORKERS)
+
+    # The fetched invoices and line items are also kept in the local DuckDB warehouse when DUCKDB_PATH is set
+    warehouse = DuckDBWarehouse(secrets.duckdb_path) if secrets.duckdb_path else None
+    if warehouse:
+        warehouse.upsert_invoices([invoices[invoice_id] for invoice_id in invoices_to_fetch])
+
+    if secrets.recon_output_format == 'parquet':
+        # Each invoice is its own partition of the dataset, written as soon as it is fetched
+        dataset = api_client.open_parquet_dataset()
+        try:
+            for invoice_id, charge_start_date, line_items in fetcher.iter_invoices(invoices_to_fetch):
+                row_count = dataset.write_invoice([line_items], f"{charge_start_date:%Y-%m}", invoice_id)
+                manifest.record(invoices[invoice_id], row_count)
+                if warehouse:
+                    warehouse.upsert_line_items(invoice_id, line_items)
+        finally:
+            manifest.save()
+            if warehouse:
+                warehouse.close()
+        print(f"All invoices processed and uploaded to the Parquet dataset {dataset.root}.")
+        api_client.transport.print_latency_report()
+        return
+
+    invoices_left = Counter(get_blob_name(charge_start_date) for charge_start_date in invoices_to_fetch.values())
+    open_files: Dict[str, Tuple[CsvLineItemSink, BlockBlobWriter]] = {}
+    # Line item count of every invoice written to each open file, recorded in the manifest once the file is committed
+    file_invoices: Dict[str, List[Tuple[str, int]]] = {}
+
+    # Fetch invoices concurrently and append each one to its month's file as soon as it is fetched. Each
+    # file uploads its blocks as they fill and is committed once the last invoice of its month is written,
+    # so only the months in progress are open, each holding a few blocks.
+    try:
+        for invoice_id, charge_start_date, line_items in fetcher.iter_invoices(invoices_to_fetch):
+            blob_name = get_blob_name(charge_start_date)
+            print(f"Processing invoice {invoice_id} for {charge_start_date} into {blob_name}...")
+
+            if blob_name not in open_files:
+                writer = api_client.open_blob_writer(blob_name)
+                open_files[blob_name] = (CsvLineItemSink(writer), writer)
+            sink, writer = open_files[blob_name]
+            sink.write(line_items)
+            file_invoices.setdefault(blob_name, []).append((invoice_id, len(line_items)))
+            if warehouse:
+                warehouse.upsert_line_items(invoice_id, line_items)
+            del line_items
+
+            invoices_left[blob_name] -= 1
+            if invoices_left[blob_name] == 0:
+                del open_files[blob_name]
+                row_count = sink.close()
+                writer.close()
+                print(f"Uploaded {row_count} line items to Azure Blob Storage with name: {blob_name}")
+                for written_invoice_id, line_item_count in file_invoices.pop(blob_name):
+                    manifest.record(invoices[written_invoice_id], line_item_count)
+    finally:
+        # Months with a failed invoice are not committed, their previous file is left unchanged
+        for blob_name, (sink, writer) in open_files.items():
+            print(f"Discarding incomplete file {blob_name}.")
+            writer.abort()
+        manifest.save()
+        if warehouse:
+            warehouse.close()
 
     print("All invoices processed and uploaded.")
+    api_client.transport.print_latency_report()
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,21 @@
 import io
 import json
 import time
-import requests
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 # from bigquery_writer import BigQueryUploader
 from blob_client import AzureBlobDownloader
 from blob_url_parser import BlobURLParser
 from resource_location import ResourceLocationParser
 from secret_manager import SecretsManager
+from http_transport import HttpTransport, get_default_transport
+from polling_policy import PollingPolicy, PollSchedule
+from token_provider import TokenProvider
 
 
 class GraphAPIClient:
-    def __init__(self, tenant_id: str, client_id: str, client_secret: str, scope: str) -> None:
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str, scope: str,
+                 token_cache_file: Optional[str] = None, transport: Optional[HttpTransport] = None,
+                 polling_policy: Optional[PollingPolicy] = None) -> None:
         """
         Initialize the GraphAPIClient with tenant, client, and authentication information.
 
@@ -20,6 +24,10 @@ class GraphAPIClient:
             client_id (str): The client ID for the Azure app.
             client_secret (str): The client secret for the Azure app.
             scope (str): The scope of the access required.
+            token_cache_file (Optional[str]): The path of the on-disk token cache, see token_provider.TokenProvider.
+            transport (Optional[HttpTransport]): The pooled HTTP transport with retries. Defaults to the shared transport.
+            polling_policy (Optional[PollingPolicy]): Decides when to poll operations and when to give up.
+                Defaults to following the server's Retry-After with the default deadline.
         """
         self.tenant_id = tenant_id
         self.client_id = client_id
@@ -27,49 +35,42 @@ class GraphAPIClient:
         self.scope = scope
         self.access_token: Optional[str] = None
         self.base_token_url = f'https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token'
+        self.transport = transport or get_default_transport()
+        self.polling_policy = polling_policy or PollingPolicy()
+        # Schedule of every operation started by initialize_unbilled_request, keyed by operation URL
+        self._poll_schedules: Dict[str, PollSchedule] = {}
+        # Shares cached tokens with every other client using the same credentials
+        self.token_provider = TokenProvider(tenant_id, client_id, client_secret, scope, token_url=self.base_token_url,
+                                            cache_file=token_cache_file, transport=self.transport)
         print('Graph API Client initialized.')
 
-    def get_access_token(self) -> str:
+    def get_access_token(self, force_refresh: bool = False) -> str:
         """
         Authenticate with Microsoft to obtain an access token.
 
+        The token is served from the token provider's cache while it is valid for at least
+        refresh_margin seconds, and requested again otherwise.
+
+        Args:
+            force_refresh (bool): Request a new token even if the cached one is still valid.
+
         Returns:
             str: The access token if the authentication is successful.
 
         Raises:
             Exception: If authentication fails due to invalid credentials or other errors.
         """
-        token_url = self.base_token_url
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        body = {
-            'grant_type': 'client_credentials',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'scope': self.scope
-        }
-
-        print(f"Authenticating with Microsoft Graph API...")
-        response = requests.post(token_url, data=body, headers=headers)
-        
-        if response.status_code == 200:
-            token_data = response.json()
-            self.access_token = token_data['access_token']
-            print("Token retrieved successfully.")
-        else:
-            print(f"Authentication failed. Status code: {response.status_code}")
-            raise Exception(f"Failed to authenticate: {response.status_code}, {response.content}")
-
+        self.access_token = self.token_provider.get_token(force_refresh=force_refresh)
         return self.access_token
 
-    def initialize_unbilled_request(self, api_url: str, billing_period: str) -> Dict[str, str]:
+    def initialize_unbilled_request(self, api_url: str, billing_period: str, currency_code: str = "INR") -> Dict[str, str]:
         """
         Submit a request to generate a billing report based on the billing period.
 
         Args:
             api_url (str): The API URL to submit the billing request.
             billing_period (str): The billing period for which to generate the billing report.
+            currency_code (str): The currency of the billing report.
 
         Returns:
             Dict[str, str]: A dictionary containing headers, including the URL to check the operation status.
@@ -80,20 +81,24 @@ class GraphAPIClient:
         if not self.access_token:
             raise Exception("Access token is missing. Authenticate first.")
 
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
         body = {
-            "currencyCode": "INR",
+            "currencyCode": currency_code,
             "billingPeriod": billing_period,
             "attributeSet": "full"
         }
 
-        response = requests.post(api_url, headers=headers, json=body)
+        response = self.transport.post(api_url, headers=self._get_headers(), json=body)
+        if response.status_code == 401:
+            # The token was revoked or expired early, retry once with a new one
+            self.get_access_token(force_refresh=True)
+            response = self.transport.post(api_url, headers=self._get_headers(), json=body)
 
         if response.status_code == 202:
             print('Request accepted. Processing has started.')
+            operation_url = response.headers.get('Location')
+            if operation_url:
+                # Completion is timed from the request, per endpoint and billing period
+                self._poll_schedules[operation_url] = self.polling_policy.start(PollingPolicy.get_key(api_url, billing_period))
             return response.headers
         else:
             raise Exception(f"Failed to make request. Status code: {response.status_code}. Content: {response.content}")
@@ -103,43 +108,90 @@ class GraphAPIClient:
         """
         Poll the operation status until it completes.
 
+        The delay between polls is set by the polling policy, which sleeps until close to the usual
+        completion time of the endpoint and billing period, then polls tightly. The access token is checked
+        before every poll, so it is refreshed ahead of expiry during long operations. A 401 is retried once
+        with a new token.
+
         Args:
             operation_url (str): The URL to check the operation status.
 
         Returns:
             Dict: A dictionary containing the final status and any additional details.
 
+        Raises:
+            Exception: If the request fails or the access token is invalid.
+            TimeoutError: If the operation does not complete before the polling policy's deadline.
+        """
+        schedule = self.get_poll_schedule(operation_url)
+        while True:
+            json_data, retry_after = self.poll_operation_status(operation_url)
+            if json_data is not None:
+                if json_data.get('status') == 'succeeded':
+                    schedule.complete()
+                return json_data
+
+            delay = schedule.next_delay(retry_after)
+            print(f"Retrying after {delay:.0f} seconds...")
+            time.sleep(delay)
+
+    def get_poll_schedule(self, operation_url: str) -> PollSchedule:
+        """
+        Return the polling schedule of an operation, started when the operation was requested.
+
+        Args:
+            operation_url (str): The URL to check the operation status.
+
+        Returns:
+            PollSchedule: The schedule, or a new one without history for operations started elsewhere.
+        """
+        schedule = self._poll_schedules.pop(operation_url, None)
+        return schedule or self.polling_policy.start(PollingPolicy.get_key(operation_url, 'unknown'))
+
+    def poll_operation_status(self, operation_url: str) -> Tuple[Optional[dict], int]:
+        """
+        Check the operation status once, without waiting.
+
+        Args:
+            operation_url (str): The URL to check the operation status.
+
+        Returns:
+            Tuple[Optional[dict], int]: The final status and details once the operation has succeeded or
+                failed, None otherwise, and the number of seconds to wait before the next poll.
+
         Raises:
             Exception: If the request fails or the access token is invalid.
         """
         if not self.access_token:
             raise Exception("Access token is missing. Authenticate first.")
 
-        headers = {
-            'Authorization': f'Bearer {self.access_token}'
-        }
+        response = self.transport.get(operation_url, headers={'Authorization': f'Bearer {self.get_access_token()}'})
+        if response.status_code == 401:
+            self.get_access_token(force_refresh=True)
+            response = self.transport.get(operation_url, headers={'Authorization': f'Bearer {self.get_access_token()}'})
 
-        while True:
-            response = requests.get(operation_url, headers=headers)
-            
-            if response.status_code in [401, 403]:
-                raise Exception("Access token is expired or invalid. Please refresh the token and try again.")
-            elif response.status_code == 200:
-                json_data = response.json()
-                # print('type json data:', type(json_data))
+        if response.status_code in [401, 403]:
+            raise Exception("Access token is expired or invalid. Please refresh the token and try again.")
+        elif response.status_code == 200:
+            json_data = response.json()
 
-                status = json_data.get('status')
-                print(f"Status: {status}")
-                # print(json.dumps(json_data, indent=2))
+            status = json_data.get('status')
+            print(f"Status: {status}")
 
-                if status in ['succeeded', 'failed']:
-                    return json_data
+            if status in ['succeeded', 'failed']:
+                return json_data, 0
+            return None, int(response.headers.get('Retry-After', 10))
+        else:
+            raise Exception(f"Request failed. Status code: {response.status_code}. Response: {response.content}")
 
-                retry_after = int(response.headers.get('Retry-After', 10))
-                print(f"Retrying after {retry_after} seconds...")
-                time.sleep(retry_after)
-            else:
-                raise Exception(f"Request failed. Status code: {response.status_code}. Response: {response.content}")
+    def _get_headers(self) -> Dict[str, str]:
+        """
+        Return the request headers with a currently valid access token.
+        """
+        return {
+            'Authorization': f'Bearer {self.get_access_token()}',
+            'Content-Type': 'application/json'
+        }
 
 
 # Example usage of GraphAPIClient
@@ -153,7 +205,9 @@ def main() -> None:
         tenant_id=secrets.tenant_id,
         client_id=secrets.client_id,
         client_secret=secrets.client_secret,
-        scope=secrets.scope
+        scope=secrets.scope,
+        token_cache_file=secrets.token_cache_file,
+        polling_policy=PollingPolicy(history_file=secrets.polling_history_file)
     )
 
     # Test Auth
@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from rate_limiter import TokenBucket
+
+# Number of invoices fetched at once. Line item pages are slow to serve, so a few workers hide most of
+# the latency while the shared rate limiter keeps the request rate within the throttling limits.
+DEFAULT_MAX_WORKERS = 4
+
+# Attempts per invoice. A failed invoice is fetched again from its first page, since continuation
+# tokens do not outlive the failure that interrupted them.
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 10.0
+
+
+class FetchProgress:
+    """
+    Thread-safe progress and throughput of a multi-invoice fetch.
+
+    Attributes:
+        total (int): The number of invoices to fetch.
+        completed (int): The number of invoices fetched.
+        failed (int): The number of invoices that failed every attempt.
+        line_items (int): The number of line items fetched.
+        retries (int): The number of invoice attempts that were retried.
+    """
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.line_items = 0
+        self.retries = 0
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def add_invoice(self, invoice_id: str, line_item_count: int, seconds: float) -> None:
+        """
+        Record a fetched invoice and print the progress.
+
+        Args:
+            invoice_id (str): The invoice ID.
+            line_item_count (int): The number of line items of the invoice.
+            seconds (float): The time taken to fetch the invoice.
+        """
+        with self._lock:
+            self.completed += 1
+            self.line_items += line_item_count
+            done = self.completed + self.failed
+            elapsed = self.elapsed()
+            remaining = (self.total - done) * elapsed / done
+
+        print(f"[{done}/{self.total}] Fetched {line_item_count} line items for invoice {invoice_id} in {seconds:.1f} seconds. "
+              f"{self.line_items / elapsed:.0f} line items/s, about {remaining:.0f} seconds remaining.")
+
+    def add_failure(self, invoice_id: str, error: Exception) -> None:
+        with self._lock:
+            self.failed += 1
+            done = self.completed + self.failed
+        print(f"[{done}/{self.total}] Failed to fetch invoice {invoice_id}: {error}")
+
+    def elapsed(self) -> float:
+        return max(time.perf_counter() - self.start_time, 1e-9)
+
+    def print_report(self) -> None:
+        elapsed = self.elapsed()
+        print(f"Fetched {self.completed} of {self.total} invoices ({self.failed} failed, {self.retries} retries), "
+              f"{self.line_items} line items in {elapsed:.1f} seconds: "
+              f"{self.completed / elapsed * 60:.1f} invoices/min, {self.line_items / elapsed:.0f} line items/s.")
+
+
+class ConcurrentInvoiceFetcher:
+    """
+    Fetches the line items of many invoices at once with a bounded pool of worker threads.
+
+    All workers share the API client's token cache and connection pool, and one token bucket that caps
+    the number of page requests per second across them. Each invoice is retried as a whole when it
+    fails, and results are handed back in completion order, so the caller writes each invoice while the
+    next ones are still being fetched. At most twice max_workers invoices are in flight or waiting to be
+    written, which bounds memory however many invoices there are.
+
+    Attributes:
+        api_client (Any): The Partner Center client, providing iter_invoice_line_items.
+        max_workers (int): The number of invoices fetched at once.
+        rate_limiter (TokenBucket): The request budget shared by the workers.
+        max_attempts (int): The number of attempts per invoice.
+        retry_delay (float): The base delay in seconds before an invoice is fetched again.
+        progress (Optional[FetchProgress]): The progress of the last fetch.
+    """
+
+    def __init__(self, api_client: Any, max_workers: int = DEFAULT_MAX_WORKERS, rate_limiter: Optional[TokenBucket] = None,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, retry_delay: float = DEFAULT_RETRY_DELAY) -> None:
+        """
+        Initialize the fetcher.
+
+        Args:
+            api_client (Any): The Partner Center client, providing iter_invoice_line_items.
+            max_workers (int): The number of invoices fetched at once.
+            rate_limiter (Optional[TokenBucket]): The request budget shared by the workers. Defaults to a
+                bucket tuned to the Partner Center throttling limits.
+            max_attempts (int): The number of attempts per invoice.
+            retry_delay (float): The base delay in seconds before an invoice is fetched again, doubled per attempt.
+        """
+        self.api_client = api_client
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.progress: Optional[FetchProgress] = None
+
+    def fetch_invoice(self, invoice_id: str) -> List[dict]:
+        """
+        Fetch every line item of an invoice, retrying the whole invoice if a page fails.
+
+        Args:
+            invoice_id (str): The invoice ID.
+
+        Returns:
+            List[dict]: The line items of the invoice.
+
+        Raises:
+            Exception: If every attempt failed.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return [line_item for page in self.api_client.iter_invoice_line_items(invoice_id, rate_limiter=self.rate_limiter)
+                        for line_item in page]
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    raise
+                delay = random.uniform(0.5, 1.0) * self.retry_delay * 2 ** (attempt - 1)
+                print(f"Attempt {attempt} for invoice {invoice_id} failed: {e}. Retrying after {delay:.0f} seconds...")
+                if self.progress is not None:
+                    self.progress.add_retry()
+                time.sleep(delay)
+
+    def iter_invoices(self, invoices: Dict[str, date]) -> Iterator[Tuple[str, date, List[dict]]]:
+        """
+        Fetch every invoice concurrently and yield each one as soon as it is fetched.
+
+        Invoices that fail every attempt are skipped, so the others are still written, and reported
+        together once the rest are done.
+
+        Args:
+            invoices (Dict[str, date]): The invoice IDs and their billing period start dates.
+
+        Yields:
+            Tuple[str, date, List[dict]]: The invoice ID, its billing period start date and its line items.
+
+        Raises:
+            Exception: If any invoice failed every attempt, after all others have been yielded.
+        """
+        self.progress = FetchProgress(len(invoices))
+        pending = iter(invoices.items())
+        in_flight: Dict[Future, Tuple[str, date, float]] = {}
+        failures: Dict[str, Exception] = {}
+
+        def submit_next(executor: ThreadPoolExecutor) -> None:
+            invoice = next(pending, None)
+            if invoice is not None:
+                invoice_id, charge_start_date = invoice
+                in_flight[executor.submit(self.fetch_invoice, invoice_id)] = (invoice_id, charge_start_date, time.perf_counter())
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='invoice-fetch') as executor:
+            try:
+                for _ in range(self.max_workers * 2):
+                    submit_next(executor)
+
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        invoice_id, charge_start_date, started_at = in_flight.pop(future)
+                        submit_next(executor)
+                        try:
+                            line_items = future.result()
+                        except Exception as e:
+                            failures[invoice_id] = e
+                            self.progress.add_failure(invoice_id, e)
+                            continue
+                        self.progress.add_invoice(invoice_id, len(line_items), time.perf_counter() - started_at)
+                        yield invoice_id, charge_start_date, line_items
+            finally:
+                # Stop fetching if the caller stopped consuming, e.g. because a write failed
+                for future in in_flight:
+                    future.cancel()
+
+        self.progress.print_report()
+        print(f"Rate limiter wait: {self.rate_limiter.wait_time:.1f} seconds in total.")
+        if failures:
+            raise Exception(f"Failed to fetch {len(failures)} invoice(s): {', '.join(failures)}. First error: {next(iter(failures.values()))}")
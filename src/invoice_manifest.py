@@ -0,0 +1,130 @@
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError, ResourceExistsError
+from azure.storage.blob import ContainerClient
+
+# Names of the manifest blobs in the recon container. Each job keeps its own manifest because they write
+# different outputs: an invoice processed by one job has not been written by the other.
+RECON_LINE_ITEMS_MANIFEST_BLOB = 'recon_line_items_manifest.json'
+FULL_LOAD_MANIFEST_BLOB = 'full_load_manifest.json'
+
+# Invoice fields compared to decide whether an invoice changed since it was processed. Partner Center
+# amends an invoice's charges rather than reissuing it, so a new total or new amendments mean its line
+# items have to be fetched again.
+INVOICE_CHANGE_FIELDS = ('totalCharges', 'currencyCode', 'billingPeriodStartDate', 'billingPeriodEndDate', 'amendments')
+
+
+class InvoiceManifest:
+    """
+    Record of the invoices already processed by a recon job, kept as a JSON blob next to the recon files.
+
+    Each entry holds the invoice's change fields, the number of line items written and when they were
+    fetched. A run selects only the invoices that are new or whose change fields differ from the manifest,
+    and records each one once its output is committed. Saving is conditional on the blob's eTag, so two
+    runs never silently overwrite each other's records.
+
+    Attributes:
+        container_client (ContainerClient): The container holding the manifest.
+        blob_name (str): The name of the manifest blob.
+        entries (Dict[str, dict]): The processed invoices, keyed by invoice ID.
+    """
+
+    def __init__(self, container_client: ContainerClient, blob_name: str) -> None:
+        """
+        Initialize the manifest and load it from the container.
+
+        Args:
+            container_client (ContainerClient): The container holding the manifest.
+            blob_name (str): The name of the manifest blob, one per job.
+        """
+        self.container_client = container_client
+        self.blob_name = blob_name
+        self.entries: Dict[str, dict] = {}
+        self._etag: Optional[str] = None
+        self.load()
+
+    def load(self) -> None:
+        """
+        Load the manifest from the container, starting empty if there is none yet.
+        """
+        blob_client = self.container_client.get_blob_client(self.blob_name)
+        try:
+            downloader = blob_client.download_blob()
+        except ResourceNotFoundError:
+            self.entries, self._etag = {}, None
+            print(f"No manifest {self.blob_name} yet, every invoice is new.")
+            return
+
+        self._etag = downloader.properties.etag
+        self.entries = json.loads(downloader.readall()).get('invoices', {})
+        print(f"Loaded manifest {self.blob_name} with {len(self.entries)} processed invoice(s).")
+
+    def is_processed(self, invoice: dict) -> bool:
+        """
+        Return whether an invoice was processed and has not changed since.
+
+        Args:
+            invoice (dict): The invoice, as returned by the invoices API.
+
+        Returns:
+            bool: True if the manifest has the invoice with the same change fields.
+        """
+        entry = self.entries.get(invoice['id'])
+        return entry is not None and all(entry.get(field) == invoice.get(field) for field in INVOICE_CHANGE_FIELDS)
+
+    def select_invoices(self, invoices: List[dict], full_refresh: bool = False) -> List[dict]:
+        """
+        Return the invoices that have to be fetched: new ones and changed ones, or all with full_refresh.
+
+        Args:
+            invoices (List[dict]): The invoices, as returned by the invoices API.
+            full_refresh (bool): Select every invoice, whatever the manifest says.
+
+        Returns:
+            List[dict]: The invoices to fetch, in their original order.
+        """
+        if full_refresh:
+            print(f"Full refresh: selecting all {len(invoices)} invoice(s).")
+            return list(invoices)
+
+        new = [invoice for invoice in invoices if invoice['id'] not in self.entries]
+        changed = [invoice for invoice in invoices if invoice['id'] in self.entries and not self.is_processed(invoice)]
+        print(f"{len(new)} new and {len(changed)} changed invoice(s), {len(invoices) - len(new) - len(changed)} unchanged.")
+        selected_ids = {invoice['id'] for invoice in new + changed}
+        return [invoice for invoice in invoices if invoice['id'] in selected_ids]
+
+    def record(self, invoice: dict, line_item_count: int) -> None:
+        """
+        Record an invoice as processed. The record is kept in the container by the next save.
+
+        Args:
+            invoice (dict): The invoice, as returned by the invoices API.
+            line_item_count (int): The number of line items written for the invoice.
+        """
+        entry = {field: invoice.get(field) for field in INVOICE_CHANGE_FIELDS}
+        entry['lineItemCount'] = line_item_count
+        entry['fetchedAt'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.entries[invoice['id']] = entry
+
+    def save(self) -> None:
+        """
+        Save the manifest to the container, unless another run has changed it since it was loaded.
+
+        Raises:
+            Exception: If the manifest was changed or created by another run in the meantime.
+        """
+        blob_client = self.container_client.get_blob_client(self.blob_name)
+        data = json.dumps({'invoices': self.entries}, indent=2, sort_keys=True).encode('utf-8')
+        try:
+            if self._etag is None:
+                result = blob_client.upload_blob(data, overwrite=False)
+            else:
+                result = blob_client.upload_blob(data, overwrite=True, etag=self._etag,
+                                                 match_condition=MatchConditions.IfNotModified)
+        except (ResourceModifiedError, ResourceExistsError):
+            raise Exception(f"Manifest {self.blob_name} was changed by another run, reload it and try again.")
+
+        self._etag = result.get('etag')
+        print(f"Saved manifest {self.blob_name} with {len(self.entries)} processed invoice(s).")
@@ -1,4 +1,3 @@
-import requests as rs
 from zipfile import ZipFile
 from io import BytesIO, StringIO
 import pandas as pd
@@ -7,6 +6,9 @@ import json
 import datetime as dt
 import warnings
 import duckdb as db
+from duckdb_warehouse import DuckDBWarehouse
+from http_transport import get_default_transport
+from token_provider import TokenProvider
 
 def main():
     script_start_time = dt.datetime.now().strftime("%d %b %Y %I:%M %p")
@@ -25,9 +27,9 @@ def main():
         pd.set_option('display.max_columns', None)
         pd.set_option('display.max_rows', None)
 
-    def get_duckdb_client(db_file_path: str):
-        """Connect to DuckDB and return the connection object."""
-        return db.connect(db_file_path)
+    def get_duckdb_client(db_file_path: str) -> DuckDBWarehouse:
+        """Open the DuckDB warehouse, creating its tables if needed."""
+        return DuckDBWarehouse(db_file_path)
 
     def parse_secrets(secrets_file_path: str) -> dict:
         """Parse the secrets.json file and return the secrets as a dictionary."""
@@ -50,27 +52,22 @@ def main():
             print(f"Query execution failed: {e}")
 
     def get_access_token(refresh_token: str, app_id: str, app_secret: str) -> str:
-        """Get an access token using the provided refresh token, app ID, and app secret."""
-        request_body = {
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token,
-            "scope": "openid",
-            "resource": "https://api.partnercenter.microsoft.com",
-            "client_id": app_id,
-            "client_secret": app_secret,
-        }
-
-        response = rs.post(
-            "https://login.windows.net/6e75cca6-47f0-47a3-a928-9d5315750bd9/oauth2/token",
-            data=request_body
+        """Get an access token using the provided refresh token, app ID, and app secret, reusing the cached one while valid."""
+        token_provider = TokenProvider(
+            tenant_id="6e75cca6-47f0-47a3-a928-9d5315750bd9",
+            client_id=app_id,
+            client_secret=app_secret,
+            scope="openid",
+            resource="https://api.partnercenter.microsoft.com",
+            refresh_token=refresh_token,
+            token_url="https://login.windows.net/6e75cca6-47f0-47a3-a928-9d5315750bd9/oauth2/token",
+            cache_file='../token_cache.json'
         )
-        
-        response.raise_for_status()
-        return response.json()['access_token']
+        return token_provider.get_token()
 
     def get_invoices(base_url: str, headers: dict) -> dict:
         """Get all invoices from partner center."""
-        response = rs.get(f"{base_url}{relative_invoices_url}", headers=headers)
+        response = get_default_transport().get(f"{base_url}{relative_invoices_url}", headers=headers)
         response.raise_for_status()
         return response.json().get('items', [])
 
@@ -88,7 +85,8 @@ def main():
     # Get DuckDB client
     print('Trying to connect to DuckDB')
     try:
-        cxn = get_duckdb_client('../duckdb.db')
+        warehouse = get_duckdb_client('../duckdb.db')
+        cxn = warehouse.connection
         print('Connected to DuckDB')
     except Exception as ex:
         print(f'Unable to connect to DuckDB: {ex}')
@@ -118,8 +116,10 @@ def main():
         print(f'Unable to fetch invoices: {ex}')
         return
     
-    invoices_df = pd.DataFrame(invoices)
-    print_query("SELECT * FROM invoices_df LIMIT 5")
+    # Keep the invoices in the warehouse, so they can be queried without fetching them again
+    warehouse.upsert_invoices(invoices)
+    print_query("SELECT * FROM invoices ORDER BY invoiceDate DESC LIMIT 5")
+    warehouse.close()
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,19 @@
-import io
-from typing import Optional
-from blob_client import AzureBlobDownloader
+import os
+from typing import List, Optional, Tuple
+from async_export_client import DEFAULT_EXPORTS, AsyncExportClient, get_billing_month
+from blob_cache import BlobCache
+from blob_client import AzureBlobDownloader, DEFAULT_BATCH_SIZE
 from blob_url_parser import BlobURLParser
 from graph_api_client import GraphAPIClient
+from polling_policy import PollingPolicy
 from resource_location import ResourceLocationParser
 from secret_manager import SecretsManager
 from bigquery_writer import BigQueryUploader
+from duckdb_warehouse import DuckDBWarehouse
+
+# Directory of the export's blobs downloaded for DuckDB when they are not in the blob cache.
+EXPORT_DOWNLOAD_DIR = 'usage_exports'
+
 
 def main() -> None:
     """
@@ -16,11 +24,13 @@ def main() -> None:
     Workflow:
     1. Retrieve secrets from SecretsManager.
     2. Authenticate using GraphAPIClient and retrieve an access token.
-    3. Initialize an unbilled request and check its operation status.
+    3. Start the unbilled exports of the current and last billing period concurrently, and for each one
+       as soon as it succeeds:
     4. Parse the resource location and SAS token to obtain blob storage information.
-    5. Download a gzipped JSON file from Azure Blob Storage into an in-memory stream.
-    6. Unzip the file and process the data by adding a billing_month field.
-    7. Upload the processed data to BigQuery.
+    5. Stream every gzipped JSON file of the export from Azure Blob Storage in parallel.
+    6. Unzip the files and process the data in batches by adding the export's billing_month field.
+    7. Upload the processed batches to BigQuery.
+    8. Load the exports into the local DuckDB warehouse, when DUCKDB_PATH is set.
     """
     # Step 1: Retrieve secrets from SecretsManager
     print("Retrieving secrets...")
@@ -32,7 +42,9 @@ def main() -> None:
         tenant_id=secrets.tenant_id,
         client_id=secrets.client_id,
         client_secret=secrets.client_secret,
-        scope=secrets.scope
+        scope=secrets.scope,
+        token_cache_file=secrets.token_cache_file,
+        polling_policy=PollingPolicy(history_file=secrets.polling_history_file)
     )
 
     # Step 3: Authenticate and obtain an access token
@@ -40,75 +52,81 @@ def main() -> None:
     if not access_token:
         raise Exception("Failed to authenticate with Microsoft.")
 
-    # Step 4: Initialize an unbilled request for the current billing period
-    print("Initializing unbilled request...")
-    headers = graph_client.initialize_unbilled_request(api_url=secrets.unbilled_endpoint, billing_period='current')
-    operation_url: Optional[str] = headers.get('Location')
-    if not operation_url:
-        raise Exception("Failed to initialize unbilled request.")
-
-    # Step 5: Check the status of the unbilled operation request
-    result = graph_client.check_operation_status(operation_url)
-    
-    # Step 6: Parse the resource location details from the response
-    resource_location: Optional[str] = result.get('resourceLocation')
-    if not resource_location:
-        raise Exception("Resource location not found in the result.")
-
-    # Step 7: Parse the resource location to extract storage account details
-    resource_parser = ResourceLocationParser(resource_location)
-    parsed_location = resource_parser.parse_resource_location()
-    
-    root_directory = parsed_location['rootDirectory']
-    sas_token = parsed_location['sasToken']
-    blob_name = parsed_location['blobName']
-
-    # Step 8: Extract the storage account name and container name from the root directory URL
-    print("Extracting storage account and container information...")
-    blob_parser = BlobURLParser(root_directory)
-    storage_account_name, container_name = blob_parser.extract_storage_info()
-    print(f"Extracted Storage Account Name & Container Name")
-
-    # Step 9: In-memory stream for blob data
-    blob_stream = io.BytesIO()
-
-    # Step 10: Initialize the Azure Blob Downloader and download the blob into an in-memory stream
-    print("Downloading blob from Azure Blob Storage...")
-    downloader = AzureBlobDownloader(storage_account_name, sas_token, container_name, blob_name)
-    downloader.download_blob_to_stream(container_name, blob_name, blob_stream)
-
-    # Step 11: Unzip the in-memory stream
-    unzipped_stream = downloader.unzip_blob_stream(blob_stream)
-
-    # Step 12: Ensure the unzipped stream contains data
-    print("Verifying the unzipped stream...")
-    unzipped_stream.seek(0)  # Reset the pointer for further operations
-    if not unzipped_stream.read(1):  # Check if there's any data
-        raise Exception("Blob download or unzip failed.")
-    print("Unzipped stream verification successful.")
-
-    # Step 13: Reset the pointer of unzipped stream for processing
-    unzipped_stream.seek(0)
-
-    # Step 14: Process the unzipped stream to add the `billing_month` field
-    json_data = downloader.process_stream_to_json_with_billing_month(unzipped_stream)
-
-    # Step 15: Initialize BigQueryUploader with credentials from SecretsManager
-    print("Initializing BigQueryUploader...")
-    uploader = BigQueryUploader(
-        project_id=secrets.project_id,
-        dataset_id=secrets.dataset_id,
-        table_id=secrets.table_id
-    )
-
-    # Step 16: Ensure the BigQuery table exists or will be created on upload
+    # Step 4: Start the unbilled exports of the current and last billing period at once. Each export is
+    # polled on its own schedule and uploaded as soon as it succeeds, while the other is still running
+    def upload_export(export: Tuple[str, str], result: dict) -> Optional[Tuple[List[str], str]]:
+        billing_period, currency_code = export
+        billing_month = get_billing_month(billing_period)
+
+        # Step 5: Parse the resource location details from the response
+        resource_location: Optional[str] = result.get('resourceLocation')
+        if not resource_location:
+            raise Exception(f"Resource location not found in the result of the {billing_period} export.")
+
+        # Step 6: Parse the resource location to extract storage account details
+        resource_parser = ResourceLocationParser(resource_location)
+        parsed_location = resource_parser.parse_resource_location()
+
+        root_directory = parsed_location['rootDirectory']
+        sas_token = parsed_location['sasToken']
+        blob_name = parsed_location['blobName']
+        blob_names = resource_parser.parse_blob_names()
+
+        # Step 7: Extract the storage account name and container name from the root directory URL
+        print("Extracting storage account and container information...")
+        blob_parser = BlobURLParser(root_directory)
+        storage_account_name, container_name = blob_parser.extract_storage_info()
+        print(f"Extracted Storage Account Name & Container Name")
+
+        # Step 8: Initialize the Azure Blob Downloader, caching the export's blobs locally by eTag so a re-run
+        # against the same export skips the download
+        blob_cache = BlobCache.from_resource_location(resource_location)
+        downloader = AzureBlobDownloader(storage_account_name, sas_token, container_name, blob_name, cache=blob_cache,
+                                         billing_month=billing_month)
+
+        # Step 9: Stream every blob of the export in parallel, unzipping and parsing them into batches of
+        # records with the `billing_month` field.
+        print(f"Streaming {len(blob_names)} blob(s) of the {billing_period} export from Azure Blob Storage...")
+        record_batches = downloader.iter_record_batches_from_blobs(container_name, blob_names, batch_size=DEFAULT_BATCH_SIZE)
+
+        # Step 10: Initialize BigQueryUploader with credentials from SecretsManager
+        print("Initializing BigQueryUploader...")
+        uploader = BigQueryUploader(
+            project_id=secrets.project_id,
+            dataset_id=secrets.dataset_id,
+            table_id=secrets.table_id
+        )
+
+        # Step 11: Upload the processed data to BigQuery batch by batch
+        print(f"Uploading billing_month {billing_month} to BigQuery...")
+        uploader.upload_batches(record_batches)
+        print(f"Processed blob data with billing month {billing_month} uploaded to BigQuery successfully.")
+
+        # Step 12: Make the gzipped files available locally for DuckDB when DUCKDB_PATH is set, from the
+        # blob cache when the upload above filled it
+        if not secrets.duckdb_path:
+            return None
+        directory = os.path.join(EXPORT_DOWNLOAD_DIR, billing_period)
+        return downloader.download_blobs_to_files(container_name, blob_names, directory), billing_month
+
+    # The table is created before the exports upload to it concurrently
     print("Ensuring the BigQuery table exists...")
-    uploader.create_table_if_not_exists()
-
-    # Step 17: Upload the processed data to BigQuery
-    print("Uploading data to BigQuery...")
-    uploader.upload_data(json_data)
-    print("Processed blob data with billing month uploaded to BigQuery successfully.")
+    BigQueryUploader(project_id=secrets.project_id, dataset_id=secrets.dataset_id, table_id=secrets.table_id).create_table_if_not_exists()
+
+    export_client = AsyncExportClient(graph_client)
+    downloaded_exports = export_client.run_exports(secrets.unbilled_endpoint, DEFAULT_EXPORTS, upload_export)
+
+    # Step 13: Load the exports into the local DuckDB warehouse when DUCKDB_PATH is set. DuckDB reads the
+    # gzipped files itself, one export after the other on a single connection
+    if secrets.duckdb_path:
+        print("Loading the exports into the DuckDB warehouse...")
+        warehouse = DuckDBWarehouse(secrets.duckdb_path)
+        try:
+            for paths, billing_month in downloaded_exports.values():
+                warehouse.load_usage_files(paths, billing_month)
+        finally:
+            warehouse.close()
+    graph_client.transport.print_latency_report()
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,45 @@
 import io
-import json
-import csv
 import time
-import os
-from datetime import datetime
+from typing import Iterable, Optional, Tuple
+from blob_cache import BlobCache
 from blob_client import AzureBlobDownloader
 from blob_url_parser import BlobURLParser
 from graph_api_client import GraphAPIClient
+from polling_policy import PollingPolicy
 from resource_location import ResourceLocationParser
+from row_count_store import RowCountStore
 from secret_manager import SecretsManager
 
+# Size of the reads when counting the rows of a stream.
+COUNT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Billing period monitored by the hourly run.
+BILLING_PERIOD = 'current'
+
+
+def count_rows_in_chunks(chunks: Iterable[bytes]) -> Tuple[int, int]:
+    """
+    Count the JSON lines in a sequence of decompressed chunks, without joining or decoding them.
+
+    Args:
+        chunks (Iterable[bytes]): The decompressed data, in order.
+
+    Returns:
+        Tuple[int, int]: The number of rows, and the number of bytes. A last line without a trailing newline counts as a row.
+    """
+    row_count = 0
+    byte_count = 0
+    last_byte = b'\n'
+    for chunk in chunks:
+        if chunk:
+            row_count += chunk.count(b'\n')
+            byte_count += len(chunk)
+            last_byte = chunk[-1:]
+    if last_byte != b'\n':
+        row_count += 1
+    return row_count, byte_count
+
+
 def count_rows_in_stream(stream: io.BytesIO) -> int:
     """
     Count the number of rows in the unzipped JSON stream.
@@ -21,40 +51,61 @@ def count_rows_in_stream(stream: io.BytesIO) -> int:
         int: The number of rows in the file.
     """
     stream.seek(0)  # Reset pointer to the beginning
-    row_count = 0
-    
-    for line in stream:
-        row_count += 1
-
+    row_count, _ = count_rows_in_chunks(iter(lambda: stream.read(COUNT_CHUNK_SIZE), b''))
     return row_count
 
-def write_row_count_to_file(row_count: int) -> None:
+
+def count_export_rows(downloader: AzureBlobDownloader, container_name: str, blob_names: list) -> Tuple[int, int, int]:
     """
-    Write the row count to a file with a timestamp.
-    
+    Count the rows of every blob of an export, streaming each blob through gunzip chunk by chunk.
+
     Args:
-        row_count (int): The number of rows counted.
+        downloader (AzureBlobDownloader): The downloader of the export's container.
+        container_name (str): The container name.
+        blob_names (list): The blobs of the export.
+
+    Returns:
+        Tuple[int, int, int]: The number of rows, compressed bytes and uncompressed bytes.
     """
-    timestamp = datetime.now().strftime("%H:%M")
-    row_count_msg = f"The row_count at {timestamp} is {row_count}\n"
-    
-    # Append row count to a file
-    with open('row_count_log.txt', 'a') as file:
-        file.write(row_count_msg)
-    print(row_count_msg)
+    row_count = compressed_bytes = uncompressed_bytes = 0
+    for blob_name in blob_names:
+        sizes = []
+
+        def count_compressed(chunks: Iterable[bytes]) -> Iterable[bytes]:
+            for chunk in chunks:
+                sizes.append(len(chunk))
+                yield chunk
+
+        compressed_chunks = count_compressed(downloader.iter_blob_chunks(container_name, blob_name))
+        blob_rows, blob_bytes = count_rows_in_chunks(downloader.iter_unzipped_chunks(compressed_chunks))
+        print(f"Counted {blob_rows} rows in {blob_name}.")
+        row_count += blob_rows
+        uncompressed_bytes += blob_bytes
+        compressed_bytes += sum(sizes)
+    return row_count, compressed_bytes, uncompressed_bytes
+
 
-def main() -> None:
+def main(store: Optional[RowCountStore] = None) -> None:
     """
-    Main function to download a file, unzip it, count rows, and log the row count.
+    Request an unbilled export, count its rows and record the count in the time series.
+
+    The export is only downloaded and counted if its eTag and createdDateTime differ from the last
+    counted export. Otherwise the previous counts are recorded again as an unchanged sample.
+
+    Args:
+        store (Optional[RowCountStore]): The row count time series. Defaults to row_counts.db.
     """
     secrets = SecretsManager()
+    store = store or RowCountStore()
 
     # Initialize the Graph API client using credentials from SecretsManager
     graph_client = GraphAPIClient(
         tenant_id=secrets.tenant_id,
         client_id=secrets.client_id,
         client_secret=secrets.client_secret,
-        scope=secrets.scope
+        scope=secrets.scope,
+        token_cache_file=secrets.token_cache_file,
+        polling_policy=PollingPolicy(history_file=secrets.polling_history_file)
     )
 
     # Authenticate and obtain an access token
@@ -63,17 +114,31 @@ def main() -> None:
         raise Exception("Failed to authenticate with Microsoft.")
     
     # Initialize an unbilled request for the current billing period
-    headers = graph_client.initialize_unbilled_request(api_url=secrets.unbilled_endpoint, billing_period='current')
+    export_start = time.perf_counter()
+    headers = graph_client.initialize_unbilled_request(api_url=secrets.unbilled_endpoint, billing_period=BILLING_PERIOD)
     operation_url = headers.get('Location')
     if not operation_url:
         raise Exception("Failed to initialize unbilled request.")
     
     # Check the status of the unbilled operation request
     result = graph_client.check_operation_status(operation_url)
+    export_seconds = time.perf_counter() - export_start
     
     # Parse the resource location details from the response
-    resource_location_json = json.dumps(result.get('resourceLocation'))
-    init_resource_location = ResourceLocationParser(resource_location_json)
+    resource_location = result.get('resourceLocation')
+    init_resource_location = ResourceLocationParser(resource_location)
+    blob_names = init_resource_location.parse_blob_names()
+    etag = resource_location.get('eTag')
+    created_at = resource_location.get('createdDateTime')
+
+    # The export is produced from the same data as the last one, so its counts have not changed
+    last_sample = store.get_last_sample(BILLING_PERIOD)
+    if last_sample and ((etag and etag == last_sample['export_etag']) or
+                        (created_at and created_at == last_sample['export_created_at'])):
+        print(f"Export {etag} created at {created_at} was already counted, skipping the download.")
+        store.record(BILLING_PERIOD, etag, created_at, last_sample['blob_count'], last_sample['row_count'],
+                     last_sample['compressed_bytes'], last_sample['uncompressed_bytes'], export_seconds, 0, skipped=True)
+        return
     
     # Extract the root directory, SAS token, and blob name from the resource location
     root_directory, sas_token, blob_name = init_resource_location.parse_resource_location().values()
@@ -81,36 +146,23 @@ def main() -> None:
     # Extract the storage account name and container name from the root directory URL
     storage_account_name, container_name = BlobURLParser(root_directory).extract_storage_info()
 
-    # In-memory stream for blob data
-    blob_stream = io.BytesIO()
-
-    # Initialize the Azure Blob Downloader and download the blob into an in-memory stream
-    downloader = AzureBlobDownloader(storage_account_name, sas_token, container_name, blob_name)
-    downloader.download_blob_to_stream(container_name, blob_name, blob_stream)
+    # Stream every blob through gunzip and count its lines chunk by chunk, the export is never held in memory.
+    # The blobs are cached locally by eTag, so other jobs reading the same export do not download it again
+    blob_cache = BlobCache.from_resource_location(resource_location)
+    downloader = AzureBlobDownloader(storage_account_name, sas_token, container_name, blob_name, cache=blob_cache)
+    count_start = time.perf_counter()
+    row_count, compressed_bytes, uncompressed_bytes = count_export_rows(downloader, container_name, blob_names)
+    count_seconds = time.perf_counter() - count_start
 
-    # Unzip the in-memory stream
-    unzipped_stream = downloader.unzip_blob_stream(blob_stream)
-
-    # Ensure the unzipped stream contains data
-    unzipped_stream.seek(0)  # Reset the pointer for further operations
-    if not unzipped_stream.read(1):  # Check if there's any data
+    if uncompressed_bytes == 0:
         raise Exception("Blob download or unzip failed.")
-    
-    # Reset the pointer of unzipped stream for row counting
-    unzipped_stream.seek(0)
-
-    # Count the number of rows in the unzipped file
-    row_count = count_rows_in_stream(unzipped_stream)
-
-    # Log the row count with the current timestamp
-    write_row_count_to_file(row_count)
 
-    # Save the unzipped stream locally
-    unzipped_stream.seek(0)
-    with open('unzipped_data.json', 'wb') as f:
-        f.write(unzipped_stream.read())
+    # Log the row count with the export details and timings
+    store.record(BILLING_PERIOD, etag, created_at, len(blob_names), row_count, compressed_bytes, uncompressed_bytes,
+                 export_seconds, count_seconds)
 
-    print("File downloaded and row count logged.")
+    print(f"Counted {row_count} rows ({uncompressed_bytes} bytes, {compressed_bytes} compressed) in {count_seconds:.1f} seconds.")
+    print(blob_cache)
     
     # Commenting out BigQuery upload for now
     # uploader = BigQueryUploader(
@@ -123,6 +175,7 @@ def main() -> None:
     print("BigQuery upload part is commented out.")
 
 if __name__ == "__main__":
+    store = RowCountStore()
     while True:
-        main()
+        main(store)
         time.sleep(3600)  # Wait for one hour before running the process again
@@ -0,0 +1,107 @@
+from typing import Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from http_transport import HttpTransport
+from rate_limiter import TokenBucket
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Largest page the invoice line items endpoints return.
+DEFAULT_PAGE_SIZE = 2000
+
+# Fields dropped from every line item before it is written out.
+DROPPED_LINE_ITEM_FIELDS = ('priceAdjustmentDescription', 'attributes', 'productQualifiers')
+
+
+def iter_pages(transport: HttpTransport, url: str, get_headers: Callable[[], Dict[str, str]],
+               page_size: int = DEFAULT_PAGE_SIZE, rate_limiter: Optional[TokenBucket] = None) -> Iterator[List[dict]]:
+    """
+    Follow the continuation links of a Partner Center collection and yield its items one page at a time.
+
+    The first request asks for page_size items. Each response's links.next gives the URI of the next page
+    (with seekOperation=Next) and the MS-ContinuationToken header to send with it. Only one page is held in
+    memory at a time, so memory stays flat however large the collection is.
+
+    Args:
+        transport (HttpTransport): The HTTP transport.
+        url (str): The URL of the first page.
+        get_headers (Callable[[], Dict[str, str]]): Returns the request headers, called before every page so
+            the access token stays valid.
+        page_size (int): The number of items requested per page.
+        rate_limiter (Optional[TokenBucket]): Takes a token before every page, to share a request budget across threads.
+
+    Yields:
+        List[dict]: The items of one page.
+
+    Raises:
+        Exception: If a page cannot be fetched.
+    """
+    url = _with_page_size(url, page_size)
+    extra_headers: Dict[str, str] = {}
+    page_count = 0
+    item_count = 0
+    while url:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        response = transport.get(url, headers={**get_headers(), **extra_headers})
+        if response.status_code != 200:
+            raise Exception(f"Error fetching page {page_count + 1} of {url}: {response.status_code}, {response.content}")
+
+        page = orjson.loads(response.content) if orjson is not None else response.json()
+        items = page.get('items', [])
+        page_count += 1
+        item_count += len(items)
+        if items:
+            yield items
+
+        next_link = (page.get('links') or {}).get('next')
+        if not next_link or not next_link.get('uri'):
+            break
+        url = _resolve_uri(url, next_link['uri'])
+        extra_headers = {header['key']: header['value'] for header in next_link.get('headers', [])}
+        if page.get('continuationToken') and 'MS-ContinuationToken' not in extra_headers:
+            extra_headers['MS-ContinuationToken'] = page['continuationToken']
+
+    print(f"Fetched {item_count} items in {page_count} page(s).")
+
+
+def clean_line_items(items: List[dict]) -> List[dict]:
+    """
+    Drop the nested fields that are not kept from every line item, in place.
+
+    Args:
+        items (List[dict]): The line items of one page.
+
+    Returns:
+        List[dict]: The same list.
+    """
+    for item in items:
+        for field in DROPPED_LINE_ITEM_FIELDS:
+            item.pop(field, None)
+    return items
+
+
+def _with_page_size(url: str, page_size: Optional[int]) -> str:
+    """
+    Return the URL with its size query parameter set, unless the URL already has one.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if page_size is None or any(key.lower() == 'size' for key, _ in query):
+        return url
+    return urlunsplit(parts._replace(query=urlencode(query + [('size', str(page_size))])))
+
+
+def _resolve_uri(current_url: str, uri: str) -> str:
+    """
+    Resolve a links.next URI, which is relative to the API version root, e.g. "/invoices/G1/lineitems?...".
+    """
+    if uri.startswith('http://') or uri.startswith('https://'):
+        return uri
+    parts = urlsplit(current_url)
+    version = parts.path.strip('/').split('/')[0]
+    if not uri.startswith(f"/{version}/"):
+        uri = f"/{version}{uri if uri.startswith('/') else '/' + uri}"
+    return f"{parts.scheme}://{parts.netloc}{uri}"
@@ -2,7 +2,6 @@ import csv
 from io import StringIO
 from secret_manager import SecretsManager
 from datetime import datetime, timedelta
-import requests
 import re
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
 import pandas as pd
@@ -10,13 +9,24 @@ import pyarrow as pa
 import pyarrow.parquet as pq
 from io import BytesIO
 import time
+from typing import Iterable, Iterator, Optional
+from blob_block_writer import BlockBlobWriter
+from http_transport import HttpTransport, get_default_transport
+from partner_center_paging import DEFAULT_PAGE_SIZE, clean_line_items, iter_pages
+from rate_limiter import TokenBucket
+from fabric_capacity import RECON_JOB_NAME, FabricCapacityManager
+from invoice_manifest import RECON_LINE_ITEMS_MANIFEST_BLOB, InvoiceManifest
+from recon_parquet import DEFAULT_DATASET_ROOT, ParquetDatasetWriter
+from recon_sink import CsvLineItemSink
+from token_provider import TokenProvider
 
 # Initialize SecretsManager to fetch credentials
 secrets = SecretsManager()
 
 class PartnerCenterAPIClient:
     def __init__(self, base_url: str, client_id: str, client_secret: str, tenant_id: str, 
-                 invoice_url: str, invoice_line_items_url: str, scope: str, blob_connection_string: str, blob_container_name: str):
+                 invoice_url: str, invoice_line_items_url: str, scope: str, blob_connection_string: str, blob_container_name: str,
+                 token_cache_file: Optional[str] = None, transport: Optional[HttpTransport] = None):
         """
         Initializes the PartnerCenterAPIClient with the provided credentials and URLs.
         """
@@ -34,6 +44,17 @@ class PartnerCenterAPIClient:
         self.blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
         self.blob_container_name = blob_container_name.lower()
 
+        # Pooled connections with retries on 429/5xx, shared with the other clients unless one is injected
+        self.transport = transport or get_default_transport()
+
+        # Caches the access token until shortly before it expires, shared with other clients of the same app
+        self.token_provider = TokenProvider(tenant_id, client_id, client_secret, scope, cache_file=token_cache_file,
+                                            transport=self.transport)
+
+        # Resumes the Fabric capacity once per window for every job needing it, suspended by the clean-up job
+        self.fabric_capacity = FabricCapacityManager.from_secrets(
+            secrets, self.blob_service_client.get_container_client(self.blob_container_name), transport=self.transport)
+
     def check_blob_exists(self, blob_name: str) -> bool:
         """
         Checks if the specified blob exists in the Azure Blob Storage container.
@@ -49,46 +70,21 @@ class PartnerCenterAPIClient:
 
     def resume_fabric_capacity(self):
         """
-        Calls the API to resume Fabric capacity and waits 30 seconds to allow the capacity to be fully available.
+        Acquires the Fabric capacity for the recon job and waits until it is active.
+
+        The capacity is resumed only if no other job already did, and stays up until the clean-up job
+        releases it (see recon_line_items_delete_recon_file.py).
         """
-        resume_url = "https://prod2-03.centralindia.logic.azure.com:443/workflows/3abceea03f6d477a999aab317aae1f0b/triggers/When_a_HTTP_request_is_received/paths/invoke?api-version=2016-10-01&sp=%2Ftriggers%2FWhen_a_HTTP_request_is_received%2Frun&sv=1.0&sig=9GidnrLPemnX8ekgH1Abdi2lejeclnGZgNW9-6-e1J8"
-        
-        body = {"Action": "resume"}
-        headers = {'Content-Type': 'application/json'}
-
-        response = requests.post(resume_url, json=body, headers=headers)
-        
-        if response.status_code == 200 or response.status_code == 202:
-            print("Fabric capacity resumed successfully or is in the process of starting.")
-            print("Waiting 30 seconds to ensure the capacity is fully available...")
-            time.sleep(30)  # Wait for 30 seconds to allow the capacity to open
-        else:
-            raise Exception(f"Failed to resume Fabric capacity: {response.status_code}, {response.content}")
+        self.fabric_capacity.acquire(RECON_JOB_NAME)
 
 
     def get_access_token(self) -> str:
         """
         Obtains an access token for authentication with the Partner Center API.
-        """
-        token_url = f"https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token"
-        
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        body = {
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'scope': self.scope, 
-            'grant_type': 'client_credentials'
-        }
-
-        response = requests.post(token_url, data=body, headers=headers)
-        if response.status_code == 200:
-            token_data = response.json()
-            self.access_token = token_data['access_token']
-        else:
-            raise Exception(f"Failed to authenticate: {response.status_code}, {response.content}")
 
+        The cached token is returned while it is valid, so calling this before every request is cheap.
+        """
+        self.access_token = self.token_provider.get_token()
         return self.access_token
 
     def get_invoice_ids(self) -> list[dict]:
@@ -99,10 +95,10 @@ class PartnerCenterAPIClient:
             list[dict]: List of invoice data with IDs and billing dates.
         """
         headers = {
-            'Authorization': f'Bearer {self.access_token}',
+            'Authorization': f'Bearer {self.get_access_token()}',
             'Content-Type': 'application/json'
         }
-        response = requests.get(f"{self.invoice_url}", headers=headers)
+        response = self.transport.get(f"{self.invoice_url}", headers=headers)
         if response.status_code == 200:
             return response.json().get('items', [])
         else:
@@ -134,73 +130,143 @@ class PartnerCenterAPIClient:
 
         return matching_invoice_ids
 
-    def get_invoice_line_items(self, invoice_id: str) -> list[dict]:
+    def iter_invoice_line_items(self, invoice_id: str, page_size: int = DEFAULT_PAGE_SIZE,
+                                rate_limiter: Optional[TokenBucket] = None) -> Iterator[list[dict]]:
         """
-        Retrieves line items for a specific invoice ID from the Partner Center API.
+        Retrieves line items for a specific invoice ID from the Partner Center API, one page at a time.
+
+        Continuation links are followed until the last page, so large invoices are fetched in full while
+        only one page is held in memory.
 
         Args:
             invoice_id (str): The ID of the invoice to fetch line items for.
+            page_size (int): The number of line items requested per page.
+            rate_limiter (Optional[TokenBucket]): Shares a request budget with other threads fetching invoices.
 
-        Returns:
-            list[dict]: List of line items associated with the invoice, excluding 'priceAdjustmentDescription'.
+        Yields:
+            list[dict]: The line items of one page, excluding 'priceAdjustmentDescription', 'attributes' and 'productQualifiers'.
         """
         # Replace the invoice ID in the line items URL
         line_items_url = self.invoice_line_items_url.replace("<invoiceID>", invoice_id)
 
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
+        def get_headers() -> dict:
+            return {
+                'Authorization': f'Bearer {self.get_access_token()}',
+                'Content-Type': 'application/json'
+            }
 
-        response = requests.get(line_items_url, headers=headers)
-        if response.status_code == 200:
-            line_items = response.json().get('items', [])
-            
-            # Remove 'priceAdjustmentDescription' from each item
-            for item in line_items:
-                item.pop('priceAdjustmentDescription', None)  # Remove 'priceAdjustmentDescription' if exists
-                item.pop('attributes', None)  # Remove 'attributes' if exists
-                item.pop('productQualifiers', None)  # Remove 'productqualifies' if exists
-        
-            return line_items
-        else:
-            raise Exception(f"Error fetching invoice line items for {invoice_id}: {response.status_code}, {response.content}")
+        try:
+            for line_items in iter_pages(self.transport, line_items_url, get_headers, page_size, rate_limiter):
+                yield clean_line_items(line_items)
+        except Exception as e:
+            raise Exception(f"Error fetching invoice line items for {invoice_id}: {e}")
 
-    def write_to_blob_storage(self, line_items: list[dict], invoice_id: str):
+    def get_invoice_line_items(self, invoice_id: str) -> list[dict]:
         """
-        Writes the line items to Azure Blob Storage in CSV format.
+        Retrieves all line items for a specific invoice ID from the Partner Center API.
 
         Args:
-            line_items (list[dict]): The line items to write.
-            invoice_id (str): The ID of the invoice, used for naming the file.
+            invoice_id (str): The ID of the invoice to fetch line items for.
+
+        Returns:
+            list[dict]: List of line items associated with the invoice, excluding 'priceAdjustmentDescription'.
         """
-        # Convert complex types like lists or dictionaries into strings for CSV
-        for item in line_items:
-            for key, value in item.items():
-                if isinstance(value, (dict, list)):
-                    item[key] = str(value)  # Convert to string to handle complex types in CSV
+        return [line_item for line_items in self.iter_invoice_line_items(invoice_id) for line_item in line_items]
 
-        # Create a DataFrame from the line items
-        df = pd.DataFrame(line_items)
+    def open_blob_writer(self, blob_name: str) -> BlockBlobWriter:
+        """
+        Opens a writer uploading a blob block by block as it is written.
 
-        # Create a CSV file in memory
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False)
+        Args:
+            blob_name (str): The name of the blob, replaced when the writer is closed.
 
+        Returns:
+            BlockBlobWriter: The writer, to be closed to commit the blob.
+        """
         # Ensure the container exists
         container_client = self.blob_service_client.get_container_client(self.blob_container_name)
         if not container_client.exists():
             container_client.create_container()
 
-        # Get blob client for the container and blob (using invoice_id for filename)
-        blob_client = self.blob_service_client.get_blob_client(
-            container=self.blob_container_name,
-            blob=f"invoice_line_items.csv"
-        )
+        blob_client = self.blob_service_client.get_blob_client(container=self.blob_container_name, blob=blob_name)
+        return BlockBlobWriter(blob_client)
+
+    def open_parquet_dataset(self, root: str = DEFAULT_DATASET_ROOT) -> ParquetDatasetWriter:
+        """
+        Opens the Hive-partitioned Parquet dataset of recon line items in the container.
+
+        Args:
+            root (str): The root directory of the dataset.
+
+        Returns:
+            ParquetDatasetWriter: The writer of the dataset.
+        """
+        container_client = self.blob_service_client.get_container_client(self.blob_container_name)
+        if not container_client.exists():
+            container_client.create_container()
+        return ParquetDatasetWriter(container_client, root)
+
+    def open_manifest(self) -> InvoiceManifest:
+        """
+        Loads the manifest of the invoices already processed by this job, kept in the container.
 
-        # Upload CSV content to Azure Blob Storage
-        blob_client.upload_blob(csv_buffer.getvalue(), overwrite=True)
-        print(f"Successfully uploaded invoice {invoice_id} line items to Azure Blob Storage in CSV format.")
+        Returns:
+            InvoiceManifest: The manifest.
+        """
+        container_client = self.blob_service_client.get_container_client(self.blob_container_name)
+        if not container_client.exists():
+            container_client.create_container()
+        return InvoiceManifest(container_client, RECON_LINE_ITEMS_MANIFEST_BLOB)
+
+    def write_to_parquet_dataset(self, line_items: Iterable[list[dict]], billing_month: str, invoice_id: str) -> int:
+        """
+        Writes the line items to the Parquet dataset, and to the CSV file the Fabric pipeline picks up.
+
+        Both outputs are written in a single pass over the pages. The CSV file is the handoff to Fabric and to
+        recon_line_items_delete_recon_file.py, so it is only committed once the invoice's partition is written.
+
+        Args:
+            line_items (Iterable[list[dict]]): The pages of line items to write, e.g. from iter_invoice_line_items.
+            billing_month (str): The billing month, as YYYY-MM.
+            invoice_id (str): The ID of the invoice.
+
+        Returns:
+            int: The number of line items written.
+        """
+        with self.open_blob_writer("invoice_line_items.csv") as writer:
+            sink = CsvLineItemSink(writer)
+
+            def write_csv_pages(pages: Iterable[list[dict]]) -> Iterator[list[dict]]:
+                for page in pages:
+                    sink.write(page)
+                    yield page
+
+            row_count = self.open_parquet_dataset().write_invoice(write_csv_pages(line_items), billing_month, invoice_id)
+            sink.close()
+        print(f"Successfully uploaded {row_count} line items of invoice {invoice_id} to the Parquet dataset and in CSV format.")
+        return row_count
+
+    def write_to_blob_storage(self, line_items: Iterable[list[dict]], invoice_id: str) -> int:
+        """
+        Writes the line items to Azure Blob Storage in CSV format.
+
+        Each page is serialized and its blocks uploaded while the next pages are fetched, so the file is never
+        held in memory in full. Complex types like lists or dictionaries are written as strings.
+
+        Args:
+            line_items (Iterable[list[dict]]): The pages of line items to write, e.g. from iter_invoice_line_items.
+            invoice_id (str): The ID of the invoice.
+
+        Returns:
+            int: The number of line items written.
+        """
+        with self.open_blob_writer("invoice_line_items.csv") as writer:
+            sink = CsvLineItemSink(writer)
+            for page in line_items:
+                sink.write(page)
+            row_count = sink.close()
+        print(f"Successfully uploaded {row_count} line items of invoice {invoice_id} to Azure Blob Storage in CSV format.")
+        return row_count
 
 def main():
     # Load secrets
@@ -215,7 +281,8 @@ def main():
     blob_container_name = secrets.blob_container_name
 
     # Initialize API client
-    api_client = PartnerCenterAPIClient(base_url, client_id, client_secret, tenant_id, invoice_url, invoice_line_items_url, scope, blob_connection_string, blob_container_name)
+    api_client = PartnerCenterAPIClient(base_url, client_id, client_secret, tenant_id, invoice_url, invoice_line_items_url, scope, blob_connection_string, blob_container_name,
+                                        token_cache_file=secrets.token_cache_file)
 
     try:
         # Check if the blob exists before continuing with Fabric capacity resumption
@@ -225,9 +292,6 @@ def main():
             print(f"Blob '{blob_name}' already exists. Exiting process.")
             return  # Exit if the blob is present
 
-        print(f"Blob '{blob_name}' does not exist. Proceeding with resuming Fabric capacity...")
-        api_client.resume_fabric_capacity()
-
         # Fetch access token and invoice data
         print("Fetching access token...")
         access_token = api_client.get_access_token()
@@ -252,15 +316,32 @@ def main():
         if matching_invoice_ids:
             print(f"Found matching invoice ID(s) for {last_month_name}: {matching_invoice_ids}")
             invoice_id = matching_invoice_ids[0]
+            invoice = next(invoice for invoice in invoice_ids if invoice['id'] == invoice_id)
+
+            # Skip invoices already processed and unchanged, unless RECON_FULL_REFRESH is set
+            manifest = api_client.open_manifest()
+            if not manifest.select_invoices([invoice], full_refresh=secrets.recon_full_refresh):
+                print(f"Invoice {invoice_id} was already processed and has not changed. Exiting process.")
+                return
+
+            print("Proceeding with resuming Fabric capacity...")
+            api_client.resume_fabric_capacity()
+
             print(f"Fetching line items for invoice ID: {invoice_id}...")
-            line_items = api_client.get_invoice_line_items(invoice_id)
+            line_items = api_client.iter_invoice_line_items(invoice_id)
 
             # Add billing_month information
             # for item in line_items:
             #     item['billing_month'] = billing_month
 
-            # Write line items to Azure Blob Storage in Parquet format
-            api_client.write_to_blob_storage(line_items, invoice_id)
+            # Write line items to Azure Blob Storage while they are fetched
+            if secrets.recon_output_format == 'parquet':
+                row_count = api_client.write_to_parquet_dataset(line_items, last_month.strftime('%Y-%m'), invoice_id)
+            else:
+                row_count = api_client.write_to_blob_storage(line_items, invoice_id)
+
+            manifest.record(invoice, row_count)
+            manifest.save()
 
         else:
             print(f"No matching invoices for {last_month_name}.")
@@ -1,6 +1,6 @@
 from azure.storage.blob import BlobServiceClient, BlobClient
 from secret_manager import SecretsManager
-import requests
+from fabric_capacity import RECON_JOB_NAME, FabricCapacityManager
 
 secrets = SecretsManager()
 
@@ -26,16 +26,21 @@ def delete_blob_file(connection_string: str, container_name: str, blob_name: str
 
     except Exception as e:
         print(f"An error occurred: {e}")
-def suspend_fabric_capacity():
+def suspend_fabric_capacity(connection_string: str, container_name: str, idle_timeout: float = 0) -> bool:
     """
-    Calls the API to resume Fabric capacity and waits 30 seconds to allow the capacity to be fully available.
-    """
-    resume_url = "https://prod2-03.centralindia.logic.azure.com:443/workflows/3abceea03f6d477a999aab317aae1f0b/triggers/When_a_HTTP_request_is_received/paths/invoke?api-version=2016-10-01&sp=%2Ftriggers%2FWhen_a_HTTP_request_is_received%2Frun&sv=1.0&sig=9GidnrLPemnX8ekgH1Abdi2lejeclnGZgNW9-6-e1J8"
-    
-    body = {"Action": "suspend"}
-    headers = {'Content-Type': 'application/json'}
+    Releases the recon job's hold on the Fabric capacity, and suspends the capacity if no other job holds it.
+
+    Args:
+        connection_string (str): Azure Storage account connection string.
+        container_name (str): Name of the container holding the capacity leases.
+        idle_timeout (float): Seconds to keep the capacity up for jobs starting shortly after, 0 to suspend right away.
 
-    response = requests.post(resume_url, json=body, headers=headers)
+    Returns:
+        bool: True if the capacity was suspended.
+    """
+    container_client = BlobServiceClient.from_connection_string(connection_string).get_container_client(container_name.lower())
+    capacity = FabricCapacityManager.from_secrets(secrets, container_client)
+    return capacity.release(RECON_JOB_NAME, idle_timeout=idle_timeout)
 
 
 # Example usage:
@@ -51,7 +56,7 @@ def main():
 
         # After deleting the blob, suspend Fabric capacity
         print("Suspending Fabric capacity...")
-        suspend_fabric_capacity()
+        suspend_fabric_capacity(connection_string, container_name)
     
     except Exception as e:
         print(f"An error occurred in the main function: {e}")
@@ -0,0 +1,240 @@
+import json
+from typing import Dict, Iterable, List, Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
+from azure.storage.blob import ContainerClient
+from arrow_schema import cast_column
+from blob_block_writer import BlockBlobWriter
+
+# Root directory of the dataset in the container.
+DEFAULT_DATASET_ROOT = 'recon_line_items'
+
+# Rows per Parquet file, and per row group within a file.
+DEFAULT_MAX_ROWS_PER_FILE = 1000000
+DEFAULT_ROW_GROUP_SIZE = 100000
+
+DEFAULT_COMPRESSION = 'zstd'
+
+# Flat recon line item fields, in the order they are written out. The DuckDB warehouse keeps any other
+# field in its extra_fields JSON column, so a new field from Partner Center never fails a load there.
+RECON_LINE_ITEM_COLUMNS = [
+    'partnerId', 'customerId', 'customerName', 'customerDomainName', 'customerCountry', 'invoiceNumber', 'mpnId',
+    'resellerMpnId', 'orderId', 'orderDate', 'productId', 'skuId', 'availabilityId', 'skuName', 'productName',
+    'chargeType', 'unitPrice', 'effectiveUnitPrice', 'unitType', 'quantity', 'billableQuantity', 'subtotal',
+    'taxTotal', 'totalForCustomer', 'totalOtherDiscount', 'currency', 'pricingCurrency', 'pcToBCExchangeRate',
+    'pcToBCExchangeRateDate', 'publisherName', 'publisherId', 'subscriptionDescription', 'subscriptionId',
+    'subscriptionStartDate', 'subscriptionEndDate', 'chargeStartDate', 'chargeEndDate', 'termAndBillingCycle',
+    'billingFrequency', 'alternateId', 'meterDescription', 'reservationOrderId', 'creditReasonCode', 'referenceId',
+    'promotionId', 'productCategory', 'invoiceLineItemType', 'billingProvider',
+]
+
+# Column holding, as a JSON object, the fields of a line item that are not in RECON_LINE_ITEM_COLUMNS.
+EXTRA_FIELDS_COLUMN = 'extra_fields'
+
+# Types of the recon line item fields that are not strings. Every other field is written as a string,
+# and nested values as JSON text.
+RECON_LINE_ITEM_TYPES: Dict[str, pa.DataType] = {
+    'unitPrice': pa.float64(),
+    'effectiveUnitPrice': pa.float64(),
+    'quantity': pa.float64(),
+    'billableQuantity': pa.float64(),
+    'subtotal': pa.float64(),
+    'taxTotal': pa.float64(),
+    'totalForCustomer': pa.float64(),
+    'totalOtherDiscount': pa.float64(),
+    'pcToBCExchangeRate': pa.float64(),
+    'orderDate': pa.timestamp('us', tz='UTC'),
+    'chargeStartDate': pa.timestamp('us', tz='UTC'),
+    'chargeEndDate': pa.timestamp('us', tz='UTC'),
+    'subscriptionStartDate': pa.timestamp('us', tz='UTC'),
+    'subscriptionEndDate': pa.timestamp('us', tz='UTC'),
+    'pcToBCExchangeRateDate': pa.timestamp('us', tz='UTC'),
+}
+
+# Columns given by the partition path, dropped from the files themselves.
+PARTITION_COLUMNS = ('billing_month', 'invoice_id')
+
+# Schema of every Parquet file of the dataset, whatever fields the line items of an invoice have.
+RECON_LINE_ITEM_SCHEMA = pa.schema(
+    [pa.field(name, RECON_LINE_ITEM_TYPES.get(name, pa.string())) for name in RECON_LINE_ITEM_COLUMNS]
+    + [pa.field(EXTRA_FIELDS_COLUMN, pa.string())]
+)
+
+
+def _to_string(value) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+
+def get_extra_fields(item: dict, column_names: List[str] = RECON_LINE_ITEM_COLUMNS) -> Optional[str]:
+    """
+    Return the fields of a line item that have no column of their own as JSON text, None if there are none.
+
+    Args:
+        item (dict): The line item.
+        column_names (List[str]): The columns of the output.
+
+    Returns:
+        Optional[str]: The other fields as a JSON object with sorted keys.
+    """
+    extra_fields = {key: value for key, value in item.items() if key not in column_names and key not in PARTITION_COLUMNS}
+    if not extra_fields:
+        return None
+    return json.dumps(extra_fields, sort_keys=True, default=str)
+
+
+def line_items_to_table(line_items: List[dict], column_names: Optional[List[str]] = None) -> pa.Table:
+    """
+    Convert line items to a table with typed columns.
+
+    Fields listed in RECON_LINE_ITEM_TYPES are cast to their type, e.g. amounts to float64 and dates to UTC
+    timestamps. Every other field is a string, with nested dicts and lists written as JSON text.
+
+    Args:
+        line_items (List[dict]): The line items.
+        column_names (Optional[List[str]]): The columns to write, in order. Defaults to every field of the line items.
+
+    Returns:
+        pa.Table: The line items as a table.
+    """
+    if column_names is None:
+        names: Dict[str, None] = {}
+        for item in line_items:
+            names.update(dict.fromkeys(item))
+        column_names = [name for name in names if name not in PARTITION_COLUMNS]
+
+    columns = []
+    for name in column_names:
+        values = [item.get(name) for item in line_items]
+        arrow_type = RECON_LINE_ITEM_TYPES.get(name)
+        if arrow_type is None:
+            columns.append(pa.array([_to_string(value) for value in values], pa.string()))
+        elif pa.types.is_timestamp(arrow_type):
+            columns.append(cast_column(pa.array([_to_string(value) for value in values], pa.string()), arrow_type))
+        else:
+            columns.append(pa.array(values).cast(arrow_type))
+    return pa.Table.from_arrays(columns, names=column_names)
+
+
+class ParquetDatasetWriter:
+    """
+    Writes recon line items to a Hive-partitioned Parquet dataset in Blob Storage.
+
+    Each invoice is written under {root}/billing_month=YYYY-MM/invoice_id={invoice_id}/ as one or more
+    part-NNNNN.parquet files, with typed columns and zstd compression. Readers such as DuckDB, Fabric or
+    pyarrow.dataset with hive partitioning then skip months and invoices they do not need from the path
+    alone, and read only the columns they select.
+
+    Rewriting an invoice replaces its files: the new parts are committed first, then any older part that
+    was not rewritten is deleted.
+
+    Attributes:
+        container_client (ContainerClient): The container holding the dataset.
+        root (str): The root directory of the dataset.
+        compression (str): The Parquet compression codec.
+        max_rows_per_file (int): The number of rows after which a new part file is started.
+        row_group_size (int): The number of rows per row group.
+    """
+
+    def __init__(self, container_client: ContainerClient, root: str = DEFAULT_DATASET_ROOT,
+                 compression: str = DEFAULT_COMPRESSION, max_rows_per_file: int = DEFAULT_MAX_ROWS_PER_FILE,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> None:
+        """
+        Initialize the writer.
+
+        Args:
+            container_client (ContainerClient): The container holding the dataset.
+            root (str): The root directory of the dataset.
+            compression (str): The Parquet compression codec.
+            max_rows_per_file (int): The number of rows after which a new part file is started.
+            row_group_size (int): The number of rows per row group.
+        """
+        self.container_client = container_client
+        self.root = root.strip('/')
+        self.compression = compression
+        self.max_rows_per_file = max_rows_per_file
+        self.row_group_size = row_group_size
+
+    def get_partition_path(self, billing_month: str, invoice_id: str) -> str:
+        """
+        Return the directory of an invoice, e.g. "recon_line_items/billing_month=2024-10/invoice_id=G123/".
+
+        Args:
+            billing_month (str): The billing month, as YYYY-MM.
+            invoice_id (str): The invoice ID.
+
+        Returns:
+            str: The directory, ending with a slash.
+        """
+        return f"{self.root}/billing_month={billing_month}/invoice_id={invoice_id}/"
+
+    def write_invoice(self, pages: Iterable[List[dict]], billing_month: str, invoice_id: str) -> int:
+        """
+        Write the line items of an invoice to its partition, replacing any earlier files.
+
+        Every part of every invoice has RECON_LINE_ITEM_SCHEMA: fields without a column of their own are
+        kept in the extra_fields column as a JSON object, and missing ones are null.
+
+        Args:
+            pages (Iterable[List[dict]]): The pages of line items, e.g. from iter_invoice_line_items.
+            billing_month (str): The billing month, as YYYY-MM.
+            invoice_id (str): The invoice ID.
+
+        Returns:
+            int: The number of line items written.
+        """
+        partition_path = self.get_partition_path(billing_month, invoice_id)
+        previous_files = set(self.container_client.list_blob_names(name_starts_with=partition_path))
+
+        written_files: List[str] = []
+        schema = RECON_LINE_ITEM_SCHEMA
+        blob_writer: Optional[BlockBlobWriter] = None
+        parquet_writer: Optional[pq.ParquetWriter] = None
+        file_rows = 0
+        row_count = 0
+
+        try:
+            for page in pages:
+                if not page:
+                    continue
+                table = line_items_to_table(page, RECON_LINE_ITEM_COLUMNS)
+                table = table.append_column(EXTRA_FIELDS_COLUMN, pa.array([get_extra_fields(item) for item in page], pa.string()))
+                table = table.cast(schema)
+
+                offset = 0
+                while offset < table.num_rows:
+                    if parquet_writer is None:
+                        blob_name = f"{partition_path}part-{len(written_files):05d}.parquet"
+                        blob_writer = BlockBlobWriter(self.container_client.get_blob_client(blob_name))
+                        parquet_writer = pq.ParquetWriter(blob_writer, schema, compression=self.compression)
+                        written_files.append(blob_name)
+                        file_rows = 0
+
+                    chunk = table.slice(offset, self.max_rows_per_file - file_rows)
+                    parquet_writer.write_table(chunk, row_group_size=self.row_group_size)
+                    offset += chunk.num_rows
+                    file_rows += chunk.num_rows
+                    row_count += chunk.num_rows
+
+                    if file_rows >= self.max_rows_per_file:
+                        parquet_writer.close()
+                        blob_writer.close()
+                        parquet_writer = blob_writer = None
+
+            if parquet_writer is not None:
+                parquet_writer.close()
+                blob_writer.close()
+                parquet_writer = blob_writer = None
+        except Exception:
+            if blob_writer is not None:
+                blob_writer.abort()
+            raise
+
+        for blob_name in sorted(previous_files - set(written_files)):
+            self.container_client.delete_blob(blob_name)
+
+        print(f"Wrote {row_count} line items of invoice {invoice_id} to {len(written_files)} Parquet file(s) in {partition_path}")
+        return row_count
@@ -0,0 +1,91 @@
+from typing import BinaryIO, List, Optional
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from recon_parquet import EXTRA_FIELDS_COLUMN, RECON_LINE_ITEM_COLUMNS, get_extra_fields
+
+# Line items converted to one Arrow record batch at a time.
+DEFAULT_BATCH_SIZE = 10000
+
+# Columns of the recon CSV files: the known line item fields, and every other field as JSON text.
+RECON_CSV_COLUMNS = RECON_LINE_ITEM_COLUMNS + [EXTRA_FIELDS_COLUMN]
+
+
+def _to_csv_value(value) -> Optional[str]:
+    """
+    Return a line item value as written to the CSV file, the same way pandas to_csv writes it.
+    """
+    if value is None:
+        return None
+    return str(value)
+
+
+class CsvLineItemSink:
+    """
+    Appends line items to a CSV stream as Arrow record batches, so a recon file is serialized as it is
+    produced instead of being built as one DataFrame and one string.
+
+    The columns are declared up front, since the header is written before the line items of later pages
+    and invoices are known. Fields without a column of their own, e.g. new fields from Partner Center, are
+    kept in the extra_fields column as a JSON object, as in the DuckDB warehouse. Every value is written
+    as text, the way pandas to_csv writes it, and missing values are left empty.
+
+    Attributes:
+        stream (BinaryIO): The stream the CSV file is written to.
+        batch_size (int): The number of line items per record batch.
+        schema (pa.Schema): The columns of the file.
+        row_count (int): The number of line items written.
+    """
+
+    def __init__(self, stream: BinaryIO, column_names: List[str] = RECON_CSV_COLUMNS,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        """
+        Initialize the sink.
+
+        Args:
+            stream (BinaryIO): The stream the CSV file is written to, left open by close.
+            column_names (List[str]): The columns of the file, in order, ending with the extra_fields column.
+            batch_size (int): The number of line items per record batch.
+        """
+        self.stream = stream
+        self.batch_size = batch_size
+        self.schema = pa.schema([pa.field(name, pa.string()) for name in column_names])
+        self.row_count = 0
+        self._writer: Optional[pa_csv.CSVWriter] = None
+        self._field_names = [name for name in column_names if name != EXTRA_FIELDS_COLUMN]
+
+    def write(self, line_items: List[dict]) -> None:
+        """
+        Append line items to the CSV file.
+
+        Args:
+            line_items (List[dict]): The line items, e.g. one invoice or one page of an invoice.
+        """
+        for start in range(0, len(line_items), self.batch_size):
+            batch = self._to_record_batch(line_items[start:start + self.batch_size])
+            if self._writer is None:
+                self._writer = pa_csv.CSVWriter(self.stream, self.schema)
+            self._writer.write_batch(batch)
+            self.row_count += batch.num_rows
+
+    def close(self) -> int:
+        """
+        Finish the CSV file.
+
+        Returns:
+            int: The number of line items written.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return self.row_count
+
+    def _to_record_batch(self, line_items: List[dict]) -> pa.RecordBatch:
+        columns = []
+        for name in self.schema.names:
+            if name == EXTRA_FIELDS_COLUMN:
+                values = [get_extra_fields(item, self._field_names) for item in line_items]
+            else:
+                values = [_to_csv_value(item.get(name)) for item in line_items]
+            columns.append(pa.array(values, pa.string()))
+        return pa.RecordBatch.from_arrays(columns, schema=self.schema)
+
@@ -1,4 +1,4 @@
-from typing import Dict, Any
+from typing import Dict, Any, List
 import json
 
 class ResourceLocationParser:
@@ -36,20 +36,40 @@ class ResourceLocationParser:
             'blobName': self.resource_location.get('blobs', [{}])[0].get('name')
         }
         return parsed_resources
+
+    def parse_blob_names(self) -> List[str]:
+        """
+        Return the names of every blob in the resource location.
+
+        Large exports are split across several part files, all of which must be ingested.
+
+        Returns:
+            List[str]: The blob names, in the order listed in the 'blobs' attribute.
+
+        Raises:
+            ValueError: If the number of blobs does not match the reported 'blobCount'.
+        """
+        blob_names = [blob.get('name') for blob in self.resource_location.get('blobs', []) if blob.get('name')]
+
+        blob_count = self.resource_location.get('blobCount')
+        if blob_count is not None and int(blob_count) != len(blob_names):
+            raise ValueError(f"Resource location reports {blob_count} blobs but lists {len(blob_names)}.")
+
+        return blob_names
     
     def __repr__(self) -> str:
         """
         Return a string representation of the ResourceLocationParser instance.
 
         Returns:
-            str: A string representation of the root directory, SAS token, and blob name.
+            str: A string representation of the root directory, SAS token, and blob names.
         """
         return f"""
         rootDirectory = {self.resource_location.get('rootDirectory')}
 
         sasToken = {self.resource_location.get('sasToken')}
         
-        blobName = {self.resource_location.get('blobs', [{}])[0].get('name')}
+        blobNames = {[blob.get('name') for blob in self.resource_location.get('blobs', [])]}
 """
 
 # Test
@@ -0,0 +1,111 @@
+import sqlite3
+from datetime import datetime, timezone
+from typing import List, Optional
+
+# SQLite database holding the row count time series.
+DEFAULT_DB_PATH = 'row_counts.db'
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS row_count_samples (
+    sampled_at TEXT NOT NULL,
+    billing_period TEXT NOT NULL,
+    export_etag TEXT,
+    export_created_at TEXT,
+    blob_count INTEGER,
+    row_count INTEGER,
+    compressed_bytes INTEGER,
+    uncompressed_bytes INTEGER,
+    export_seconds REAL,
+    count_seconds REAL,
+    skipped INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+CREATE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS row_count_samples_period_time ON row_count_samples (billing_period, sampled_at)"
+
+
+class RowCountStore:
+    """
+    Time series of the row counts of the unbilled exports, kept in a SQLite database.
+
+    Every run of the row count monitor adds one sample: the export's eTag and creation time, its row
+    count and size, and how long the export and the count took. Samples of runs that found the same
+    export as the previous run are marked as skipped and repeat its counts. The table can be queried
+    with any SQLite client, or with query, e.g.
+
+        SELECT date(sampled_at), max(row_count) FROM row_count_samples GROUP BY 1 ORDER BY 1
+
+    Attributes:
+        db_path (str): The path of the SQLite database.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH) -> None:
+        """
+        Open the database, creating the table if needed.
+
+        Args:
+            db_path (str): The path of the SQLite database.
+        """
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute(CREATE_TABLE_SQL)
+            self.connection.execute(CREATE_INDEX_SQL)
+
+    def get_last_sample(self, billing_period: str) -> Optional[dict]:
+        """
+        Return the latest sample that counted an export of a billing period.
+
+        Args:
+            billing_period (str): The billing period, e.g. 'current'.
+
+        Returns:
+            Optional[dict]: The sample, or None if there is none yet.
+        """
+        row = self.connection.execute(
+            "SELECT * FROM row_count_samples WHERE billing_period = ? AND skipped = 0 ORDER BY sampled_at DESC LIMIT 1",
+            (billing_period,)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, billing_period: str, export_etag: Optional[str], export_created_at: Optional[str],
+               blob_count: int, row_count: int, compressed_bytes: int, uncompressed_bytes: int,
+               export_seconds: float, count_seconds: float, skipped: bool = False) -> None:
+        """
+        Add a sample.
+
+        Args:
+            billing_period (str): The billing period, e.g. 'current'.
+            export_etag (Optional[str]): The eTag of the export.
+            export_created_at (Optional[str]): The createdDateTime of the export.
+            blob_count (int): The number of blobs of the export.
+            row_count (int): The number of rows of the export.
+            compressed_bytes (int): The size of the export as downloaded.
+            uncompressed_bytes (int): The size of the export once decompressed.
+            export_seconds (float): The time taken by the export request and polling.
+            count_seconds (float): The time taken to download and count the export, 0 when skipped.
+            skipped (bool): Whether the export was the same as the previous one and was not counted again.
+        """
+        sampled_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO row_count_samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (sampled_at, billing_period, export_etag, export_created_at, blob_count, row_count, compressed_bytes,
+                 uncompressed_bytes, round(export_seconds, 3), round(count_seconds, 3), int(skipped)))
+        print(f"Recorded row count {row_count} of the {billing_period} export at {sampled_at}{' (unchanged)' if skipped else ''}.")
+
+    def query(self, sql: str, parameters: tuple = ()) -> List[dict]:
+        """
+        Run a query on the time series.
+
+        Args:
+            sql (str): The query.
+            parameters (tuple): The query parameters.
+
+        Returns:
+            List[dict]: The result rows.
+        """
+        return [dict(row) for row in self.connection.execute(sql, parameters).fetchall()]
+
+    def close(self) -> None:
+        self.connection.close()
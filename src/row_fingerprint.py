@@ -0,0 +1,141 @@
+import os
+from datetime import datetime
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Columns identifying a daily-rated usage row.
+BUSINESS_KEY_FIELDS = [
+    "CustomerId",
+    "SubscriptionId",
+    "EntitlementId",
+    "ProductId",
+    "SkuId",
+    "AvailabilityId",
+    "MeterId",
+    "ResourceURI",
+    "ResourceLocation",
+    "ConsumedService",
+    "ChargeType",
+    "UsageDate",
+    "billing_month",
+]
+
+# Columns whose change makes a row count as updated.
+AMOUNT_FIELDS = [
+    "Quantity",
+    "UnitPrice",
+    "EffectiveUnitPrice",
+    "BillingPreTaxTotal",
+    "PricingPreTaxTotal",
+    "PCToBCExchangeRate",
+    "PartnerEarnedCreditPercentage",
+    "CreditPercentage",
+]
+
+FINGERPRINT_FIELDS = BUSINESS_KEY_FIELDS + AMOUNT_FIELDS
+
+# Odd 64-bit constant used to tell apart identical rows by their occurrence number.
+OCCURRENCE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def hash_rows(table: pa.Table, fields: List[str] = FINGERPRINT_FIELDS) -> np.ndarray:
+    """
+    Compute a stable 64-bit hash per row over the given columns, without per-row Python objects.
+
+    Args:
+        table (pa.Table): The rows to hash.
+        fields (List[str]): The columns included in the hash.
+
+    Returns:
+        np.ndarray: One uint64 hash per row, in row order.
+    """
+    frame = table.select(fields).to_pandas()
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy(dtype=np.uint64)
+
+
+def assign_fingerprints(row_hashes: np.ndarray) -> np.ndarray:
+    """
+    Turn row hashes into fingerprints that are unique within a snapshot.
+
+    Rows with the same hash are interchangeable, so the n-th occurrence of a hash is mixed with n.
+    This keeps duplicated rows apart while staying independent of the row order.
+
+    Args:
+        row_hashes (np.ndarray): The uint64 row hashes from hash_rows.
+
+    Returns:
+        np.ndarray: One uint64 fingerprint per row, in row order.
+    """
+    order = np.argsort(row_hashes, kind="stable")
+    sorted_hashes = row_hashes[order]
+
+    positions = np.arange(len(sorted_hashes))
+    run_starts = np.ones(len(sorted_hashes), dtype=bool)
+    run_starts[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+    occurrences = positions - np.maximum.accumulate(np.where(run_starts, positions, 0))
+
+    fingerprints = np.empty_like(row_hashes)
+    fingerprints[order] = sorted_hashes ^ (occurrences.astype(np.uint64) * OCCURRENCE_MULTIPLIER)
+    return fingerprints
+
+
+class FingerprintStore:
+    """
+    Keeps the sorted fingerprints of the last loaded snapshot of each billing month on local disk.
+
+    Each billing month is stored as a .npy file holding a sorted uint64 array, 8 bytes per row.
+
+    Attributes:
+        state_dir (str): The directory holding the fingerprint files.
+        table_id (str): The BigQuery table the fingerprints describe.
+    """
+
+    def __init__(self, state_dir: str, table_id: str) -> None:
+        """
+        Initialize the store, creating the state directory if needed.
+
+        Args:
+            state_dir (str): The directory holding the fingerprint files.
+            table_id (str): The BigQuery table the fingerprints describe.
+        """
+        self.state_dir = state_dir
+        self.table_id = table_id
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _get_path(self, billing_month: str) -> str:
+        billing_month_date = datetime.strptime(billing_month, "%Y-%m-%d").date()
+        return os.path.join(self.state_dir, f"{self.table_id}_{billing_month_date:%Y%m}.npy")
+
+    def load(self, billing_month: str) -> Optional[np.ndarray]:
+        """
+        Load the fingerprints of the previous snapshot of a billing month.
+
+        Args:
+            billing_month (str): The billing month formatted as "YYYY-MM-DD".
+
+        Returns:
+            Optional[np.ndarray]: The sorted uint64 fingerprints, or None if the month was never loaded.
+        """
+        path = self._get_path(billing_month)
+        if not os.path.exists(path):
+            return None
+        return np.load(path)
+
+    def save(self, billing_month: str, fingerprints: np.ndarray) -> None:
+        """
+        Replace the stored fingerprints of a billing month.
+
+        The file is written next to the old one and renamed over it, so a crash never leaves a partial file.
+
+        Args:
+            billing_month (str): The billing month formatted as "YYYY-MM-DD".
+            fingerprints (np.ndarray): The uint64 fingerprints of the snapshot that was loaded.
+        """
+        path = self._get_path(billing_month)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, np.sort(fingerprints))
+        os.replace(temp_path, path)
+        print(f"Saved {len(fingerprints)} fingerprints to {path}.")
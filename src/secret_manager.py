@@ -24,9 +24,16 @@ class SecretsManager:
             self.fabric_server = os.getenv('FABRIC_SERVER')
             self.fabric_client_id = os.getenv('FABRIC_CLIENT_ID')
             self.fabric_client_secret = os.getenv('FABRIC_CLIENT_SECRET')
+            self.fabric_trigger_url = os.getenv('FABRIC_TRIGGER_URL')
+            self.fabric_status_url = os.getenv('FABRIC_STATUS_URL')
             self.blob_container_name = os.getenv('BLOB_CONTAINER_NAME')
             self.blob_directory_name = os.getenv('BLOB_DIRECTORY_NAME')
             self.blob_connection_string = os.getenv('BLOB_CONNECTION_STRING')
+            self.token_cache_file = os.getenv('TOKEN_CACHE_FILE')
+            self.polling_history_file = os.getenv('POLLING_HISTORY_FILE')
+            self.recon_output_format = os.getenv('RECON_OUTPUT_FORMAT', 'csv').lower()
+            self.recon_full_refresh = os.getenv('RECON_FULL_REFRESH', '').lower() in ('1', 'true', 'yes')
+            self.duckdb_path = os.getenv('DUCKDB_PATH')
         else:
             print("couldnt load env.")
             return
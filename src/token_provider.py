@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from http_transport import HttpTransport, get_default_transport
+
+# Tokens are refreshed this many seconds before they expire, so a request never goes out with a token
+# that expires on the way.
+DEFAULT_REFRESH_MARGIN = 300
+
+# Lifetime assumed when the token response has no expires_in.
+DEFAULT_TOKEN_LIFETIME = 3600
+
+# Tokens shared by every TokenProvider of the process, keyed by TokenProvider.cache_key.
+_token_cache: Dict[Tuple[str, ...], dict] = {}
+_token_cache_lock = threading.Lock()
+
+# One lock per cache key, so concurrent callers wait for a single token request instead of each sending one.
+_refresh_locks: Dict[Tuple[str, ...], threading.Lock] = {}
+
+
+class TokenProvider:
+    """
+    Obtains OAuth access tokens from Microsoft Entra ID and caches them until shortly before they expire.
+
+    Tokens are cached in memory for the whole process, keyed by tenant, client and scope, so every
+    client using the same credentials shares one token. With a cache_file, tokens are also kept on disk,
+    which lets short scheduled runs skip the token request while the last token is still valid. The
+    cache file holds bearer tokens and is created readable by the owner only.
+
+    Attributes:
+        tenant_id (str): The tenant ID for the Azure Active Directory.
+        client_id (str): The client ID for the Azure app.
+        scope (str): The scope of the access required.
+        resource (Optional[str]): The resource, for the v1 token endpoint.
+        token_url (str): The token endpoint.
+        cache_file (Optional[str]): The path of the on-disk token cache.
+        refresh_margin (int): The number of seconds before expiry at which a token is refreshed.
+        token_requests (int): The number of token requests sent by this provider.
+    """
+
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str, scope: str, resource: Optional[str] = None,
+                 refresh_token: Optional[str] = None, token_url: Optional[str] = None, cache_file: Optional[str] = None,
+                 refresh_margin: int = DEFAULT_REFRESH_MARGIN, transport: Optional[HttpTransport] = None) -> None:
+        """
+        Initialize the TokenProvider with the app credentials.
+
+        Args:
+            tenant_id (str): The tenant ID for the Azure Active Directory.
+            client_id (str): The client ID for the Azure app.
+            client_secret (str): The client secret for the Azure app.
+            scope (str): The scope of the access required.
+            resource (Optional[str]): The resource, for the v1 token endpoint.
+            refresh_token (Optional[str]): A refresh token, to use the refresh_token grant instead of client_credentials.
+            token_url (Optional[str]): The token endpoint. Defaults to the v2 endpoint of the tenant.
+            cache_file (Optional[str]): The path of the on-disk token cache. Defaults to in-memory caching only.
+            refresh_margin (int): The number of seconds before expiry at which a token is refreshed.
+            transport (Optional[HttpTransport]): The HTTP transport. Defaults to the shared transport.
+        """
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.resource = resource
+        self.refresh_token = refresh_token
+        self.token_url = token_url or f'https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token'
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        self.transport = transport or get_default_transport()
+        self.token_requests = 0
+
+    @property
+    def cache_key(self) -> Tuple[str, ...]:
+        return (self.token_url, self.tenant_id, self.client_id, self.scope, self.resource or '')
+
+    def get_token(self, force_refresh: bool = False) -> str:
+        """
+        Return a valid access token, requesting a new one only if the cached one is about to expire.
+
+        Args:
+            force_refresh (bool): Ignore the cached token, e.g. after the API rejected it with a 401.
+
+        Returns:
+            str: The access token.
+
+        Raises:
+            Exception: If authentication fails due to invalid credentials or other errors.
+        """
+        if not force_refresh:
+            token = self._get_cached_token()
+            if token:
+                return token
+
+        with _token_cache_lock:
+            refresh_lock = _refresh_locks.setdefault(self.cache_key, threading.Lock())
+
+        with refresh_lock:
+            # Another thread may have refreshed the token while this one was waiting
+            if not force_refresh:
+                token = self._get_cached_token()
+                if token:
+                    return token
+
+            token_data = self._request_token()
+            with _token_cache_lock:
+                _token_cache[self.cache_key] = token_data
+            if self.cache_file:
+                self._save_to_disk(token_data)
+            return token_data['access_token']
+
+    def invalidate(self) -> None:
+        """
+        Drop the cached token, so the next get_token call requests a new one.
+        """
+        with _token_cache_lock:
+            _token_cache.pop(self.cache_key, None)
+
+    def _get_cached_token(self) -> Optional[str]:
+        """
+        Return the cached token if it is valid for at least refresh_margin seconds, checking memory then disk.
+        """
+        with _token_cache_lock:
+            token_data = _token_cache.get(self.cache_key)
+
+        if token_data is None and self.cache_file:
+            token_data = self._load_from_disk()
+            if token_data is not None:
+                with _token_cache_lock:
+                    _token_cache.setdefault(self.cache_key, token_data)
+
+        if token_data and token_data['expires_at'] - self.refresh_margin > time.time():
+            return token_data['access_token']
+        return None
+
+    def _request_token(self) -> dict:
+        """
+        Request a new token from the token endpoint.
+
+        Returns:
+            dict: The access token and the epoch time at which it expires.
+
+        Raises:
+            Exception: If authentication fails due to invalid credentials or other errors.
+        """
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded'
+        }
+        body = {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'scope': self.scope
+        }
+        if self.resource:
+            body['resource'] = self.resource
+        if self.refresh_token:
+            body['grant_type'] = 'refresh_token'
+            body['refresh_token'] = self.refresh_token
+
+        requested_at = time.time()
+        response = self.transport.post(self.token_url, data=body, headers=headers, idempotent=True)
+        self.token_requests += 1
+        if response.status_code != 200:
+            raise Exception(f"Failed to authenticate: {response.status_code}, {response.content}")
+
+        token_data = response.json()
+        if token_data.get('refresh_token'):
+            # Refresh tokens are rotated, the next request must use the new one
+            self.refresh_token = token_data['refresh_token']
+
+        expires_in = int(token_data.get('expires_in', DEFAULT_TOKEN_LIFETIME))
+        print(f"Token retrieved successfully, valid for {expires_in} seconds.")
+        return {
+            'access_token': token_data['access_token'],
+            'expires_at': requested_at + expires_in
+        }
+
+    def _get_disk_key(self) -> str:
+        return hashlib.sha256('|'.join(self.cache_key).encode('utf-8')).hexdigest()
+
+    def _load_from_disk(self) -> Optional[dict]:
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f).get(self._get_disk_key())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save_to_disk(self, token_data: dict) -> None:
+        """
+        Add a token to the on-disk cache, replacing the file atomically.
+        """
+        try:
+            with open(self.cache_file, 'r') as f:
+                tokens = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            tokens = {}
+
+        # Drop expired tokens of other keys while the file is rewritten
+        now = time.time()
+        tokens = {key: value for key, value in tokens.items() if value.get('expires_at', 0) > now}
+        tokens[self._get_disk_key()] = token_data
+
+        temp_file = f"{self.cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tokens, f)
+        os.replace(temp_file, self.cache_file)
+
+    def __repr__(self) -> str:
+        return f"TokenProvider(tenant_id={self.tenant_id!r}, client_id={self.client_id!r}, scope={self.scope!r})"